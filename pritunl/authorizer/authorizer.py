@@ -18,6 +18,48 @@ import base64
 import pymongo
 
 _states = tunldb.TunlDB()
+_whitelist = None
+_whitelist_networks = None
+_whitelist_lock = threading.Lock()
+
+def _get_whitelist():
+    global _whitelist
+    global _whitelist_networks
+
+    whitelist = _whitelist
+    if whitelist is not None:
+        return whitelist
+
+    _whitelist_lock.acquire()
+    try:
+        if _whitelist is not None:
+            return _whitelist
+
+        networks = list(settings.app.sso_whitelist or [])
+        whitelist = utils.NetworkTrie()
+
+        for network_str in networks:
+            try:
+                whitelist.add(ipaddress.ip_network(network_str))
+            except (ipaddress.AddressValueError, ValueError):
+                logger.warning('Invalid whitelist network', 'authorize',
+                    network=network_str,
+                )
+
+        _whitelist_networks = networks
+        _whitelist = whitelist
+    finally:
+        _whitelist_lock.release()
+
+    return whitelist
+
+def _on_settings():
+    global _whitelist
+
+    if (settings.app.sso_whitelist or []) != _whitelist_networks:
+        _whitelist = None
+
+settings.add_callback(_on_settings)
 
 class Authorizer(object):
     def __init__(self, svr, usr, clients, mode, stage, remote_ip, platform,
@@ -223,14 +265,9 @@ class Authorizer(object):
 
     def _check_token(self):
         if settings.app.sso_client_cache and self.server_auth_token:
-            doc = self.sso_client_cache_collection.find_one({
-                'user_id': self.user.id,
-                'server_id': self.server.id,
-                'device_id': self.device_id,
-                'device_name': self.device_name,
-                'auth_token': self.server_auth_token,
-            })
-            if doc:
+            if sso.check_client_cache(self.user.id, self.server.id,
+                    self.device_id, self.device_name,
+                    self.server_auth_token):
                 self.has_token = True
 
     def _check_fw_token(self):
@@ -309,18 +346,8 @@ class Authorizer(object):
         if settings.app.sso_whitelist:
             remote_ip = ipaddress.ip_address(self.remote_ip)
 
-            for network_str in settings.app.sso_whitelist:
-                try:
-                    network = ipaddress.ip_network(network_str)
-                except (ipaddress.AddressValueError, ValueError):
-                    logger.warning('Invalid whitelist network', 'authorize',
-                        network=network_str,
-                    )
-                    continue
-
-                if remote_ip in network:
-                    self.whitelisted = True
-                    break
+            if _get_whitelist().contains(remote_ip):
+                self.whitelisted = True
 
     def _update_token(self):
         if settings.app.sso_client_cache and self.server_auth_token and \
@@ -332,19 +359,13 @@ class Authorizer(object):
                 factors=self.modes,
             )
 
-            self.sso_client_cache_collection.replace_one({
-                'user_id': self.user.id,
-                'server_id': self.server.id,
-                'device_id': self.device_id,
-                'device_name': self.device_name,
-            }, {
-                'user_id': self.user.id,
-                'server_id': self.server.id,
-                'device_id': self.device_id,
-                'device_name': self.device_name,
-                'auth_token': self.server_auth_token,
-                'timestamp': utils.now(),
-            }, upsert=True)
+            sso.update_client_cache(
+                self.user.id,
+                self.server.id,
+                self.device_id,
+                self.device_name,
+                self.server_auth_token,
+            )
 
     def _check_auth_data(self):
         if not self.auth_token and not self.auth_nonce and \
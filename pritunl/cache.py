@@ -4,14 +4,30 @@ from pritunl import utils
 from pritunl import logger
 from pritunl import database
 
+import threading
+import queue
 import time
 import json
 import redis
 
 _set = set
 _client = None
+_subscribers = _set()
+_subscribers_lock = threading.Lock()
+_channels = {}
+_channels_pending = []
+_channels_removed = []
+_pubsub_thread = None
 has_cache = False
 
+class _Subscriber(object):
+    __slots__ = ('channels', 'queue', 'overflow')
+
+    def __init__(self, channels):
+        self.channels = _set(channels)
+        self.queue = queue.Queue(settings.app.redis_queue_size)
+        self.overflow = False
+
 def init():
     global _client
     global has_cache
@@ -79,6 +95,8 @@ def publish(channels, message, extra=None, cap=50, ttl=300):
     if isinstance(channels, str):
         channels = [channels]
 
+    pipe = _client.pipeline(transaction=False)
+
     for channel in channels:
         doc = {
             '_id': database.ObjectId(),
@@ -91,13 +109,13 @@ def publish(channels, message, extra=None, cap=50, ttl=300):
 
         doc = json.dumps(doc, default=utils.json_default)
 
-        pipe = _client.pipeline()
         pipe.lpush(channel, doc)
         pipe.ltrim(channel, 0, cap)
         if ttl:
             pipe.expire(channel, ttl)
         pipe.publish(channel, doc)
-        pipe.execute()
+
+    pipe.execute()
 
 def get_cursor_id(channel):
     msg = _client.lindex(channel, 0)
@@ -105,65 +123,188 @@ def get_cursor_id(channel):
         doc = json.loads(msg, object_hook=utils.json_object_hook_handler)
         return doc['_id']
 
+def _dispatch(msg):
+    channel = msg['channel']
+
+    _subscribers_lock.acquire()
+    try:
+        subscribers = [x for x in _subscribers if channel in x.channels]
+    finally:
+        _subscribers_lock.release()
+
+    if not subscribers:
+        return
+
+    doc = json.loads(msg['data'],
+        object_hook=utils.json_object_hook_handler)
+    doc['channel'] = channel
+
+    for subscriber in subscribers:
+        if subscriber.overflow:
+            continue
+        try:
+            subscriber.queue.put_nowait(doc.copy())
+        except queue.Full:
+            subscriber.overflow = True
+
+def _pubsub_runner():
+    pubsub = None
+
+    while True:
+        try:
+            if pubsub is None:
+                pubsub = _client.pubsub()
+
+                _subscribers_lock.acquire()
+                try:
+                    _channels_pending[:] = list(_channels.keys())
+                    del _channels_removed[:]
+                finally:
+                    _subscribers_lock.release()
+
+            _subscribers_lock.acquire()
+            try:
+                pending = _channels_pending[:]
+                del _channels_pending[:]
+                removed = _channels_removed[:]
+                del _channels_removed[:]
+            finally:
+                _subscribers_lock.release()
+
+            if removed:
+                pubsub.unsubscribe(*removed)
+            if pending:
+                pubsub.subscribe(*pending)
+
+            msg = pubsub.get_message(timeout=0.1)
+            if not msg:
+                continue
+
+            if msg['type'] == 'message':
+                _dispatch(msg)
+            elif msg['type'] == 'subscribe':
+                subscribed = _channels.get(msg['channel'])
+                if subscribed:
+                    subscribed.set()
+        except:
+            logger.exception('Error in redis subscription', 'cache')
+
+            if pubsub:
+                try:
+                    pubsub.close()
+                except:
+                    pass
+                pubsub = None
+
+            time.sleep(0.5)
+
+def _add_subscriber(subscriber):
+    global _pubsub_thread
+
+    events = []
+
+    _subscribers_lock.acquire()
+    try:
+        _subscribers.add(subscriber)
+
+        for channel in subscriber.channels:
+            subscribed = _channels.get(channel)
+            if not subscribed:
+                subscribed = threading.Event()
+                _channels[channel] = subscribed
+                if channel in _channels_removed:
+                    # Unsubscribe not sent yet, still subscribed
+                    _channels_removed.remove(channel)
+                    subscribed.set()
+                else:
+                    _channels_pending.append(channel)
+            events.append(subscribed)
+
+        if _pubsub_thread is None:
+            _pubsub_thread = threading.Thread(name="CachePubSub",
+                target=_pubsub_runner)
+            _pubsub_thread.daemon = True
+            _pubsub_thread.start()
+    finally:
+        _subscribers_lock.release()
+
+    return events
+
+def _remove_subscriber(subscriber):
+    _subscribers_lock.acquire()
+    try:
+        _subscribers.discard(subscriber)
+
+        # Unsubscribe channels from the shared pubsub once their last
+        # subscriber leaves
+        channels = _set(subscriber.channels)
+        for other in _subscribers:
+            channels -= other.channels
+            if not channels:
+                break
+
+        for channel in channels:
+            _channels.pop(channel, None)
+            if channel in _channels_pending:
+                _channels_pending.remove(channel)
+            else:
+                _channels_removed.append(channel)
+    finally:
+        _subscribers_lock.release()
+
+def _get_history(channel, cursor_id):
+    # Channel lists are trimmed on publish, read the full list at once
+    past = []
+
+    for msg in _client.lrange(channel, 0, -1):
+        doc = json.loads(
+            msg,
+            object_hook=utils.json_object_hook_handler,
+        )
+        if doc['_id'] == cursor_id:
+            return past
+        doc['channel'] = channel
+        past.append(doc)
+
 @interrupter_generator
 def subscribe(channels, cursor_id=None, timeout=None, yield_delay=None,
         yield_app_server=False):
-    if timeout:
-        get_timeout = 0.5
-        start_time = time.time()
-    else:
-        get_timeout = None
-
+    start_time = time.time()
     duplicates = None
-    yield_stop = False
-    pubsub = _client.pubsub()
 
-    try:
-        if isinstance(channels, str):
-            channels = [channels]
+    if isinstance(channels, str):
+        channels = [channels]
 
-        for channel in channels:
-            pubsub.subscribe(channel)
+    if cursor_id and len(channels) > 1:
+        raise TypeError(
+            'Cannot specify cursor_id with multiple channels')
+
+    # Subscribers in the process share one pubsub connection, wait for
+    # the channels to be subscribed before reading the history so no
+    # messages are missed between the two
+    subscriber = _Subscriber(channels)
+    try:
+        for subscribed in _add_subscriber(subscriber):
+            subscribed.wait(settings.app.redis_timeout)
 
         yield
 
         if cursor_id:
-            if len(channels) > 1:
-                raise TypeError(
-                    'Cannot specify cursor_id with multiple channels')
-
-            found = False
-            past = []
-            duplicates = _set()
-            history = _client.lrange(channels[0], 0, -1)
-            for msg in history:
-                doc = json.loads(
-                    msg,
-                    object_hook=utils.json_object_hook_handler,
-                )
-                if doc['_id'] == cursor_id:
-                    found = True
-                    break
-                doc['channel'] = channels[0]
-                past.append(doc)
-                duplicates.add(doc['_id'])
-
-                yield
-
-            if found:
+            past = _get_history(channels[0], cursor_id)
+            if past:
+                duplicates = {x['_id'] for x in past}
                 for doc in reversed(past):
                     yield doc
 
         yield
 
         while True:
-            msg = pubsub.get_message(timeout=get_timeout)
-            if msg and msg['type'] == 'message':
-                yield
+            try:
+                doc = subscriber.queue.get(timeout=0.5)
+            except queue.Empty:
+                doc = None
 
-                doc = json.loads(msg['data'],
-                    object_hook=utils.json_object_hook_handler)
-                doc['channel'] = msg['channel']
+            if doc:
                 if duplicates:
                     if doc['_id'] in duplicates:
                         continue
@@ -172,17 +313,25 @@ def subscribe(channels, cursor_id=None, timeout=None, yield_delay=None,
 
                 yield doc
 
-                if yield_stop:
+                if yield_delay:
+                    try:
+                        doc = subscriber.queue.get(timeout=yield_delay)
+                    except queue.Empty:
+                        return
+
+                    if not duplicates or doc['_id'] not in duplicates:
+                        yield doc
                     return
 
-                if yield_delay:
-                    get_timeout = yield_delay
-                    yield_stop = True
-                    continue
+            # Messages were dropped for a slow subscriber, end the
+            # subscription so the caller resumes from its cursor
+            if subscriber.overflow:
+                return
 
-            if yield_stop or (yield_app_server and
-                    check_app_server_interrupt()) or (timeout and
-                    time.time() - start_time >= timeout):
+            if (yield_app_server and check_app_server_interrupt()) or \
+                    (timeout and time.time() - start_time >= timeout):
                 return
+
+            yield
     finally:
-        pubsub.close()
+        _remove_subscriber(subscriber)
@@ -1,10 +1,32 @@
 import collections
+import threading
 import re
 
-_keys = collections.defaultdict(
-    lambda: collections.defaultdict(lambda: collections.Counter()))
-_values = collections.defaultdict(
-    lambda: collections.defaultdict(lambda: set()))
+_roots = {}
+_locks = collections.defaultdict(threading.Lock)
+
+class _Node(object):
+    __slots__ = ('label', 'children', 'values')
+
+    def __init__(self, label, values=None):
+        self.label = label
+        self.children = {}
+        self.values = values
+
+def _common_len(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+def _merge(node):
+    if node.values or len(node.children) != 1:
+        return
+    child = next(iter(node.children.values()))
+    node.label += child.label
+    node.children = child.children
+    node.values = child.values
 
 class CacheTrie(object):
     __slots__ = ('name', 'key')
@@ -13,19 +35,44 @@ class CacheTrie(object):
         self.name = name
         self.key = key
 
+    def _root(self):
+        root = _roots.get(self.name)
+        if root is None:
+            root = _roots.setdefault(self.name, _Node(''))
+        return root
+
     def clear_cache(self):
-        _keys.pop(self.name, None)
-        _values.pop(self.name, None)
+        with _locks[self.name]:
+            _roots.pop(self.name, None)
 
     def add_key(self, key, value):
-        keys = _keys[self.name]
-        cur_key = self.key
-        new_key = cur_key
-        for char in key.lower():
-            new_key += char
-            keys[cur_key][new_key] += 1
-            cur_key = new_key
-        _values[self.name][cur_key].add(value)
+        key = self.key + key.lower()
+
+        with _locks[self.name]:
+            node = self._root()
+            while key:
+                child = node.children.get(key[0])
+                if child is None:
+                    child = _Node(key)
+                    node.children[key[0]] = child
+                    node = child
+                    break
+
+                label = child.label
+                common = _common_len(label, key)
+                if common < len(label):
+                    split = _Node(label[:common])
+                    child.label = label[common:]
+                    split.children[child.label[0]] = child
+                    node.children[key[0]] = split
+                    child = split
+
+                node = child
+                key = key[common:]
+
+            if node.values is None:
+                node.values = set()
+            node.values.add(value)
 
     def add_key_terms(self, key, value):
         for term in re.split('[^a-z0-9]', key.lower()):
@@ -33,45 +80,77 @@ class CacheTrie(object):
         self.add_key(key, value)
 
     def remove_key(self, key, value):
-        keys = _keys[self.name]
-        values = _values[self.name]
-        cur_key = self.key
-        new_key = cur_key
-        for char in key.lower():
-            new_key += char
-            keys[cur_key][new_key] -= 1
-            if not keys[cur_key][new_key]:
-                keys[cur_key].pop(new_key, None)
-                if not keys[cur_key]:
-                    keys.pop(cur_key, None)
-            cur_key = new_key
-        try:
-            values[cur_key].remove(value)
-        except KeyError:
-            pass
-        if not values[cur_key]:
-            values.pop(cur_key, None)
+        key = self.key + key.lower()
+
+        with _locks[self.name]:
+            node = self._root()
+            path = []
+            while key:
+                child = node.children.get(key[0])
+                if child is None or not key.startswith(child.label):
+                    return
+                path.append(node)
+                key = key[len(child.label):]
+                node = child
+
+            if node.values:
+                node.values.discard(value)
+                if not node.values:
+                    node.values = None
+
+            while path:
+                parent = path.pop()
+                if not node.values and not node.children:
+                    parent.children.pop(node.label[0], None)
+                else:
+                    _merge(node)
+                    break
+                node = parent
 
     def remove_key_terms(self, key, value):
         for term in re.split('[^a-z0-9]', key.lower()):
             self.remove_key(term, value)
         self.remove_key(key, value)
 
+    def _find(self, prefix):
+        node = _roots.get(self.name)
+        while node is not None and prefix:
+            child = node.children.get(prefix[0])
+            if child is None:
+                return
+            label = child.label
+            if prefix.startswith(label):
+                prefix = prefix[len(label):]
+            elif not label.startswith(prefix):
+                return
+            else:
+                prefix = ''
+            node = child
+        return node
+
     def chain(self, node_values):
-        name = self.name
-        key = self.key
-        keys = _keys[name]
-        values = _values[name]
-        if key in keys:
-            for node_key in keys[key]:
-                CacheTrie(name, node_key).chain(node_values)
-        if key in values:
-            node_values.update(values[key])
+        node_values.update(self.iter_prefix(''))
         return node_values
 
-    def get_prefix(self, prefix):
-        return CacheTrie(self.name, prefix.lower()).chain(set())
+    def get_prefix(self, prefix, limit=None):
+        return set(self.iter_prefix(prefix, limit))
+
+    def iter_prefix(self, prefix, limit=None):
+        with _locks[self.name]:
+            node = self._find(self.key + prefix.lower())
+            stack = [node] if node is not None else []
+
+        seen = set()
+        while stack:
+            with _locks[self.name]:
+                node = stack.pop()
+                values = list(node.values) if node.values else ()
+                stack.extend(node.children.values())
 
-    def iter_prefix(self, prefix):
-        for value in CacheTrie(self.name, prefix.lower()).chain(set()):
-            yield value
+            for value in values:
+                if value in seen:
+                    continue
+                seen.add(value)
+                yield value
+                if limit and len(seen) >= limit:
+                    return
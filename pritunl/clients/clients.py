@@ -1,5 +1,6 @@
 from pritunl.constants import *
 from pritunl.helpers import *
+from pritunl.clients import writer
 from pritunl import utils
 from pritunl import mongo
 from pritunl import limiter
@@ -52,7 +53,10 @@ class Clients(object):
             self.instance.is_interrupted, 512)
         self.clients_call_queue = callqueue.CallQueue(
             self.instance.is_interrupted)
-        self.obj_cache = objcache.ObjCache()
+        self.obj_cache = objcache.ObjCache(
+            capacity=settings.vpn.org_cache_size,
+            events=(ORGS_UPDATED, SERVER_ORGS_UPDATED),
+        )
         self.client_routes = set()
         self.client_routes6 = set()
         self.link_routes = set()
@@ -1781,6 +1785,14 @@ class Clients(object):
             return False
         return True
 
+    def ping_wg_peer(self, wg_public_key, timestamp):
+        client = self.clients.find_id(wg_public_key, view=True)
+        if not client or client.get('timestamp_wg', 0) >= timestamp:
+            return
+        self.clients.update_id(wg_public_key, {
+            'timestamp_wg': timestamp,
+        })
+
     def on_port_forwarding(self, org_id, user_id):
         client = self.clients.find({'user_id': user_id})
         if not client:
@@ -2238,7 +2250,7 @@ class Clients(object):
                 client['virt_address'].split('/')[0])
 
         try:
-            self.collection.insert_one(doc)
+            writer.insert(doc).wait()
             if self.server.route_clients:
                 messenger.publish('client', {
                     'state': True,
@@ -2390,6 +2402,7 @@ class Clients(object):
             return
 
         self.clients.remove_id(client_id)
+        self.instance_com.client_bandwidth.remove(client_id)
         host.global_clients.remove({
             'instance_id': self.instance.id,
             'client_id': client_id,
@@ -2403,14 +2416,7 @@ class Clients(object):
 
         doc_id = client.get('doc_id')
         if doc_id:
-            try:
-                self.collection.delete_one({
-                    '_id': doc_id,
-                })
-            except:
-                logger.exception('Error removing client', 'server',
-                    server_id=self.server.id,
-                )
+            writer.delete(doc_id)
 
         if self.server.multi_device:
             if client['address_dynamic']:
@@ -0,0 +1,164 @@
+from pritunl import settings
+from pritunl import logger
+from pritunl import mongo
+
+import threading
+import collections
+import time
+import pymongo
+
+_queue = collections.deque()
+_cond = threading.Condition()
+_thread = None
+
+class WriteOp(object):
+    __slots__ = ('op', 'doc_id', 'wait_result', 'error', '_event')
+
+    def __init__(self, op, doc_id, wait_result):
+        self.op = op
+        self.doc_id = doc_id
+        self.wait_result = wait_result
+        self.error = None
+        self._event = threading.Event()
+
+    def done(self, error=None):
+        self.error = error
+        self._event.set()
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            timeout = settings.vpn.op_timeout
+        if not self._event.wait(timeout):
+            _cond.acquire()
+            try:
+                try:
+                    _queue.remove(self)
+                    cancelled = True
+                except ValueError:
+                    cancelled = False
+            finally:
+                _cond.release()
+
+            if cancelled:
+                raise WriteTimeout('Client write timed out')
+
+            # Already sent with a batch, wait for the result so the
+            # caller does not report a write that lands later as failed
+            self._event.wait()
+
+        if self.error:
+            raise self.error
+
+class WriteTimeout(Exception):
+    pass
+
+def _get_batch():
+    _cond.acquire()
+    try:
+        while not _queue:
+            _cond.wait()
+
+        deadline = time.time() + settings.vpn.client_write_delay / 1000.
+        batch_size = settings.vpn.client_write_batch
+        while len(_queue) < batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            _cond.wait(remaining)
+
+        batch = []
+        while _queue and len(batch) < batch_size:
+            batch.append(_queue.popleft())
+    finally:
+        _cond.release()
+
+    return batch
+
+def _fail(write_op, error):
+    if not write_op.wait_result:
+        logger.error('Error writing client', 'clients',
+            doc_id=write_op.doc_id,
+            error=str(error),
+        )
+    write_op.done(error)
+
+def _write(batch):
+    # Ordered so a disconnect queued after its connect is applied after it,
+    # a failed op is acknowledged with its error and the rest are retried
+    while batch:
+        try:
+            collection = mongo.get_collection('clients')
+            collection.bulk_write([x.op for x in batch], ordered=True)
+        except pymongo.errors.BulkWriteError as error:
+            write_errors = error.details.get('writeErrors')
+            if not write_errors:
+                for write_op in batch:
+                    _fail(write_op, error)
+                return
+
+            write_error = write_errors[0]
+            index = write_error['index']
+            for write_op in batch[:index]:
+                write_op.done()
+            _fail(batch[index], pymongo.errors.OperationFailure(
+                write_error.get('errmsg'),
+                write_error.get('code'),
+                write_error,
+            ))
+            batch = batch[index + 1:]
+            continue
+        except Exception as error:
+            logger.exception('Error writing client batch', 'clients',
+                count=len(batch),
+            )
+            for write_op in batch:
+                _fail(write_op, error)
+            return
+
+        for write_op in batch:
+            write_op.done()
+        return
+
+def _writer_thread():
+    while True:
+        batch = []
+        try:
+            batch = _get_batch()
+            _write(batch)
+        except Exception as error:
+            logger.exception('Error in clients writer thread', 'clients')
+            for write_op in batch:
+                if not write_op._event.is_set():
+                    _fail(write_op, error)
+            time.sleep(0.5)
+
+def _put(op, doc_id, wait_result):
+    global _thread
+
+    write_op = WriteOp(op, doc_id, wait_result)
+
+    _cond.acquire()
+    try:
+        if _thread is None:
+            _thread = threading.Thread(name="ClientsWriter",
+                target=_writer_thread)
+            _thread.daemon = True
+            _thread.start()
+
+        _queue.append(write_op)
+        if len(_queue) == 1 or \
+                len(_queue) >= settings.vpn.client_write_batch:
+            _cond.notify()
+    finally:
+        _cond.release()
+
+    return write_op
+
+def insert(doc):
+    return _put(pymongo.InsertOne(doc), doc.get('_id'), True)
+
+def delete(doc_id):
+    # Not waited on by the caller, errors are logged by the writer
+    return _put(pymongo.DeleteOne({
+        '_id': doc_id,
+    }), doc_id, False)
@@ -1,131 +1,125 @@
 import threading
 import collections
+import types
 import bson
 import copy
 
+class _Record(object):
+    __slots__ = ('doc',)
+
+    def __init__(self, doc):
+        self.doc = doc
+
 class DocDb(object):
-    def __init__(self, *indexes):
+    # Stored documents are never modified in place. Writes replace the
+    # record document so view reads can share it without a deep copy,
+    # other reads return a deep copy the caller can modify.
+
+    def __init__(self, *indexes, **kwargs):
         self._indexes = set()
         self._index = {}
         self._lock = threading.RLock()
         self._docs = {}
+        self._stats = kwargs.get('stats', False)
+        self.lookups = 0
+        self.scans = 0
+        self.copies = 0
 
         for ind in indexes:
             self._indexes.add(ind)
             self._index[ind] = collections.defaultdict(set)
 
-    def _find(self, query, slow=False, only_id=False):
-        need = len(query)
-        possible = {}
-        found = []
+    def _output(self, record, view):
+        if view:
+            return types.MappingProxyType(record.doc)
+        if self._stats:
+            self.copies += 1
+        return copy.deepcopy(record.doc)
+
+    def _match(self, doc, query):
+        for key, val in query.items():
+            if doc.get(key) != val:
+                return False
+        return True
 
+    def _find_ids(self, query, slow=False):
+        query = dict(query)
+        if self._stats:
+            self.lookups += 1
+
+        if 'id' in query:
+            record = self._docs.get(query.pop('id'))
+            if record is None or not self._match(record.doc, query):
+                return []
+            return [record.doc['id']]
+
+        candidates = None
+        for index_key in self._indexes:
+            if index_key not in query:
+                continue
+
+            val = query[index_key]
+            doc_ids = self._index[index_key].get(val)
+            if not doc_ids:
+                return []
+
+            if candidates is None or len(doc_ids) < len(candidates[1]):
+                candidates = (index_key, doc_ids)
+
+        if candidates is None:
+            if not slow:
+                raise IndexError('Non indexed query')
+            if self._stats:
+                self.scans += 1
+            doc_ids = self._docs.keys()
+        else:
+            query.pop(candidates[0])
+            doc_ids = candidates[1]
+
+        if not query:
+            return list(doc_ids)
+
+        docs = self._docs
+        return [x for x in doc_ids if self._match(docs[x].doc, query)]
+
+    def _find(self, query, slow=False, only_id=False, view=False):
         self._lock.acquire()
         try:
-            checked_count = 0
-            if 'id' in query:
-                checked_count += 1
-                doc_id = query['id']
-                query.pop('id')
-
-                if doc_id in self._docs:
-                    matched = possible.get(doc_id, 0) + 1
-                    possible[doc_id] = matched
-                    if matched == need:
-                        if only_id:
-                            found.append(doc_id)
-                        else:
-                            doc = copy.deepcopy(self._docs[doc_id])
-                            doc['id'] = doc_id
-                            found.append(doc)
-
-                if len(query) == 0:
-                    return found
-
-            for index_key in list(self._index.keys()):
-                if index_key in query:
-                    checked_count += 1
-                    val = query[index_key]
-                    query.pop(index_key)
-
-                    index = self._index[index_key]
-                    if val in index:
-                        for doc_id in index[val]:
-                            matched = possible.get(doc_id, 0) + 1
-                            possible[doc_id] = matched
-                            if matched == need:
-                                if only_id:
-                                    found.append(doc_id)
-                                else:
-                                    doc = copy.deepcopy(self._docs[doc_id])
-                                    doc['id'] = doc_id
-                                    found.append(doc)
-
-            if not checked_count:
-                if not slow:
-                    raise IndexError('Non indexed query')
-
-                for doc_id, doc in list(self._docs.items()):
-                    match = True
-                    for key, val in list(query.items()):
-                        if doc.get(key) != val:
-                            match = False
-                            break
-                    if match:
-                        if only_id:
-                            found.append(doc_id)
-                        else:
-                            doc = copy.deepcopy(doc)
-                            doc['id'] = doc_id
-                            found.append(doc)
-            elif checked_count != need:
-                for doc_id, matched in list(possible.items()):
-                    if matched != checked_count:
-                        continue
-                    doc = self._docs[doc_id]
-                    match = True
-                    for key, val in list(query.items()):
-                        if doc.get(key) != val:
-                            match = False
-                            break
-                    if match:
-                        if only_id:
-                            found.append(doc_id)
-                        else:
-                            doc = copy.deepcopy(doc)
-                            doc['id'] = doc_id
-                            found.append(doc)
+            doc_ids = self._find_ids(query, slow)
+            if only_id:
+                return doc_ids
+            return [self._output(self._docs[x], view) for x in doc_ids]
         finally:
             self._lock.release()
 
-        return found
-
-    def find_all(self):
-        found = []
-
-        for doc_id, doc in list(self._docs.items()):
-            doc = copy.deepcopy(doc)
-            doc['id'] = doc_id
-            found.append(doc)
-
-        return found
+    def find_all(self, view=False):
+        self._lock.acquire()
+        try:
+            return [self._output(x, view) for x in self._docs.values()]
+        finally:
+            self._lock.release()
 
-    def find(self, query, slow=False):
-        return self._find(query, slow)
+    def find(self, query, slow=False, view=False):
+        return self._find(query, slow, view=view)
 
-    def find_id(self, doc_id):
+    def find_id(self, doc_id, view=False):
         self._lock.acquire()
         try:
-            doc = self._docs.get(doc_id)
-            if doc:
-                doc = copy.deepcopy(doc)
-                doc['id'] = doc_id
-                return doc
+            if self._stats:
+                self.lookups += 1
+            record = self._docs.get(doc_id)
+            if record:
+                return self._output(record, view)
         finally:
             self._lock.release()
 
     def insert(self, doc, upsert=False):
         doc_copy = copy.deepcopy(doc)
-        doc_id = doc_copy.pop('id', bson.ObjectId())
+        if 'id' in doc_copy:
+            doc_id = doc_copy.pop('id')
+        else:
+            doc_id = bson.ObjectId()
+        doc_copy['id'] = doc_id
         doc['id'] = doc_id
 
         self._lock.acquire()
@@ -135,40 +129,46 @@ class DocDb(object):
             elif doc_id in self._docs:
                 raise KeyError('Doc id already exists')
 
-            for index_key, index in list(self._index.items()):
+            for index_key, index in self._index.items():
                 val = doc_copy.get(index_key)
                 index[val].add(doc_id)
 
-            self._docs[doc_id] = doc_copy
+            self._docs[doc_id] = _Record(doc_copy)
         finally:
             self._lock.release()
 
         return doc
 
     def _update(self, doc_ids, update):
+        update = copy.deepcopy(update)
+        update.pop('id', None)
+
         for doc_id in doc_ids:
-            doc = self._docs[doc_id]
+            record = self._docs[doc_id]
+            doc = record.doc
 
-            for key, val in list(update.items()):
+            for key, val in update.items():
                 if key in self._indexes:
                     index = self._index[key]
 
                     cur_val = doc.get(key)
                     val_index = index[cur_val]
-                    val_index.remove(doc_id)
+                    val_index.discard(doc_id)
                     if len(val_index) == 0:
                         index.pop(cur_val)
 
                     index[val].add(doc_id)
 
-                doc[key] = val
+            new_doc = dict(doc)
+            new_doc.update(update)
+            record.doc = new_doc
 
     def count(self, query, slow=False):
         self._lock.acquire()
         try:
             if not query:
                 return len(self._docs)
-            doc_ids = self._find(query, slow, True)
+            doc_ids = self._find_ids(query, slow)
         finally:
             self._lock.release()
 
@@ -187,7 +187,7 @@ class DocDb(object):
     def update(self, query, update, slow=False):
         self._lock.acquire()
         try:
-            doc_ids = self._find(query, slow, True)
+            doc_ids = self._find_ids(query, slow)
             self._update(doc_ids, update)
         finally:
             self._lock.release()
@@ -207,19 +207,19 @@ class DocDb(object):
 
     def _remove(self, doc_ids):
         for doc_id in doc_ids:
-            doc = self._docs.pop(doc_id)
+            doc = self._docs.pop(doc_id).doc
 
-            for index_key, index in list(self._index.items()):
+            for index_key, index in self._index.items():
                 val = doc.get(index_key)
                 val_index = index[val]
-                val_index.remove(doc_id)
+                val_index.discard(doc_id)
                 if len(val_index) == 0:
                     index.pop(val)
 
     def remove(self, query, slow=False):
         self._lock.acquire()
         try:
-            doc_ids = self._find(query, slow, True)
+            doc_ids = self._find_ids(query, slow)
             self._remove(doc_ids)
         finally:
             self._lock.release()
@@ -234,3 +234,17 @@ class DocDb(object):
             self._remove([doc_id])
         finally:
             self._lock.release()
+
+        return True
+
+    def get_stats(self):
+        self._lock.acquire()
+        try:
+            return {
+                'docs': len(self._docs),
+                'lookups': self.lookups,
+                'scans': self.scans,
+                'copies': self.copies,
+            }
+        finally:
+            self._lock.release()
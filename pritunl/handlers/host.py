@@ -196,5 +196,9 @@ def host_usage_get(hst, period):
         resp = hst.usage.get_period_random(period)
         utils.demo_set_cache(resp)
     else:
-        resp = hst.usage.get_period(period)
+        try:
+            downsample = int(flask.request.args.get('downsample') or 0)
+        except ValueError:
+            downsample = 0
+        resp = hst.usage.get_period(period, downsample)
     return utils.jsonify(resp)
@@ -56,26 +56,6 @@ def _dns_server_invalid():
         'error_msg': DNS_SERVER_INVALID_MSG,
     }, 400)
 
-def _check_network_overlap(test_network, networks):
-    test_net = ipaddress.ip_network(test_network)
-    test_start = test_net.network_address
-    test_end = test_net.broadcast_address
-
-    for network in networks:
-        net_start = network.network_address
-        net_end = network.broadcast_address
-
-        if test_start >= net_start and test_start <= net_end:
-            return True
-        elif test_end >= net_start and test_end <= net_end:
-            return True
-        elif net_start >= test_start and net_start <= test_end:
-            return True
-        elif net_end >= test_start and net_end <= test_end:
-            return True
-
-    return False
-
 def _check_network_private(test_network):
     test_net = ipaddress.ip_network(test_network)
     test_start = test_net.network_address
@@ -152,7 +132,7 @@ def server_put_post(server_id=None):
         return utils.demo_blocked()
 
     used_resources = server.get_used_resources(server_id)
-    network_used = used_resources['networks']
+    network_used = utils.NetworkTrie(used_resources['networks'])
     port_used = used_resources['ports']
 
     name = None
@@ -603,7 +583,7 @@ def server_put_post(server_id=None):
             rand_range += rand_range_low
             for i in rand_range:
                 rand_network = '192.168.%s.0/24' % i
-                if not _check_network_overlap(rand_network, network_used):
+                if not network_used.overlaps(rand_network):
                     network = rand_network
                     break
             if not network:
@@ -623,8 +603,7 @@ def server_put_post(server_id=None):
             rand_range += rand_range_low
             for i in rand_range:
                 rand_network_wg = '192.168.%s.0/24' % i
-                if not _check_network_overlap(
-                        rand_network_wg, network_used):
+                if not network_used.overlaps(rand_network_wg):
                     network_wg = rand_network_wg
                     break
             if not network_wg:
@@ -1592,7 +1571,11 @@ def server_bandwidth_get(server_id, period):
         resp = server.bandwidth_random_get(server_id, period)
         utils.demo_set_cache(resp)
     else:
-        resp = server.bandwidth_get(server_id, period)
+        try:
+            downsample = int(flask.request.args.get('downsample') or 0)
+        except ValueError:
+            downsample = 0
+        resp = server.bandwidth_get(server_id, period, downsample)
     return utils.jsonify(resp)
 
 @app.app.route('/server/vpcs', methods=['GET'])
@@ -14,6 +14,7 @@ from pritunl import messenger
 from pritunl import ipaddress
 from pritunl import callqueue
 from pritunl import journal
+from pritunl import database
 
 import flask
 import time
@@ -43,6 +44,8 @@ def user_get(org_id, user_id=None, page=None):
 
     page = flask.request.args.get('page', page)
     page = int(page) if page else page
+    after = flask.request.args.get('after', None)
+    after = database.ParseObjectId(after) if after else None
     search = flask.request.args.get('search', None)
     sort_last_active = flask.request.args.get('last_active', None)
     limit = int(flask.request.args.get('limit', settings.user.page_count))
@@ -100,7 +103,7 @@ def user_get(org_id, user_id=None, page=None):
     else:
         query = org.iter_users(page=page, search=search,
             search_limit=limit, fields=fields,
-            sort_last_active=sort_last_active == 'true')
+            sort_last_active=sort_last_active == 'true', after=after)
 
     for usr in query:
         users_id.append(usr.id)
@@ -203,10 +206,11 @@ def user_get(org_id, user_id=None, page=None):
         if settings.app.demo_mode:
             utils.demo_set_cache(resp)
         return utils.jsonify(resp)
-    elif page is not None:
+    elif page is not None or after is not None:
         resp = {
             'page': page,
             'page_total': org.page_total,
+            'page_cursor': org.last_page_cursor,
             'server_count': server_count,
             'users': users,
         }
@@ -1,54 +1,249 @@
 from pritunl import settings
 from pritunl import mongo
 from pritunl import utils
+from pritunl import cache
+from pritunl import logger
 
 import time
 import datetime
+import threading
+import pymongo
+
+SHARDS = 16
 
 _get_time = time.time
 limiters = []
+_auth_shards = [(threading.Lock(), {}) for _ in range(SHARDS)]
+_auth_thread = None
+_auth_thread_lock = threading.Lock()
+# Counters are kept per shard and updated under the shard lock
+_auth_allowed = [0] * SHARDS
+_auth_rejected = [0] * SHARDS
+_auth_synced = 0
 
 class Limiter(object):
     def __init__(self, group_name, limit_name, limit_timeout_name):
         limiters.append(self)
-        self.peers_expire_count = {}
+        self.shards = [(threading.Lock(), {}) for _ in range(SHARDS)]
         self.group_name = group_name
         self.limit_name = limit_name
         self.limit_timeout_name = limit_timeout_name
+        self.allowed = [0] * SHARDS
+        self.rejected = [0] * SHARDS
 
     def validate(self, peer):
         settings_group = getattr(settings, self.group_name)
         limit = getattr(settings_group, self.limit_name)
         limit_timeout = getattr(settings_group, self.limit_timeout_name)
 
+        # Token bucket per peer holding up to limit tokens refilled
+        # over limit_timeout
         cur_time = _get_time()
-        expire, count = self.peers_expire_count.get(peer, (None, None))
-        if expire and cur_time <= expire:
-            if count > limit:
+        shard = hash(peer) % SHARDS
+        lock, peers = self.shards[shard]
+
+        lock.acquire()
+        try:
+            tokens, last_time = peers.get(peer, (limit, cur_time))
+            tokens = min(limit, tokens + (cur_time - last_time) *
+                limit / float(limit_timeout))
+
+            if tokens < 1:
+                peers[peer] = (tokens, cur_time)
+                self.rejected[shard] += 1
                 return False
-            self.peers_expire_count[peer] = (expire, count + 1)
-        else:
-            self.peers_expire_count[peer] = (cur_time + limit_timeout, 1)
+
+            peers[peer] = (tokens - 1, cur_time)
+            self.allowed[shard] += 1
+        finally:
+            lock.release()
+
         return True
 
-def auth_check(user_id):
-    collection = mongo.get_collection('auth_limiter')
+    def evict(self):
+        settings_group = getattr(settings, self.group_name)
+        limit_timeout = getattr(settings_group, self.limit_timeout_name)
+        cur_time = _get_time()
 
-    doc = collection.find_one_and_update({
-        '_id': user_id,
-    }, {
-        '$inc': {'count': 1},
-        '$setOnInsert': {'timestamp': utils.now()},
-    }, return_document=True, upsert=True)
-
-    if utils.now() > doc['timestamp'] + datetime.timedelta(
-            seconds=settings.app.auth_limiter_ttl):
-        doc = {
-            'count': 1,
-            'timestamp': utils.now(),
+        # Buckets idle for the full timeout are refilled and can be
+        # recreated on the next attempt
+        for lock, peers in self.shards:
+            lock.acquire()
+            try:
+                for peer, (_, last_time) in list(peers.items()):
+                    if cur_time - last_time >= limit_timeout:
+                        peers.pop(peer, None)
+            finally:
+                lock.release()
+
+    def get_stats(self):
+        return {
+            'name': self.limit_name,
+            'peers': sum(len(x[1]) for x in self.shards),
+            'allowed': sum(self.allowed),
+            'rejected': sum(self.rejected),
         }
-        collection.replace_one({
+
+class _AuthEntry(object):
+    __slots__ = ('expire', 'count', 'pending')
+
+    def __init__(self, expire):
+        self.expire = expire
+        self.count = 0
+        self.pending = 0
+
+def _auth_sync_mongo(pending):
+    collection = mongo.get_collection('auth_limiter')
+    ttl = settings.app.auth_limiter_ttl
+    now = utils.now()
+    expired = now - datetime.timedelta(seconds=ttl)
+
+    bulk = []
+    for user_id, count in pending.items():
+        bulk.append(pymongo.UpdateOne({
+            '_id': user_id,
+            'timestamp': {'$lt': expired},
+        }, {'$set': {
+            'count': 0,
+            'timestamp': now,
+        }}))
+        bulk.append(pymongo.UpdateOne({
             '_id': user_id,
-        }, doc, upsert=True)
+        }, {
+            '$inc': {'count': count},
+            '$setOnInsert': {'timestamp': now},
+        }, upsert=True))
+    collection.bulk_write(bulk, ordered=True)
+
+    counts = {}
+    for doc in collection.find({
+                '_id': {'$in': list(pending.keys())},
+            }, {
+                'count': True,
+                'timestamp': True,
+            }):
+        counts[doc['_id']] = (
+            doc['count'],
+            time.time() - (now - doc['timestamp']).total_seconds() + ttl,
+        )
+
+    return counts
+
+def _auth_sync_redis(pending):
+    ttl = settings.app.auth_limiter_ttl
+
+    pipe = cache._client.pipeline(transaction=False)
+    for user_id, count in pending.items():
+        key = 'auth_limiter:%s' % user_id
+        pipe.set(key, 0, ex=ttl, nx=True)
+        pipe.incrby(key, count)
+        pipe.ttl(key)
+    results = pipe.execute()
+
+    counts = {}
+    for i, user_id in enumerate(pending.keys()):
+        count = results[i * 3 + 1]
+        expire = results[i * 3 + 2]
+        if expire is None or expire < 0:
+            expire = ttl
+        counts[user_id] = (count, time.time() + expire)
+
+    return counts
+
+def _auth_sync():
+    global _auth_synced
+    pending = {}
+
+    for lock, entries in _auth_shards:
+        lock.acquire()
+        try:
+            cur_time = _get_time()
+            for user_id, entry in list(entries.items()):
+                if entry.pending:
+                    pending[user_id] = entry.pending
+                elif cur_time > entry.expire:
+                    entries.pop(user_id, None)
+        finally:
+            lock.release()
+
+    if not pending:
+        return
+
+    if cache.has_cache:
+        counts = _auth_sync_redis(pending)
+    else:
+        counts = _auth_sync_mongo(pending)
+
+    for lock, entries in _auth_shards:
+        lock.acquire()
+        try:
+            for user_id, (count, expire) in counts.items():
+                entry = entries.get(user_id)
+                if entry is None:
+                    continue
+                entry.pending = max(0, entry.pending - pending[user_id])
+                entry.count = count
+                entry.expire = expire
+        finally:
+            lock.release()
+
+    _auth_synced += len(pending)
+
+def _auth_sync_thread():
+    while True:
+        time.sleep(settings.app.auth_limiter_sync_rate)
+        try:
+            _auth_sync()
+        except:
+            logger.exception('Error syncing auth limiter', 'limiter')
+
+def auth_check(user_id):
+    global _auth_thread
+
+    if _auth_thread is None:
+        _auth_thread_lock.acquire()
+        try:
+            if _auth_thread is None:
+                _auth_thread = threading.Thread(name="AuthLimiterSync",
+                    target=_auth_sync_thread)
+                _auth_thread.daemon = True
+                _auth_thread.start()
+        finally:
+            _auth_thread_lock.release()
+
+    # Attempts are counted locally and merged with the attempts of other
+    # hosts by the sync thread, attempts over the limit are rejected
+    # without a database write
+    cur_time = _get_time()
+    shard = hash(user_id) % SHARDS
+    lock, entries = _auth_shards[shard]
+
+    lock.acquire()
+    try:
+        entry = entries.get(user_id)
+        if entry is None or cur_time > entry.expire:
+            entry = _AuthEntry(cur_time + settings.app.auth_limiter_ttl)
+            entries[user_id] = entry
+
+        if entry.count + entry.pending >= \
+                settings.app.auth_limiter_count_max:
+            _auth_rejected[shard] += 1
+            return False
+
+        entry.pending += 1
+        _auth_allowed[shard] += 1
+    finally:
+        lock.release()
+
+    return True
 
-    return doc['count'] <= settings.app.auth_limiter_count_max
+def get_stats():
+    return {
+        'auth': {
+            'users': sum(len(x[1]) for x in _auth_shards),
+            'allowed': sum(_auth_allowed),
+            'rejected': sum(_auth_rejected),
+            'synced': _auth_synced,
+        },
+        'peers': [x.get_stats() for x in limiters],
+    }
@@ -5,6 +5,7 @@ from pritunl import utils
 from pritunl import mongo
 from pritunl import ipaddress
 from pritunl import settings
+from pritunl.link import topology
 
 import hashlib
 import json
@@ -12,6 +13,34 @@ import datetime
 import pymongo
 import collections
 
+TOPOLOGY_HOST_FIELDS = {
+    'name',
+    'location_id',
+    'status',
+    'active',
+    'priority',
+    'backoff',
+    'static',
+    'public_address',
+    'local_address',
+    'address6',
+    'wg_public_key',
+}
+
+HEARTBEAT_HOST_FIELDS = (
+    'public_address',
+    'address6',
+    'local_address',
+    'version',
+    'status',
+    'timestamp',
+    'hosts',
+    'hosts_hist',
+    'wg_public_key',
+    'hosts_hist_timestamp',
+    'ping_timestamp_ttl',
+)
+
 class Host(mongo.MongoObject):
     fields = {
         'name',
@@ -125,6 +154,22 @@ class Host(mongo.MongoObject):
     def collection(cls):
         return mongo.get_collection('links_hosts')
 
+    def commit(self, fields=None, spec=None):
+        response = mongo.MongoObject.commit(self, fields, spec)
+
+        if isinstance(fields, str):
+            fields = (fields,)
+        if fields is None or TOPOLOGY_HOST_FIELDS.intersection(fields):
+            version = topology.bump(self.link_id)
+            if self.link:
+                self.link.topology_version = version
+
+        return response
+
+    def remove(self):
+        mongo.MongoObject.remove(self)
+        topology.bump(self.link_id)
+
     @property
     def is_available(self):
         if self.status != AVAILABLE or \
@@ -235,6 +280,7 @@ class Host(mongo.MongoObject):
                 self.status = UNAVAILABLE
                 self.backoff_timestamp = cur_timestamp
                 self.ping_timestamp_ttl = None
+                topology.bump(self.link_id)
             return
 
         if self.status == UNAVAILABLE:
@@ -254,6 +300,7 @@ class Host(mongo.MongoObject):
             self.status = UNAVAILABLE
             self.backoff_timestamp = cur_timestamp
             self.ping_timestamp_ttl = None
+            topology.bump(self.link_id)
 
     def load_link(self):
         self.link = Link(id=self.link_id)
@@ -283,6 +330,7 @@ class Host(mongo.MongoObject):
         }, {'$set': {
             'active': False,
         }})
+        topology.bump(self.link_id)
 
         return True
 
@@ -321,15 +369,27 @@ class Host(mongo.MongoObject):
         self.timestamp = utils.now()
         self.ping_timestamp_ttl = utils.now() + datetime.timedelta(
             seconds=self.timeout or settings.vpn.link_timeout)
-        self.commit(('public_address', 'address6', 'local_address',
-            'version', 'status', 'timestamp', 'hosts', 'hosts_hist',
-            'wg_public_key', 'hosts_hist_timestamp', 'ping_timestamp_ttl'))
 
         if not self.link.key:
+            self.commit(HEARTBEAT_HOST_FIELDS)
             self.link.generate_key()
             self.link.commit('key')
             return
 
+        snapshot = topology.get(self.link)
+        host_doc = snapshot.hosts_id.get(self.id)
+        if host_doc and host_doc.get('status') == AVAILABLE and \
+                host_doc.get('public_address') == self.public_address and \
+                host_doc.get('local_address') == self.local_address and \
+                host_doc.get('address6') == self.address6 and \
+                host_doc.get('wg_public_key') == self.wg_public_key:
+            topology.queue_heartbeat(self.id, {
+                x: getattr(self, x) for x in HEARTBEAT_HOST_FIELDS
+            })
+        else:
+            self.commit(HEARTBEAT_HOST_FIELDS)
+            snapshot = topology.get(self.link)
+
         links = []
         hosts = {}
         state = {
@@ -345,11 +405,21 @@ class Host(mongo.MongoObject):
             'preferred_esp': self.link.preferred_esp,
             'force_preferred': self.link.force_preferred,
         }
-        active_host = self.location.get_active_host()
+        active_host = snapshot.active_hosts.get(self.location.id)
         active = active_host and active_host.id == self.id
 
         loc_transit_excludes = set(self.location.transit_excludes)
-        locations, locations_id, loc_excludes = self.get_state_locations()
+        locations = snapshot.locations
+        locations_id = snapshot.locations_id
+        loc_excludes = set()
+        for exclude in self.link.excludes:
+            if self.location.id not in exclude:
+                continue
+
+            if exclude[0] == self.location.id:
+                loc_excludes.add(exclude[1])
+            else:
+                loc_excludes.add(exclude[0])
 
         if self.link.status == ONLINE and active_host and active:
             if self.link.type == DIRECT:
@@ -362,7 +432,7 @@ class Host(mongo.MongoObject):
                     if location.type != self.location.type:
                         other_location = location
 
-                active_host = other_location.get_active_host()
+                active_host = snapshot.active_hosts.get(other_location.id)
                 if active_host:
                     if self.location.type == DIRECT_SERVER:
                         left_subnets = ['%s/32' % self.local_address]
@@ -388,7 +458,7 @@ class Host(mongo.MongoObject):
                             location.id == self.location.id:
                         continue
 
-                    active_host = location.get_active_host()
+                    active_host = snapshot.active_hosts.get(location.id)
                     if not active_host:
                         continue
 
@@ -452,12 +522,12 @@ class Host(mongo.MongoObject):
                     location.id == self.location.id:
                     continue
 
-                for host in location.iter_hosts():
-                    host_addr = host.address6 if \
-                        host.link.ipv6 else host.public_address
+                for host_doc in snapshot.hosts[location.id]:
+                    host_addr = host_doc.get('address6') if \
+                        self.link.ipv6 else host_doc.get('public_address')
 
                     if host_addr:
-                        hosts[str(host.id)] = host_addr
+                        hosts[str(host_doc['_id'])] = host_addr
 
         for lnk in links:
             link_hash = utils.unsafe_md5(json.dumps(
@@ -677,6 +747,16 @@ class Location(mongo.MongoObject):
     def host_collection(cls):
         return mongo.get_collection('links_hosts')
 
+    def commit(self, fields=None, spec=None):
+        response = mongo.MongoObject.commit(self, fields, spec)
+
+        if fields != 'status' and fields != ('status',):
+            version = topology.bump(self.link_id)
+            if self.link:
+                self.link.topology_version = version
+
+        return response
+
     def dict(self, locations=None, locations_id=None):
         static_location = False
         location_state = None
@@ -808,6 +888,7 @@ class Location(mongo.MongoObject):
             'location_id': self.id,
         })
         mongo.MongoObject.remove(self)
+        topology.bump(self.link_id)
 
     def add_route(self, network):
         try:
@@ -1159,6 +1240,7 @@ class Link(mongo.MongoObject):
         'preferred_ike',
         'preferred_esp',
         'force_preferred',
+        'topology_version',
     }
     fields_default = {
         'protocol': 'ipsec',
@@ -1166,6 +1248,7 @@ class Link(mongo.MongoObject):
         'status': OFFLINE,
         'action': RESTART,
         'excludes': [],
+        'topology_version': 0,
     }
 
     def __init__(self, name=None, type=None, status=None, timeout=None,
@@ -1225,6 +1308,17 @@ class Link(mongo.MongoObject):
     def host_collection(cls):
         return mongo.get_collection('links_hosts')
 
+    def commit(self, fields=None, spec=None):
+        # Version is only changed by bump, a full commit of a stale
+        # link must not move it back
+        if fields is None and self.exists:
+            fields = self.fields - {'topology_version'}
+        elif fields is not None and not isinstance(fields, str):
+            fields = set(fields) - {'topology_version'}
+        response = mongo.MongoObject.commit(self, fields, spec)
+        self.topology_version = topology.bump(self.id)
+        return response
+
     def dict(self):
         return {
             'id': self.id,
@@ -1249,6 +1343,7 @@ class Link(mongo.MongoObject):
             'link_id': self.id,
         })
         mongo.MongoObject.remove(self)
+        topology.clear(self.id)
 
     def generate_key(self):
         self.key = utils.rand_str(64)
@@ -0,0 +1,184 @@
+from pritunl import settings
+from pritunl import logger
+from pritunl import mongo
+
+import threading
+import collections
+import time
+import pymongo
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+_build_locks = collections.defaultdict(threading.Lock)
+_heartbeats = {}
+_heartbeats_lock = threading.Lock()
+_heartbeats_thread = None
+
+class Snapshot(object):
+    __slots__ = (
+        'link_id',
+        'version',
+        'link_status',
+        'timestamp',
+        'locations',
+        'locations_id',
+        'active_hosts',
+        'hosts',
+        'hosts_id',
+    )
+
+    def __init__(self, link_id, version, link_status):
+        self.link_id = link_id
+        self.version = version
+        self.link_status = link_status
+        self.timestamp = time.time()
+        self.locations = []
+        self.locations_id = {}
+        self.active_hosts = {}
+        self.hosts = collections.defaultdict(list)
+        self.hosts_id = {}
+
+def get_version(lnk):
+    if 'topology_version' in lnk.loaded_fields:
+        return lnk.topology_version or 0
+
+    doc = mongo.get_collection('links').find_one({
+        '_id': lnk.id,
+    }, {
+        'topology_version': True,
+    })
+    return (doc or {}).get('topology_version') or 0
+
+def bump(link_id):
+    _snapshots_lock.acquire()
+    try:
+        _snapshots.pop(link_id, None)
+    finally:
+        _snapshots_lock.release()
+
+    if not link_id:
+        return 0
+
+    doc = mongo.get_collection('links').find_one_and_update({
+        '_id': link_id,
+    }, {'$inc': {
+        'topology_version': 1,
+    }}, {
+        'topology_version': True,
+    }, return_document=pymongo.ReturnDocument.AFTER)
+
+    if doc:
+        return doc.get('topology_version') or 0
+    return 0
+
+def clear(link_id):
+    _snapshots_lock.acquire()
+    try:
+        _snapshots.pop(link_id, None)
+    finally:
+        _snapshots_lock.release()
+
+def _build(lnk, version):
+    snapshot = Snapshot(lnk.id, version, lnk.status)
+
+    for location in lnk.iter_locations():
+        snapshot.locations.append(location)
+        snapshot.locations_id[location.id] = location
+
+    cursor = mongo.get_collection('links_hosts').find({
+        'link_id': lnk.id,
+    }, {
+        '_id': True,
+        'location_id': True,
+        'status': True,
+        'static': True,
+        'public_address': True,
+        'local_address': True,
+        'address6': True,
+        'wg_public_key': True,
+    }).sort('name')
+
+    for doc in cursor:
+        snapshot.hosts[doc.get('location_id')].append(doc)
+        snapshot.hosts_id[doc['_id']] = doc
+
+    for location in snapshot.locations:
+        snapshot.active_hosts[location.id] = location.get_active_host()
+
+    return snapshot
+
+def get(lnk):
+    version = get_version(lnk)
+    ttl = settings.app.link_topology_ttl
+
+    snapshot = _snapshots.get(lnk.id)
+    if snapshot and snapshot.version == version and \
+            snapshot.link_status == lnk.status and \
+            time.time() - snapshot.timestamp < ttl:
+        return snapshot
+
+    build_lock = _build_locks[lnk.id]
+    build_lock.acquire()
+    try:
+        snapshot = _snapshots.get(lnk.id)
+        if snapshot and snapshot.version == version and \
+                snapshot.link_status == lnk.status and \
+                time.time() - snapshot.timestamp < ttl:
+            return snapshot
+
+        snapshot = _build(lnk, version)
+
+        _snapshots_lock.acquire()
+        try:
+            cur_snapshot = _snapshots.get(lnk.id)
+            if not cur_snapshot or cur_snapshot.version <= version:
+                _snapshots[lnk.id] = snapshot
+        finally:
+            _snapshots_lock.release()
+    finally:
+        build_lock.release()
+
+    return snapshot
+
+def _flush_heartbeats():
+    global _heartbeats
+
+    _heartbeats_lock.acquire()
+    try:
+        if not _heartbeats:
+            return
+        heartbeats = _heartbeats
+        _heartbeats = {}
+    finally:
+        _heartbeats_lock.release()
+
+    bulk = []
+    for host_id, doc in heartbeats.items():
+        bulk.append(pymongo.UpdateOne({
+            '_id': host_id,
+        }, {'$set': doc}))
+
+    mongo.get_collection('links_hosts').bulk_write(bulk, ordered=False)
+
+def _heartbeats_runner():
+    while True:
+        time.sleep(settings.app.link_heartbeat_rate)
+        try:
+            _flush_heartbeats()
+        except:
+            logger.exception('Error writing link host heartbeats', 'link')
+
+def queue_heartbeat(host_id, doc):
+    global _heartbeats_thread
+
+    _heartbeats_lock.acquire()
+    try:
+        _heartbeats[host_id] = doc
+
+        if _heartbeats_thread is None:
+            _heartbeats_thread = threading.Thread(
+                name="LinkHeartbeats", target=_heartbeats_runner)
+            _heartbeats_thread.daemon = True
+            _heartbeats_thread.start()
+    finally:
+        _heartbeats_lock.release()
@@ -4,10 +4,32 @@ from pritunl import cache
 from pritunl import utils
 from pritunl import settings
 from pritunl import database
+from pritunl import logger
 
 import pymongo
+import threading
+import collections
+import queue
 import time
 
+_subscribers = set()
+_subscribers_lock = threading.Lock()
+_hub_thread = None
+_hub_last_id = None
+_hub_recent = collections.deque(maxlen=1024)
+_hub_recent_ids = set()
+
+class _Subscriber(object):
+    __slots__ = ('channels', 'queue', 'overflow')
+
+    def __init__(self, channels):
+        if isinstance(channels, str):
+            self.channels = {channels}
+        else:
+            self.channels = set(channels)
+        self.queue = queue.Queue(settings.mongo.subscriber_queue_size)
+        self.overflow = False
+
 def publish(channels, message, extra=None):
     if cache.has_cache:
         return cache.publish(channels, message, extra=extra)
@@ -58,108 +80,262 @@ def get_cursor_id(channels):
             else:
                 publish(channels, None)
 
-@interrupter_generator
-def subscribe(channels, cursor_id=None, timeout=None, yield_delay=None,
-        yield_app_server=False):
-    if cache.has_cache:
-        for msg in cache.subscribe(channels, cursor_id=cursor_id,
-                timeout=timeout, yield_delay=yield_delay,
-                yield_app_server=yield_app_server):
-            yield msg
+def _dispatch(doc):
+    global _hub_last_id
+
+    doc_id = doc['_id']
+    _hub_last_id = doc_id
+    if doc_id in _hub_recent_ids:
         return
+    if len(_hub_recent) == _hub_recent.maxlen:
+        _hub_recent_ids.discard(_hub_recent[0])
+    _hub_recent.append(doc_id)
+    _hub_recent_ids.add(doc_id)
+
+    channel = doc.get('channel')
+
+    _subscribers_lock.acquire()
+    try:
+        subscribers = [x for x in _subscribers if channel in x.channels]
+    finally:
+        _subscribers_lock.release()
+
+    for subscriber in subscribers:
+        if subscriber.overflow:
+            continue
+        try:
+            subscriber.queue.put_nowait(doc.copy())
+        except queue.Full:
+            subscriber.overflow = True
 
-    collection = mongo.get_collection('messages')
-    stall_ttl = settings.mongo.cursor_stall_ttl
-    start_time = time.time()
-    cursor = None
-    cursor_id = cursor_id or get_cursor_id(channels)
+def _catch_up(collection, last_id):
+    if not last_id:
+        return last_id
+
+    for doc in collection.find({
+                '_id': {'$gt': last_id},
+            }).sort('$natural', pymongo.ASCENDING):
+        last_id = doc['_id']
+        _dispatch(doc)
+
+    return last_id
+
+def _get_last_id(collection):
+    doc = collection.find_one({}, {
+        '_id': True,
+    }, sort=[('$natural', pymongo.DESCENDING)])
+    return doc['_id'] if doc else None
+
+def _watch(collection, last_id):
+    resume_token = None
 
     while True:
         try:
-            spec = {}
-
-            if isinstance(channels, str):
-                spec['channel'] = channels
-            else:
-                spec['channel'] = {'$in': channels}
+            with collection.watch([
+                        {'$match': {'operationType': 'insert'}},
+                    ], resume_after=resume_token) as stream:
+                if not resume_token:
+                    last_id = _catch_up(collection, last_id)
+
+                for change in stream:
+                    resume_token = change['_id']
+                    doc = change['fullDocument']
+                    last_id = doc['_id']
+                    _dispatch(doc)
+        except pymongo.errors.OperationFailure:
+            if not resume_token:
+                raise
+            resume_token = None
+        except (pymongo.errors.AutoReconnect,
+                pymongo.errors.NetworkTimeout):
+            time.sleep(0.2)
 
-            if cursor_id:
-                cursor_missing = collection.count_documents(
-                    {'_id': cursor_id},
-                    limit=1,
-                ) < 1
-                if cursor_missing:
-                    cursor_id = get_cursor_id(channels)
+def _tail(collection, last_id):
+    global _hub_last_id
 
-                if cursor_id:
-                    spec['_id'] = {'$gt': cursor_id}
+    while True:
+        cursor = None
+        try:
+            spec = {}
+            if last_id:
+                spec['_id'] = {'$gt': last_id}
 
-            yield
+            cursor = collection.find(
+                spec,
+                cursor_type=pymongo.cursor.CursorType.TAILABLE_AWAIT,
+            ).sort('$natural', pymongo.ASCENDING)
 
+            while cursor.alive:
+                for doc in cursor:
+                    last_id = doc['_id']
+                    _dispatch(doc)
+        except (pymongo.errors.AutoReconnect,
+                pymongo.errors.CursorNotFound):
+            time.sleep(0.2)
+        finally:
             if cursor:
                 try:
                     cursor.close()
-                    cursor = None
                 except:
                     pass
 
-            last_event = time.time()
-            cursor = collection.find(
-                spec,
-                cursor_type=pymongo.cursor.CursorType.TAILABLE_AWAIT,
-            ).sort('$natural', pymongo.ASCENDING)
+        if last_id and collection.count_documents(
+                {'_id': last_id}, limit=1) < 1:
+            last_id = _get_last_id(collection)
+            _hub_last_id = last_id
 
-            yield
+@interrupter
+def _hub_runner(last_id):
+    global _hub_last_id
 
-            while cursor.alive:
-                for doc in cursor:
-                    last_event = time.time()
-                    cursor_id = doc['_id']
+    collection = mongo.get_collection('messages')
+    change_stream = settings.mongo.change_stream
+    _hub_last_id = last_id
 
-                    yield
+    while True:
+        try:
+            # Resume from the last dispatched message after an error
+            last_id = _hub_last_id
+            if last_id is None:
+                last_id = _get_last_id(collection)
+                _hub_last_id = last_id
 
-                    if doc.get('message') is not None:
-                        doc.pop('nonce', None)
-                        yield doc
+            if change_stream:
+                try:
+                    _watch(collection, last_id)
+                except pymongo.errors.OperationFailure as error:
+                    change_stream = False
+                    logger.info(
+                        'Change streams unavailable, tailing messages',
+                        'messenger',
+                        error=str(error),
+                    )
+            else:
+                _tail(collection, last_id)
+        except GeneratorExit:
+            raise
+        except:
+            logger.exception('Error in messenger subscription', 'messenger')
+            time.sleep(1)
+
+        yield
+
+def _add_subscriber(subscriber):
+    global _hub_thread
+
+    _subscribers_lock.acquire()
+    try:
+        _subscribers.add(subscriber)
+
+        if _hub_thread is None:
+            # Start from the current last message before the subscriber
+            # reads its backlog so nothing is missed between the two
+            last_id = _get_last_id(mongo.get_collection('messages'))
+            _hub_thread = threading.Thread(name="MessengerHub",
+                target=_hub_runner, args=(last_id,))
+            _hub_thread.daemon = True
+            _hub_thread.start()
+    finally:
+        _subscribers_lock.release()
+
+def _remove_subscriber(subscriber):
+    _subscribers_lock.acquire()
+    try:
+        _subscribers.discard(subscriber)
+    finally:
+        _subscribers_lock.release()
+
+def _get_backlog(channels, cursor_id):
+    collection = mongo.get_collection('messages')
 
-                    if yield_delay:
-                        time.sleep(yield_delay)
+    if collection.count_documents({'_id': cursor_id}, limit=1) < 1:
+        return get_cursor_id(channels), []
 
-                        spec = spec.copy()
-                        spec['_id'] = {'$gt': cursor_id}
-                        batch_cursor = collection.find(spec).sort(
-                            '$natural', pymongo.ASCENDING)
+    spec = {
+        '_id': {'$gt': cursor_id},
+    }
+    if isinstance(channels, str):
+        spec['channel'] = channels
+    else:
+        spec['channel'] = {'$in': channels}
 
-                        for doc in batch_cursor:
-                            if doc.get('message') is not None:
-                                doc.pop('nonce', None)
-                                yield doc
+    return cursor_id, list(collection.find(spec).sort(
+        '$natural', pymongo.ASCENDING))
 
-                        return
+@interrupter_generator
+def subscribe(channels, cursor_id=None, timeout=None, yield_delay=None,
+        yield_app_server=False):
+    if cache.has_cache:
+        for msg in cache.subscribe(channels, cursor_id=cursor_id,
+                timeout=timeout, yield_delay=yield_delay,
+                yield_app_server=yield_app_server):
+            yield msg
+        return
 
-                if yield_app_server and check_app_server_interrupt():
-                    return
+    # All subscribers in the process share a single change stream or
+    # tailable cursor, messages before the subscriber was registered or
+    # dropped on overflow are read from the collection
+    subscriber = _Subscriber(channels)
+    _add_subscriber(subscriber)
+    try:
+        start_time = time.time()
+        cursor_id = cursor_id or get_cursor_id(channels)
+        backlog = True
+        backlog_ids = set()
+
+        while True:
+            if backlog or subscriber.overflow:
+                if subscriber.overflow:
+                    subscriber.overflow = False
+                    while True:
+                        try:
+                            subscriber.queue.get_nowait()
+                        except queue.Empty:
+                            break
+
+                backlog = False
+                cursor_id, docs = _get_backlog(channels, cursor_id)
+                backlog_ids = {x['_id'] for x in docs}
+            else:
+                try:
+                    doc = subscriber.queue.get(timeout=0.5)
+                    docs = [] if doc['_id'] in backlog_ids else [doc]
+                except queue.Empty:
+                    docs = []
 
-                cur_time = time.time()
-                if timeout and cur_time - start_time >= timeout:
-                    return
+            yielded = False
+            for doc in docs:
+                cursor_id = doc['_id']
 
-                if cur_time - last_event > stall_ttl:
-                    break
+                if doc.get('message') is not None:
+                    doc.pop('nonce', None)
+                    yielded = True
+                    yield doc
 
-                time.sleep(0.2)
-                yield
+            if yielded and yield_delay:
+                time.sleep(yield_delay)
 
-        except pymongo.errors.AutoReconnect:
-            time.sleep(0.2)
+                while True:
+                    try:
+                        doc = subscriber.queue.get_nowait()
+                    except queue.Empty:
+                        break
 
-        except pymongo.errors.CursorNotFound:
-            time.sleep(0.2)
+                    if doc['_id'] in backlog_ids:
+                        continue
 
-        finally:
-            if cursor:
-                try:
-                    cursor.close()
-                    cursor = None
-                except:
-                    pass
+                    if doc.get('message') is not None:
+                        doc.pop('nonce', None)
+                        yield doc
+
+                return
+
+            if yield_app_server and check_app_server_interrupt():
+                return
+
+            if timeout and time.time() - start_time >= timeout:
+                return
+
+            yield
+    finally:
+        _remove_subscriber(subscriber)
@@ -20,6 +20,7 @@ class MongoObject(object):
         mongo_object.unseted = set()
         mongo_object.id = id
         mongo_object.loaded_fields = fields
+        mongo_object.upserted = False
 
         if id or doc or spec:
             mongo_object.exists = True
@@ -149,6 +150,7 @@ class MongoObject(object):
             response = collection.update_one(
                 spec, update_doc, upsert=not fields)
 
+            self.upserted = response.upserted_id is not None
             response = bool(response.modified_count)
 
         self.exists = True
@@ -1,68 +1,245 @@
-from pritunl.monitoring.utils import get_servers
+from pritunl.monitoring.utils import get_servers, encode_point
 
 from pritunl import settings
 from pritunl import logger
 
 import threading
-import influxdb_client
-import influxdb_client.client.write_api
+import collections
+import itertools
+import time
+import os
+import gzip
+import requests
 
-_queue = []
+_queue = collections.deque()
 _queue_lock = threading.Lock()
-_client = None
+_spool_lock = threading.Lock()
+_session = None
+_write_url = None
+_write_params = None
 _cur_influxdb_url = None
 _cur_influxdb_org = None
 _cur_influxdb_bucket = None
 _cur_influxdb_token = None
-_write_options = influxdb_client.client.write_api.SYNCHRONOUS
+_stats = {
+    'queued': 0,
+    'written': 0,
+    'dropped': 0,
+    'spilled': 0,
+    'replayed': 0,
+}
+
+def _inc_stat(name, count):
+    # Counters are updated under the queue lock like the queue itself
+    _queue_lock.acquire()
+    try:
+        _stats[name] += count
+    finally:
+        _queue_lock.release()
+
+def get_stats():
+    _queue_lock.acquire()
+    try:
+        stats = _stats.copy()
+        stats['queue_size'] = len(_queue)
+    finally:
+        _queue_lock.release()
+
+    try:
+        stats['spool_size'] = os.path.getsize(
+            settings.app.influxdb_spool_path)
+    except OSError:
+        stats['spool_size'] = 0
+
+    return stats
+
+def _spool_path():
+    return settings.app.influxdb_spool_path
+
+def _spill(lines):
+    path = _spool_path()
+
+    _spool_lock.acquire()
+    try:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+
+        data = ''.join(x + '\n' for x in lines)
+        if size + len(data) > settings.app.influxdb_spool_size:
+            _inc_stat('dropped', len(lines))
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as spool_file:
+            spool_file.write(data)
+        _inc_stat('spilled', len(lines))
+    except:
+        _inc_stat('dropped', len(lines))
+        logger.exception('InfluxDB spool write error', 'monitoring',
+            spool_path=path,
+        )
+    finally:
+        _spool_lock.release()
 
 def insert_point(measurement, tags, fields):
+    insert_points(measurement, ((tags, fields),))
+
+def insert_points(measurement, points):
+    if not _session:
+        return
+
+    measurement = settings.app.influxdb_prefix + measurement
+    timestamp = time.time_ns()
+
+    lines = []
+    for tags, fields in points:
+        line = encode_point(measurement, tags, fields, timestamp)
+        if line:
+            lines.append(line)
+    if not lines:
+        return
+
+    overflow = None
+
     _queue_lock.acquire()
     try:
-        if not _client:
+        if not _session:
             return
 
-        point = influxdb_client.Point(
-            settings.app.influxdb_prefix + measurement
+        _queue.extend(lines)
+        _stats['queued'] += len(lines)
+
+        excess = len(_queue) - settings.app.influxdb_queue_size
+        if excess > 0:
+            overflow = [_queue.popleft() for _ in range(max(excess, min(
+                len(_queue), settings.app.influxdb_batch_size)))]
+    finally:
+        _queue_lock.release()
+
+    if overflow:
+        _spill(overflow)
+
+def _send(session, url, params, lines):
+    data = gzip.compress(('\n'.join(lines) + '\n').encode())
+
+    response = session.post(
+        url,
+        params=params,
+        data=data,
+        timeout=settings.app.influxdb_timeout,
+    )
+
+    if response.status_code in (400, 413, 422):
+        _inc_stat('dropped', len(lines))
+        logger.error('InfluxDB rejected points', 'monitoring',
+            status_code=response.status_code,
+            count=len(lines),
+            response=response.text[:512],
         )
+        return
 
-        for key, val in tags.items():
-            point.tag(key, val)
+    response.raise_for_status()
+    _inc_stat('written', len(lines))
 
-        for key, val in fields.items():
-            point.field(key, val)
+def _get_batch():
+    batch = []
+    batch_len = 0
+    batch_size = settings.app.influxdb_batch_size
+    batch_bytes = settings.app.influxdb_batch_bytes
 
-        _queue.append(point)
+    _queue_lock.acquire()
+    try:
+        while _queue and len(batch) < batch_size and \
+                batch_len < batch_bytes:
+            line = _queue.popleft()
+            batch.append(line)
+            batch_len += len(line) + 1
     finally:
         _queue_lock.release()
 
-def write_queue():
-    global _queue
+    return batch
+
+def _requeue(batch):
+    overflow = None
 
     _queue_lock.acquire()
     try:
-        if not _queue:
-            return
-        queue = _queue
-        _queue = []
-        client = _client
+        _queue.extendleft(reversed(batch))
+
+        count = len(_queue) - settings.app.influxdb_queue_size
+        if count > 0:
+            overflow = [_queue.popleft() for _ in range(count)]
     finally:
         _queue_lock.release()
 
-    if client:
+    if overflow:
+        _spill(overflow)
+
+def _replay_spool(session, url, params):
+    path = _spool_path()
+    replay_path = path + '.replay'
+
+    _spool_lock.acquire()
+    try:
+        if not os.path.exists(replay_path):
+            if not os.path.exists(path):
+                return
+            os.rename(path, replay_path)
+    finally:
+        _spool_lock.release()
+
+    batch_size = settings.app.influxdb_batch_size
+
+    with open(replay_path, 'r') as replay_file:
+        lines = (x.rstrip('\n') for x in replay_file if x.strip())
+
+        while True:
+            batch = list(itertools.islice(lines, batch_size))
+            if not batch:
+                break
+
+            try:
+                _send(session, url, params, batch)
+            except:
+                _spill(batch + list(lines))
+                os.remove(replay_path)
+                raise
+
+            _inc_stat('replayed', len(batch))
+
+    os.remove(replay_path)
+
+def write_queue():
+    _queue_lock.acquire()
+    try:
+        session = _session
+        url = _write_url
+        params = _write_params
+    finally:
+        _queue_lock.release()
+
+    if not session:
+        return
+
+    while True:
+        batch = _get_batch()
+        if not batch:
+            break
+
         try:
-            write_api = client.write_api(write_options=_write_options)
-            write_api.write(bucket=_cur_influxdb_bucket, record=queue)
+            _send(session, url, params, batch)
         except:
-            _queue_lock.acquire()
-            try:
-                _queue = queue + _queue
-            finally:
-                _queue_lock.release()
+            _requeue(batch)
             raise
 
+    _replay_spool(session, url, params)
+
 def connect():
-    global _client
+    global _session
+    global _write_url
+    global _write_params
     global _cur_influxdb_url
     global _cur_influxdb_org
     global _cur_influxdb_bucket
@@ -81,7 +258,7 @@ def connect():
     if not influxdb_url:
         _queue_lock.acquire()
         try:
-            _client = None
+            _session = None
         finally:
             _queue_lock.release()
         _cur_influxdb_url = influxdb_url
@@ -96,11 +273,25 @@ def connect():
         influxdb_bucket=influxdb_bucket,
     )
 
-    _client = influxdb_client.InfluxDBClient(
-        url=influxdb_url,
-        org=influxdb_org,
-        token=influxdb_token,
-    )
+    session = requests.Session()
+    session.headers.update({
+        'Authorization': 'Token %s' % influxdb_token,
+        'Content-Type': 'text/plain; charset=utf-8',
+        'Content-Encoding': 'gzip',
+        'Accept': 'application/json',
+    })
+
+    _queue_lock.acquire()
+    try:
+        _session = session
+        _write_url = influxdb_url.rstrip('/') + '/api/v2/write'
+        _write_params = {
+            'org': influxdb_org,
+            'bucket': influxdb_bucket,
+            'precision': 'ns',
+        }
+    finally:
+        _queue_lock.release()
 
     _cur_influxdb_url = influxdb_url
     _cur_influxdb_org = influxdb_org
@@ -29,3 +29,40 @@ def get_servers(uri):
         database = None
 
     return hosts, username, password, database
+
+def _escape_key(val):
+    return str(val).replace('\\', '\\\\').replace(',', '\\,').replace(
+        '=', '\\=').replace(' ', '\\ ').replace('\n', '\\n')
+
+def _escape_measurement(val):
+    return str(val).replace('\\', '\\\\').replace(',', '\\,').replace(
+        ' ', '\\ ').replace('\n', '\\n')
+
+def _format_field(val):
+    if isinstance(val, bool):
+        return 'true' if val else 'false'
+    elif isinstance(val, int):
+        return '%di' % val
+    elif isinstance(val, float):
+        return repr(val)
+    return '"%s"' % str(val).replace('\\', '\\\\').replace('"', '\\"')
+
+def encode_point(measurement, tags, fields, timestamp):
+    line = _escape_measurement(measurement)
+
+    for key in sorted(tags):
+        val = tags[key]
+        if val is None or val == '':
+            continue
+        line += ',%s=%s' % (_escape_key(key), _escape_key(val))
+
+    field_set = []
+    for key, val in fields.items():
+        if val is None:
+            continue
+        field_set.append('%s=%s' % (_escape_key(key), _format_field(val)))
+
+    if not field_set:
+        return
+
+    return '%s %s %d' % (line, ','.join(field_set), timestamp)
@@ -1,25 +1,86 @@
 import threading
+import collections
+import weakref
+import time
+
+_caches = weakref.WeakSet()
+_caches_lock = threading.Lock()
 
 class ObjCache(object):
-    def __init__(self, ttl=60):
+    def __init__(self, ttl=60, capacity=1024, events=None):
         self._ttl = ttl
-        self._data = {}
-        self._timers = {}
+        self._capacity = capacity
+        self._events = set(events or ())
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self._events:
+            with _caches_lock:
+                _caches.add(self)
 
     def remove(self, key):
-        self._data.pop(key, None)
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is not None and key in self._data:
+                self._data.pop(key, None)
+            else:
+                self._data.clear()
 
     def set(self, key, val):
-        cur_timer = self._timers.pop(key, None)
-        if cur_timer:
-            cur_timer.cancel()
+        expire = time.monotonic() + self._ttl
 
-        timer = threading.Timer(self._ttl, self.remove, (key,))
-        timer.daemon = True
-        self._timers[key] = timer
-        timer.start()
+        with self._lock:
+            self._data[key] = (expire, val)
+            self._data.move_to_end(key)
 
-        self._data[key] = val
+            while len(self._data) > self._capacity:
+                self._data.popitem(last=False)
 
     def get(self, key):
-        return self._data.get(key)
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                self.misses += 1
+                return
+
+            if time.monotonic() > data[0]:
+                self._data.pop(key, None)
+                self.misses += 1
+                return
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return data[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'capacity': self._capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+def on_msg(msg):
+    try:
+        event_type, resource_id = msg['message']
+    except (TypeError, ValueError):
+        return
+
+    with _caches_lock:
+        caches = list(_caches)
+
+    for cache in caches:
+        if event_type not in cache._events:
+            continue
+
+        cache.invalidate(resource_id)
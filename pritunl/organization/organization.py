@@ -8,6 +8,7 @@ from pritunl import pooler
 from pritunl import user
 from pritunl import utils
 from pritunl import database
+from pritunl import objcache
 
 import uuid
 import math
@@ -17,6 +18,9 @@ import hashlib
 import re
 import datetime
 
+_page_cursors = objcache.ObjCache(ttl=300, capacity=4096,
+    events=(USERS_UPDATED,))
+
 class Organization(mongo.MongoObject):
     fields = {
         'name',
@@ -77,7 +81,24 @@ class Organization(mongo.MongoObject):
 
     @cached_property
     def user_count(self):
-        return self._get_user_count(type=CERT_CLIENT)
+        doc = self.collection.find_one({
+            '_id': self.id,
+        }, {
+            'user_count': True,
+        })
+        if doc and doc.get('user_count') is not None:
+            return max(0, doc['user_count'])
+
+        user_count = self._get_user_count(type=CERT_CLIENT)
+
+        self.collection.update_one({
+            '_id': self.id,
+            'user_count': {'$exists': False},
+        }, {'$set': {
+            'user_count': user_count,
+        }})
+
+        return user_count
 
     @cached_property
     def server_user_count(self):
@@ -198,17 +219,60 @@ class Organization(mongo.MongoObject):
             'org_id': self.id,
         })
 
+    def _get_page_spec(self, after, sort_last_active, boundary=None):
+        doc = user.User.collection.find_one({
+            '_id': after,
+            'org_id': self.id,
+            'type': CERT_CLIENT,
+        }, {
+            '_id': True,
+            'name': True,
+            'last_active': True,
+        })
+        if not doc:
+            return
+
+        # Cached boundaries are only valid while the user still sorts
+        # at the same position
+        if boundary is not None and boundary != (
+                doc.get('name'), doc.get('last_active')):
+            return
+
+        name = doc.get('name')
+        name_spec = [
+            {'name': {'$gt': name}},
+            {'name': name, '_id': {'$gt': doc['_id']}},
+        ]
+        if not sort_last_active:
+            return {'$or': name_spec}
+
+        last_active = doc.get('last_active')
+        if last_active is None:
+            return {'$or': [
+                {'last_active': None, '$or': name_spec},
+                {'last_active': {'$type': 'date'}},
+            ]}
+
+        return {'$or': [
+            {'last_active': {'$gt': last_active}},
+            {'last_active': last_active, '$or': name_spec},
+        ]}
+
     def iter_users(self, page=None, search=None, search_limit=None,
-            fields=None, include_pool=False, sort_last_active=False):
+            fields=None, include_pool=False, sort_last_active=False,
+            after=None):
         spec = {
             'org_id': self.id,
             'type': CERT_CLIENT,
         }
+        page_spec = None
+        page_cursor_key = None
         searched = False
         type_search = False
         limit = None
         skip = None
         page_count = settings.user.page_count
+        self.last_page_cursor = None
 
         if fields:
             fields = {key: True for key in fields}
@@ -248,7 +312,7 @@ class Organization(mongo.MongoObject):
                 email = email[0] if email else ''
                 if email:
                     spec['email'] = {
-                        '$regex': '.*%s.*' % re.escape(email),
+                        '$regex': '^%s' % re.escape(email),
                         '$options': 'i',
                     }
                 search = search[:n] + search[n + 6 + len(email):].strip()
@@ -286,42 +350,93 @@ class Organization(mongo.MongoObject):
                 else:
                     spec['_id'] = {'$nin': user_ids}
 
-            spec['name'] = {
-                '$regex': '.*%s.*' % re.escape(search).strip(),
-                '$options': 'i',
-            }
+            search_terms = utils.get_search_query(search)
+            if search_terms:
+                # Users committed before search terms were indexed fall
+                # back to the name regex until the backfill task reaches them
+                spec['$or'] = [
+                    {'search_terms': {'$all': search_terms}},
+                    {
+                        'search_terms': {'$exists': False},
+                        'name': {
+                            '$regex': '.*%s.*' % re.escape(search.strip()),
+                            '$options': 'i',
+                        },
+                    },
+                ]
 
             limit = search_limit or page_count
-        elif page is not None:
+        elif page is not None or after is not None:
             limit = page_count
-            skip = page * page_count if page else 0
 
-        cursor = user.User.collection.find(spec, fields)
+            # Walk pages by the last user of the previous page on the
+            # sort key instead of skipping, fall back to skip when the
+            # previous page was not served by this host. Boundaries are
+            # only shared for paging by page number.
+            if after is None:
+                page_cursor_key = (self.id, bool(sort_last_active), page)
+                if page:
+                    page_cursor = _page_cursors.get(page_cursor_key)
+                    if page_cursor is not None:
+                        page_spec = self._get_page_spec(page_cursor[0],
+                            sort_last_active, page_cursor[1:])
+                        if page_spec is None:
+                            _page_cursors.remove(page_cursor_key)
+                    if page_spec is None:
+                        skip = page * page_count
+            else:
+                page_spec = self._get_page_spec(after, sort_last_active)
+
+            if fields:
+                fields['name'] = True
+                fields['last_active'] = True
+
+        if page_spec:
+            cursor = user.User.collection.find(
+                dict(spec, **page_spec), fields)
+        else:
+            cursor = user.User.collection.find(spec, fields)
+
         if sort_last_active:
             cursor.sort([
                 ('last_active', pymongo.ASCENDING),
                 ('name', pymongo.ASCENDING),
+                ('_id', pymongo.ASCENDING),
             ])
         else:
-            cursor.sort('name', pymongo.ASCENDING)
+            cursor.sort([
+                ('name', pymongo.ASCENDING),
+                ('_id', pymongo.ASCENDING),
+            ])
 
         if skip is not None:
-            cursor = cursor.skip(page * page_count if page else 0)
+            cursor = cursor.skip(skip)
         if limit is not None:
             cursor = cursor.limit(limit + 1)
 
         if searched:
-            self.last_search_count = user.User.collection.count_documents(spec)
+            self.last_search_count = user.User.collection.count_documents(
+                spec, limit=settings.user.search_count_limit)
 
         if limit is None:
             for doc in cursor:
                 yield user.User(self, doc=doc, fields=fields)
         else:
             count = 0
+            last_doc = None
             for doc in cursor:
                 count += 1
                 if count > limit:
+                    if not searched:
+                        self.last_page_cursor = last_doc['_id']
+                        if page_cursor_key is not None:
+                            _page_cursors.set(
+                                (self.id, bool(sort_last_active), page + 1),
+                                (last_doc['_id'], last_doc.get('name'),
+                                    last_doc.get('last_active')),
+                            )
                     return
+                last_doc = doc
                 yield user.User(self, doc=doc, fields=fields)
 
         if type_search:
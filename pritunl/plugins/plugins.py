@@ -91,6 +91,21 @@ def _event(event_type, **kwargs):
                 handler=event_type,
             )
 
+def has_event(event_type):
+    if not settings.local.sub_plan or \
+            'enterprise' not in settings.local.sub_plan:
+        return False
+    return _has_plugins and event_type in _handlers
+
+def _events(event_type, kwargs_list):
+    for kwargs in kwargs_list:
+        _event(event_type, **kwargs)
+
+def events(event_type, kwargs_list):
+    if not kwargs_list or not has_event(event_type):
+        return
+    _queue.put(_events, event_type, kwargs_list)
+
 def event(event_type, **kwargs):
     if not settings.local.sub_plan or \
             'enterprise' not in settings.local.sub_plan:
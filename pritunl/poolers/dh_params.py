@@ -12,6 +12,11 @@ def fill_dh_params():
 
     new_dh_params = []
     dh_param_bits_pool = settings.app.dh_param_bits_pool
+    if settings.vpn.dh_param_mode == 'ffdhe':
+        dh_param_bits_pool = [x for x in dh_param_bits_pool
+            if x not in FFDHE_PARAMS]
+        if not dh_param_bits_pool:
+            return
     dh_param_counts = utils.LeastCommonCounter()
 
     for dh_param_bits in dh_param_bits_pool:
@@ -0,0 +1,222 @@
+from pritunl import mongo
+from pritunl import utils
+from pritunl import objcache
+
+import threading
+import datetime
+import time
+import array
+import pymongo
+
+PERIODS = ('1m', '5m', '30m', '2h', '1d')
+PERIOD_RETENTION = {
+    '1m': datetime.timedelta(hours=6),
+    '5m': datetime.timedelta(days=1),
+    '30m': datetime.timedelta(days=7),
+    '2h': datetime.timedelta(days=30),
+    '1d': datetime.timedelta(days=365),
+}
+PERIOD_STEP = {
+    '1m': 60,
+    '5m': 300,
+    '30m': 1800,
+    '2h': 7200,
+    '1d': 86400,
+}
+
+FLUSH_INTERVAL = 600
+
+_series_cache = objcache.ObjCache(ttl=10, capacity=512)
+
+def get_period_timestamp(period, timestamp):
+    timestamp -= datetime.timedelta(microseconds=timestamp.microsecond,
+            seconds=timestamp.second)
+
+    if period == '1m':
+        return timestamp
+    elif period == '5m':
+        return timestamp - datetime.timedelta(
+            minutes=timestamp.minute % 5)
+    elif period == '30m':
+        return timestamp - datetime.timedelta(
+            minutes=timestamp.minute % 30)
+    elif period == '2h':
+        return timestamp - datetime.timedelta(
+            hours=timestamp.hour % 2, minutes=timestamp.minute)
+    elif period == '1d':
+        return timestamp - datetime.timedelta(
+            hours=timestamp.hour, minutes=timestamp.minute)
+
+class Rollup(object):
+    # Values are summed into an in memory bucket for each period. A
+    # bucket is written with a single $inc once its window closes. The
+    # 1m bucket closes every minute, the values of the open higher period
+    # buckets are also written every flush interval to limit the data lost
+    # on a crash. Expired buckets are removed by the clean_rollups task.
+
+    def __init__(self, collection_name, spec):
+        self.collection_name = collection_name
+        self.spec = spec
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._flushed = time.monotonic()
+
+    @property
+    def collection(self):
+        return mongo.get_collection(self.collection_name)
+
+    def add(self, timestamp, values):
+        closed = []
+
+        self._lock.acquire()
+        try:
+            for period in PERIODS:
+                period_timestamp = get_period_timestamp(period, timestamp)
+
+                bucket = self._buckets.get(period)
+                if bucket is not None and bucket[0] != period_timestamp:
+                    closed.append((period, bucket))
+                    bucket = None
+
+                if bucket is None:
+                    bucket = (period_timestamp, {})
+                    self._buckets[period] = bucket
+
+                bucket_values = bucket[1]
+                for key, val in values.items():
+                    bucket_values[key] = bucket_values.get(key, 0) + val
+
+            cur_time = time.monotonic()
+            if cur_time - self._flushed >= FLUSH_INTERVAL:
+                self._flushed = cur_time
+                for period in PERIODS[1:]:
+                    bucket = self._buckets.get(period)
+                    if bucket is None:
+                        continue
+                    closed.append((period, bucket))
+                    self._buckets[period] = (bucket[0], {})
+        finally:
+            self._lock.release()
+
+        if closed:
+            self._write(closed)
+
+    def flush(self):
+        self._lock.acquire()
+        try:
+            closed = list(self._buckets.items())
+            self._buckets = {}
+            self._flushed = time.monotonic()
+        finally:
+            self._lock.release()
+
+        if closed:
+            self._write(closed)
+
+    def _write(self, buckets):
+        bulk = []
+
+        for period, (timestamp, values) in buckets:
+            if not any(values.values()):
+                continue
+
+            spec = self.spec.copy()
+            spec['period'] = period
+            spec['timestamp'] = timestamp
+            bulk.append(pymongo.UpdateOne(spec, {
+                '$inc': values,
+            }, upsert=True))
+
+        if bulk:
+            self.collection.bulk_write(bulk)
+
+def clean(collection_name, timestamp):
+    collection = mongo.get_collection(collection_name)
+
+    for period in PERIODS:
+        collection.delete_many({
+            'period': period,
+            'timestamp': {
+                '$lt': get_period_timestamp(period, timestamp) -
+                    PERIOD_RETENTION[period],
+            },
+        })
+
+def _downsample(column, factor, average):
+    typecode = 'd' if average else column.typecode
+    merged = array.array(typecode)
+    for i in range(0, len(column), factor):
+        chunk = column[i:i + factor]
+        if average:
+            merged.append(sum(chunk) / float(len(chunk)))
+        else:
+            merged.append(sum(chunk))
+    return merged
+
+def get_series(collection_name, spec, period, fields, count_field=None,
+        downsample=None):
+    # Returns the timestamps and a column for each field with a slot for
+    # every step of the period. When count_field is set values are
+    # averaged over the count of the bucket.
+    step = PERIOD_STEP[period]
+    date_end = get_period_timestamp(period, utils.now())
+    date_start = date_end - PERIOD_RETENTION[period]
+    size = int((date_end - date_start).total_seconds()) // step + 1
+
+    if not downsample or downsample < 1 or downsample >= size:
+        downsample = None
+
+    cache_key = (collection_name, tuple(sorted(spec.items())), period,
+        fields, count_field, downsample)
+    series = _series_cache.get(cache_key)
+    if series is not None:
+        return series
+    start = int(date_start.strftime('%s'))
+
+    typecode = 'd' if count_field else 'q'
+    zeros = bytes(size * 8)
+    columns = {}
+    for field in fields:
+        columns[field] = array.array(typecode, zeros)
+
+    query = spec.copy()
+    query['period'] = period
+    query['timestamp'] = {'$gte': date_start}
+
+    project = {
+        '_id': False,
+        'timestamp': True,
+    }
+    for field in fields:
+        project[field] = True
+    if count_field:
+        project[count_field] = True
+
+    collection = mongo.get_collection(collection_name)
+    for doc in collection.find(query, project):
+        index = int((doc['timestamp'] - date_start).total_seconds()) // step
+        if index >= size:
+            continue
+
+        if count_field:
+            count = doc.get(count_field)
+            if not count:
+                continue
+            for field in fields:
+                columns[field][index] = (doc.get(field) or 0) / count
+        else:
+            for field in fields:
+                columns[field][index] = doc.get(field) or 0
+
+    timestamps = array.array('q', range(start, start + size * step, step))
+
+    if downsample:
+        factor = -(-size // downsample)
+        timestamps = timestamps[::factor]
+        for field in fields:
+            columns[field] = _downsample(columns[field], factor,
+                bool(count_field))
+
+    series = (timestamps, columns)
+    _series_cache.set(cache_key, series)
+    return series
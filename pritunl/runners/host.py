@@ -158,6 +158,13 @@ def _keep_alive_thread():
 
             settings.local.host_ping_timestamp = ping_timestamp
         except GeneratorExit:
+            try:
+                settings.local.host.usage.flush()
+            except:
+                logger.exception('Failed to write host usage', 'runners',
+                    host_id=settings.local.host_id,
+                    host_name=settings.local.host.name,
+                )
             host.deinit()
             raise
         except:
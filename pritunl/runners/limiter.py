@@ -6,15 +6,33 @@ from pritunl import limiter
 import time
 import threading
 
+def _log_stats(last_rejected):
+    # Logged only when attempts were rejected since the last run
+    stats = limiter.get_stats()
+    rejected = stats['auth']['rejected'] + sum(
+        x['rejected'] for x in stats['peers'])
+
+    if rejected != last_rejected:
+        logger.info('Limiter rejected attempts', 'limiter',
+            auth_allowed=stats['auth']['allowed'],
+            auth_rejected=stats['auth']['rejected'],
+            auth_users=stats['auth']['users'],
+            auth_synced=stats['auth']['synced'],
+            peers=stats['peers'],
+        )
+
+    return rejected
+
 @interrupter
 def _limiter_runner_thread():
+    rejected = 0
+
     while True:
         try:
             for limtr in limiter.limiters:
-                cur_time = time.time()
-                for peer, (expire, count) in list(limtr.peers_expire_count.items()):
-                    if cur_time > expire:
-                        limtr.peers_expire_count.pop(peer, None)
+                limtr.evict()
+
+            rejected = _log_stats(rejected)
 
             yield interrupter_sleep(settings.app.peer_limit_timeout * 2)
 
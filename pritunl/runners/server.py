@@ -29,3 +29,4 @@ def _on_msg(msg):
 
 def start_server():
     listener.add_listener('servers', _on_msg)
+    server.start_heartbeat()
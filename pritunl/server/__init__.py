@@ -2,5 +2,6 @@ from pritunl.server.server import Server, dict_fields, operation_fields
 from pritunl.server.instance import get_instance
 from pritunl.server.bandwidth import ServerBandwidth
 from pritunl.server.listener import on_msg
+from pritunl.server.heartbeat import start_heartbeat
 from pritunl.server.ip_pool import *
 from pritunl.server.utils import *
@@ -2,6 +2,7 @@ from pritunl.helpers import *
 from pritunl import settings
 from pritunl import mongo
 from pritunl import utils
+from pritunl import rollup
 
 import os
 import json
@@ -12,137 +13,39 @@ import pymongo
 class ServerBandwidth(object):
     def __init__(self, server_id):
         self.server_id = server_id
+        self.rollup = rollup.Rollup('servers_bandwidth', {
+            'server_id': server_id,
+        })
 
     @cached_static_property
     def collection(cls):
         return mongo.get_collection('servers_bandwidth')
 
-    def _get_period_timestamp(self, period, timestamp):
-        timestamp -= datetime.timedelta(microseconds=timestamp.microsecond,
-                seconds=timestamp.second)
-
-        if period == '1m':
-            return timestamp
-        elif period == '5m':
-            return timestamp - datetime.timedelta(
-                minutes=timestamp.minute % 5)
-        elif period == '30m':
-            return timestamp - datetime.timedelta(
-                minutes=timestamp.minute % 30)
-        elif period == '2h':
-            return timestamp - datetime.timedelta(
-                hours=timestamp.hour % 2, minutes=timestamp.minute)
-        elif period == '1d':
-            return timestamp - datetime.timedelta(
-                hours=timestamp.hour, minutes=timestamp.minute)
-
-    def _get_period_max_timestamp(self, period, timestamp):
-        timestamp -= datetime.timedelta(microseconds=timestamp.microsecond,
-                seconds=timestamp.second)
-
-        if period == '1m':
-            return timestamp - datetime.timedelta(hours=6)
-        elif period == '5m':
-            return timestamp - datetime.timedelta(
-                minutes=timestamp.minute % 5) - datetime.timedelta(days=1)
-        elif period == '30m':
-            return timestamp - datetime.timedelta(
-                minutes=timestamp.minute % 30) - datetime.timedelta(days=7)
-        elif period == '2h':
-            return timestamp - datetime.timedelta(
-                hours=timestamp.hour % 2,
-                minutes=timestamp.minute) - datetime.timedelta(days=30)
-        elif period == '1d':
-            return timestamp - datetime.timedelta(
-                hours=timestamp.hour,
-                minutes=timestamp.minute) - datetime.timedelta(days=365)
-
     def add_data(self, timestamp, received, sent):
-        bulk = []
-
-        for period in ('1m', '5m', '30m', '2h', '1d'):
-            bulk.append(pymongo.UpdateOne({
-                'server_id': self.server_id,
-                'period': period,
-                'timestamp': self._get_period_timestamp(period, timestamp),
-            }, {'$inc': {
-                'received': received,
-                'sent': sent,
-            }}, upsert=True))
-            bulk.append(pymongo.DeleteMany({
-                'server_id': self.server_id,
-                'period': period,
-                'timestamp': {
-                    '$lt': self._get_period_max_timestamp(period, timestamp),
-                },
-            }))
-
-        self.collection.bulk_write(bulk)
-
-    def get_period(self, period):
-        date_end = self._get_period_timestamp(period, utils.now())
-
-        if period == '1m':
-            date_start = date_end - datetime.timedelta(hours=6)
-            date_step = datetime.timedelta(minutes=1)
-        elif period == '5m':
-            date_start = date_end - datetime.timedelta(days=1)
-            date_step = datetime.timedelta(minutes=5)
-        elif period == '30m':
-            date_start = date_end - datetime.timedelta(days=7)
-            date_step = datetime.timedelta(minutes=30)
-        elif period == '2h':
-            date_start = date_end - datetime.timedelta(days=30)
-            date_step = datetime.timedelta(hours=2)
-        elif period == '1d':
-            date_start = date_end - datetime.timedelta(days=365)
-            date_step = datetime.timedelta(days=1)
-        date_cur = date_start
-
-        data = {
-            'received': [],
-            'received_total': 0,
-            'sent': [],
-            'sent_total': 0,
+        self.rollup.add(timestamp, {
+            'received': received,
+            'sent': sent,
+        })
+
+    def flush(self):
+        self.rollup.flush()
+
+    def get_period(self, period, downsample=None):
+        timestamps, columns = rollup.get_series(
+            'servers_bandwidth',
+            {'server_id': self.server_id},
+            period,
+            ('received', 'sent'),
+            downsample=downsample,
+        )
+
+        return {
+            'received': list(zip(timestamps, columns['received'])),
+            'received_total': sum(columns['received']),
+            'sent': list(zip(timestamps, columns['sent'])),
+            'sent_total': sum(columns['sent']),
         }
 
-        spec = {
-            'server_id': self.server_id,
-            'period': period,
-        }
-        project = {
-            'timestamp': True,
-            'received': True,
-            'sent': True,
-        }
-
-        for doc in self.collection.find(spec, project).sort('timestamp'):
-            if date_cur > doc['timestamp']:
-                continue
-
-            while date_cur < doc['timestamp']:
-                timestamp = int(date_cur.strftime('%s'))
-                data['received'].append((timestamp, 0))
-                data['sent'].append((timestamp, 0))
-                date_cur += date_step
-
-            timestamp = int(doc['timestamp'].strftime('%s'))
-            received = doc['received']
-            sent = doc['sent']
-            data['received'].append((timestamp, received))
-            data['sent'].append((timestamp, sent))
-            data['received_total'] += received
-            data['sent_total'] += sent
-            date_cur += date_step
-
-        while date_cur <= date_end:
-            timestamp = int(date_cur.strftime('%s'))
-            data['received'].append((timestamp, 0))
-            data['sent'].append((timestamp, 0))
-            date_cur += date_step
-
-        return data
-
     def get_period_random(self, period):
         date = utils.now()
         date -= datetime.timedelta(microseconds=date.microsecond,
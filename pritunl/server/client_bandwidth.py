@@ -0,0 +1,118 @@
+import threading
+import array
+import time
+
+class ClientBandwidth(object):
+    # Byte counters are stored in typed arrays indexed by a client slot.
+    # Slots of disconnected and expired clients are reused by new clients.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._free = []
+        self._client_ids = []
+        self._recv = array.array('Q')
+        self._sent = array.array('Q')
+        self._period_recv = array.array('Q')
+        self._period_sent = array.array('Q')
+        self._updated = array.array('d')
+        self.bytes_recv = 0
+        self.bytes_sent = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _add_slot(self, client_id):
+        if self._free:
+            slot = self._free.pop()
+            self._client_ids[slot] = client_id
+        else:
+            slot = len(self._client_ids)
+            self._client_ids.append(client_id)
+            self._recv.append(0)
+            self._sent.append(0)
+            self._period_recv.append(0)
+            self._period_sent.append(0)
+            self._updated.append(0)
+        self._slots[client_id] = slot
+        return slot
+
+    def update(self, client_id, bytes_recv, bytes_sent):
+        self._lock.acquire()
+        try:
+            slot = self._slots.get(client_id)
+            if slot is None:
+                slot = self._add_slot(client_id)
+
+            # Counters lower than the last value were reset by a
+            # reconnect, the new value is the traffic since the reset
+            delta_recv = bytes_recv - self._recv[slot]
+            if delta_recv < 0:
+                delta_recv = bytes_recv
+            delta_sent = bytes_sent - self._sent[slot]
+            if delta_sent < 0:
+                delta_sent = bytes_sent
+
+            self._recv[slot] = bytes_recv
+            self._sent[slot] = bytes_sent
+            self._period_recv[slot] += delta_recv
+            self._period_sent[slot] += delta_sent
+            self._updated[slot] = time.monotonic()
+
+            self.bytes_recv += delta_recv
+            self.bytes_sent += delta_sent
+        finally:
+            self._lock.release()
+
+        return delta_recv
+
+    def remove(self, client_id):
+        self._lock.acquire()
+        try:
+            self._remove_slot(client_id)
+        finally:
+            self._lock.release()
+
+    def _remove_slot(self, client_id):
+        slot = self._slots.pop(client_id, None)
+        if slot is None:
+            return
+        self._client_ids[slot] = None
+        self._recv[slot] = 0
+        self._sent[slot] = 0
+        self._period_recv[slot] = 0
+        self._period_sent[slot] = 0
+        self._free.append(slot)
+
+    def roll(self, ttl):
+        # Swaps the period arrays for zeroed arrays and returns the
+        # server totals with the period counters of each active client
+        expire = time.monotonic() - ttl
+
+        self._lock.acquire()
+        try:
+            zeros = bytes(len(self._client_ids) * 8)
+            period_recv = self._period_recv
+            period_sent = self._period_sent
+            self._period_recv = array.array('Q', zeros)
+            self._period_sent = array.array('Q', zeros)
+
+            client_ids = list(self._client_ids)
+            expired = [i for i, x in enumerate(self._updated)
+                if x < expire and client_ids[i] is not None]
+            for slot in expired:
+                self._remove_slot(client_ids[slot])
+                client_ids[slot] = None
+
+            bytes_recv = self.bytes_recv
+            bytes_sent = self.bytes_sent
+            self.bytes_recv = 0
+            self.bytes_sent = 0
+        finally:
+            self._lock.release()
+
+        clients = [(client_id, period_recv[i], period_sent[i])
+            for i, client_id in enumerate(client_ids)
+            if client_id is not None]
+
+        return bytes_recv, bytes_sent, clients
@@ -0,0 +1,218 @@
+from pritunl.constants import *
+from pritunl.helpers import *
+from pritunl import settings
+from pritunl import logger
+from pritunl import utils
+from pritunl import mongo
+
+import threading
+import time
+import pymongo
+
+# Ping timestamps of all instances running on this host are written
+# with one bulk write per interval
+_instances = {}
+_instances_lock = threading.Lock()
+_error_counts = {}
+_wake = threading.Event()
+
+def add_instance(instance):
+    _instances_lock.acquire()
+    try:
+        _instances[instance.id] = instance
+    finally:
+        _instances_lock.release()
+
+    # Ping new instances without waiting for the next interval
+    _wake.set()
+
+def remove_instance(instance):
+    _instances_lock.acquire()
+    try:
+        if _instances.get(instance.id) is instance:
+            _instances.pop(instance.id)
+        _error_counts.pop(instance.id, None)
+    finally:
+        _instances_lock.release()
+
+def _get_instances():
+    _instances_lock.acquire()
+    try:
+        instances = []
+        for instance in list(_instances.values()):
+            if instance.interrupt:
+                _instances.pop(instance.id)
+                _error_counts.pop(instance.id, None)
+            else:
+                instances.append(instance)
+        return instances
+    finally:
+        _instances_lock.release()
+
+def _stop_instance(instance):
+    try:
+        if instance.stop_process():
+            remove_instance(instance)
+            return True
+    except Exception:
+        logger.exception('Failed to stop server instance', 'server',
+            server_id=instance.server.id,
+            instance_id=instance.id,
+        )
+    return False
+
+def _find_lost(collection, instances):
+    # Bulk results only have totals, find the instances without a
+    # matching server doc
+    docs = {}
+    for doc in collection.find({
+                '_id': {'$in': [x.server.id for x in instances]},
+            }, {
+                '_id': True,
+                'availability_group': True,
+                'hosts': True,
+                'instances.instance_id': True,
+            }):
+        docs[doc['_id']] = doc
+
+    lost = []
+    for instance in instances:
+        doc = docs.get(instance.server.id)
+        if doc and doc.get('availability_group') == \
+                settings.local.host.availability_group and \
+                instance.id in [x.get('instance_id')
+                    for x in doc.get('instances') or []]:
+            continue
+        lost.append((instance, doc))
+
+    return lost
+
+def _ping_failed(instance, error_msg):
+    error_count = _error_counts.get(instance.id, 0) + 1
+    _error_counts[instance.id] = error_count
+
+    if error_count >= 10 and _stop_instance(instance):
+        logger.error(
+            'Failed to update server ping, stopping server',
+            'server',
+            server_id=instance.server.id,
+            instance_id=instance.id,
+            error=error_msg,
+        )
+        return
+
+    logger.error('Failed to update server ping',
+        'server',
+        server_id=instance.server.id,
+        instance_id=instance.id,
+        error=error_msg,
+    )
+
+def _ping(collection, instances):
+    timestamp = utils.now()
+    availability_group = settings.local.host.availability_group
+
+    bulk = []
+    for instance in instances:
+        bulk.append(pymongo.UpdateOne({
+            '_id': instance.server.id,
+            'availability_group': availability_group,
+            'instances.instance_id': instance.id,
+        }, {'$set': {
+            'instances.$.ping_timestamp': timestamp,
+        }}))
+
+    # Only the instances of the failed ops are charged with an error
+    failed = {}
+    try:
+        response = collection.bulk_write(bulk, ordered=False)
+        matched_count = response.matched_count
+    except pymongo.errors.BulkWriteError as error:
+        write_errors = error.details.get('writeErrors')
+        if not write_errors:
+            raise
+        for write_error in write_errors:
+            failed[write_error['index']] = write_error.get('errmsg')
+        matched_count = error.details.get('nMatched', 0)
+
+    pinged = []
+    for i, instance in enumerate(instances):
+        if i in failed:
+            _ping_failed(instance, failed[i])
+        else:
+            _error_counts.pop(instance.id, None)
+            pinged.append(instance)
+
+    if matched_count >= len(pinged):
+        return
+
+    for instance, doc in _find_lost(collection, pinged):
+        doc_hosts = ((doc or {}).get('hosts') or [])
+        if settings.local.host_id in doc_hosts and \
+                not instance.sock_interrupt:
+            logger.error(
+                'Instance doc lost, stopping server. ' +
+                'Check datetime settings',
+                'server',
+                server_id=instance.server.id,
+                instance_id=instance.id,
+                cur_timestamp=utils.now(),
+            )
+
+        _stop_instance(instance)
+
+def _wait(length):
+    while length > 0 and not check_global_interrupt():
+        if _wake.wait(min(0.5, length)):
+            break
+        length -= 0.5
+    _wake.clear()
+
+def _heartbeat(collection):
+    instances = _get_instances()
+    if not instances:
+        return
+
+    if settings.local.vpn_state == DISABLED:
+        logger.warning(
+            'VPN server disabled',
+            'server',
+            message=settings.local.notification,
+        )
+        for instance in instances:
+            _stop_instance(instance)
+        return
+
+    try:
+        _ping(collection, instances)
+    except Exception as error:
+        logger.exception('Failed to write server pings',
+            'server',
+            server_ids=[x.server.id for x in instances],
+        )
+        for instance in instances:
+            _ping_failed(instance, str(error))
+        time.sleep(2)
+
+@interrupter
+def _heartbeat_thread():
+    collection = mongo.get_collection('servers')
+
+    try:
+        while True:
+            yield _wait(settings.vpn.server_ping)
+
+            # One thread pings every instance on the host, errors must
+            # not end it
+            try:
+                _heartbeat(collection)
+            except Exception:
+                logger.exception('Error in server heartbeat', 'server')
+                time.sleep(1)
+    except GeneratorExit:
+        for instance in _get_instances():
+            _stop_instance(instance)
+
+def start_heartbeat():
+    threading.Thread(name="ServerHeartbeat",
+        target=_heartbeat_thread).start()
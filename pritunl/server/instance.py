@@ -1,6 +1,7 @@
 from pritunl.server.instance_com import ServerInstanceCom
 from pritunl.server.instance_link import ServerInstanceLink
 from pritunl.server.bridge import add_interface, rem_interface
+from pritunl.server import heartbeat
 
 from pritunl.constants import *
 from pritunl.exceptions import *
@@ -28,6 +29,7 @@ import threading
 import traceback
 import re
 import pymongo
+import pyroute2.netlink
 import datetime
 import pwd
 import grp
@@ -51,6 +53,7 @@ class ServerInstance(object):
         self.wg_started = False
         self.wg_private_key = None
         self.wg_public_key = None
+        self.wg_peers = None
         self.bridge_interface = None
         self.primary_user = None
         self.process = None
@@ -63,8 +66,6 @@ class ServerInstance(object):
         self.route_advertisements = set()
         self._temp_path = utils.get_temp_path()
         self.ovpn_conf_path = os.path.join(self._temp_path, OVPN_CONF_NAME)
-        self.wg_private_key_path = os.path.join(
-            self._temp_path, WG_PRIVATE_KEY_NAME)
         self.management_socket_path = os.path.join(
             settings.conf.var_run_path,
             MANAGEMENT_SOCKET_NAME % self.id,
@@ -169,6 +170,8 @@ class ServerInstance(object):
         finally:
             _instances_lock.release()
 
+        heartbeat.remove_instance(self)
+
     def tables_add(self, vxlan_addr, vxlan_addr6, network):
         if ':' in network:
             if vxlan_addr6 == self.vxlan.vxlan_addr6:
@@ -1276,85 +1279,6 @@ class ServerInstance(object):
         except GeneratorExit:
             self.stop_process()
 
-    @interrupter
-    def _keep_alive_thread(self):
-        try:
-            error_count = 0
-
-            while not self.interrupt:
-                if settings.local.vpn_state == DISABLED:
-                    logger.warning(
-                        'VPN server disabled',
-                        'server',
-                        message=settings.local.notification,
-                    )
-                    if self.stop_process():
-                        return
-                    continue
-
-                try:
-                    doc = self.collection.find_one_and_update({
-                        '_id': self.server.id,
-                        'availability_group': \
-                            settings.local.host.availability_group,
-                        'instances.instance_id': self.id,
-                    }, {'$set': {
-                        'instances.$.ping_timestamp': utils.now(),
-                    }}, {
-                        '_id': False,
-                        'instances': True,
-                    }, return_document=True)
-
-                    yield
-
-                    if not doc:
-                        doc = self.collection.find_one({
-                            '_id': self.server.id,
-                        })
-
-                        doc_hosts = ((doc or {}).get('hosts') or [])
-                        if settings.local.host_id in doc_hosts and \
-                                not self.sock_interrupt:
-                            logger.error(
-                                'Instance doc lost, stopping server. ' +
-                                'Check datetime settings',
-                                'server',
-                                server_id=self.server.id,
-                                instance_id=self.id,
-                                cur_timestamp=utils.now(),
-                            )
-
-                        if self.stop_process():
-                            break
-                        else:
-                            time.sleep(1)
-                            continue
-                    else:
-                        error_count = 0
-
-                    yield
-                except GeneratorExit:
-                    self.stop_process()
-                except:
-                    error_count += 1
-                    if error_count >= 10 and self.stop_process():
-                        logger.exception(
-                            'Failed to update server ping, stopping server',
-                            'server',
-                            server_id=self.server.id,
-                        )
-                        break
-
-                    logger.exception('Failed to update server ping',
-                        'server',
-                        server_id=self.server.id,
-                    )
-                    time.sleep(2)
-
-                yield interrupter_sleep(settings.vpn.server_ping)
-        except GeneratorExit:
-            self.stop_process()
-
     @interrupter
     def _route_ad_keep_alive_thread(self):
         try:
@@ -1528,56 +1452,22 @@ class ServerInstance(object):
         self.wg_started = True
 
         try:
-            utils.check_call_silent([
-                'ip', 'link',
-                'add', 'dev', 'wgh0',
-                'type', 'wireguard',
-            ])
-        except subprocess.CalledProcessError:
+            utils.add_link('wgh0', 'wireguard')
+        except pyroute2.netlink.exceptions.NetlinkError:
             pass
 
-        try:
-            private_key = utils.check_output_logged([
-                'wg', 'genkey',
-            ])
-        except subprocess.CalledProcessError:
-            logger.exception('Failed to generate wg private key', 'server',
-                server_id=self.server.id,
-            )
-            raise
-
-        try:
-            public_key = utils.check_output_logged([
-                'wg', 'pubkey',
-            ], input=private_key)
-        except subprocess.CalledProcessError:
-            logger.exception('Failed to get wg public key', 'server',
-                server_id=self.server.id,
-            )
-            raise
-
-        with open(self.wg_private_key_path, 'w') as privatekey_file:
-            os.chmod(self.ovpn_conf_path, 0o600)
-            privatekey_file.write(private_key)
-
-        self.wg_private_key = private_key.strip()
-        self.wg_public_key = public_key.strip()
+        private_key, public_key = utils.generate_wg_key()
+        self.wg_private_key = private_key
+        self.wg_public_key = public_key
 
         try:
-            utils.check_call_silent([
-                'ip', 'link',
-                'del', 'dev', self.interface_wg,
-            ])
-        except subprocess.CalledProcessError:
+            utils.del_link(self.interface_wg)
+        except pyroute2.netlink.exceptions.NetlinkError:
             pass
 
         try:
-            utils.check_output_logged([
-                'ip', 'link',
-                'add', 'dev', self.interface_wg,
-                'type', 'wireguard',
-            ])
-        except subprocess.CalledProcessError:
+            utils.add_link(self.interface_wg, 'wireguard')
+        except pyroute2.netlink.exceptions.NetlinkError:
             logger.exception('Failed to add wg interface', 'server',
                 server_id=self.server.id,
             )
@@ -1585,23 +1475,15 @@ class ServerInstance(object):
 
         if self.server.mss_fix:
             try:
-                utils.check_call_silent([
-                    'ip', 'link',
-                    'set', 'dev', self.interface_wg,
-                    'mtu', '%s' % self.server.mss_fix,
-                ])
-            except subprocess.CalledProcessError:
+                utils.set_link(self.interface_wg, mtu=self.server.mss_fix)
+            except pyroute2.netlink.exceptions.NetlinkError:
                 pass
 
         server_addr = utils.get_network_gateway_cidr(
             self.server.network_wg)
         try:
-            utils.check_output_logged([
-                'ip', 'address',
-                'add', 'dev', self.interface_wg,
-                server_addr,
-            ])
-        except subprocess.CalledProcessError:
+            utils.add_link_address(self.interface_wg, server_addr)
+        except pyroute2.netlink.exceptions.NetlinkError:
             logger.exception('Failed to add wg ip', 'server',
                 server_id=self.server.id,
             )
@@ -1612,35 +1494,27 @@ class ServerInstance(object):
                 self.server.network6_wg)
 
             try:
-                utils.check_output_logged([
-                    'ip', '-6', 'address',
-                    'add', 'dev', self.interface_wg,
-                    server_addr6,
-                ])
-            except subprocess.CalledProcessError:
+                utils.add_link_address(self.interface_wg, server_addr6)
+            except pyroute2.netlink.exceptions.NetlinkError:
                 logger.exception('Failed to add wg ipv6', 'server',
                     server_id=self.server.id,
                 )
                 raise
 
         try:
-            utils.check_output_logged([
-                'wg', 'set', self.interface_wg,
-                'listen-port', '%s' % self.server.port_wg,
-                'private-key', self.wg_private_key_path,
-            ])
-        except subprocess.CalledProcessError:
+            utils.wg_set_device(self.interface_wg, self.wg_private_key,
+                self.server.port_wg)
+        except pyroute2.netlink.exceptions.NetlinkError:
             logger.exception('Failed to configure wg', 'server',
                 server_id=self.server.id,
             )
             raise
 
+        self.wg_peers = utils.WgPeerQueue(self.interface_wg)
+
         try:
-            utils.check_output_logged([
-                'ip', 'link',
-                'set', self.interface_wg, 'up',
-            ])
-        except subprocess.CalledProcessError:
+            utils.set_link(self.interface_wg, state='up')
+        except pyroute2.netlink.exceptions.NetlinkError:
             logger.exception('Failed to start wg interface', 'server',
                 server_id=self.server.id,
             )
@@ -1650,46 +1524,34 @@ class ServerInstance(object):
         if not self.wg_started:
             return
 
+        self.wg_peers = None
+
         try:
-            utils.check_output_logged([
-                'ip', 'link',
-                'set', self.interface_wg, 'down',
-            ])
-        except subprocess.CalledProcessError:
+            utils.set_link(self.interface_wg, state='down')
+        except pyroute2.netlink.exceptions.NetlinkError:
             logger.exception('Failed to stop wg interface', 'server',
                 server_id=self.server.id,
             )
 
         try:
-            utils.check_output_logged([
-                'ip', 'link',
-                'del', 'dev', self.interface_wg,
-            ])
-        except subprocess.CalledProcessError:
+            utils.del_link(self.interface_wg)
+        except pyroute2.netlink.exceptions.NetlinkError:
             logger.exception('Failed to del wg interface', 'server',
                 server_id=self.server.id,
             )
 
     def connect_wg(self, wg_public_key, virt_address, virt_address6,
             network_links, network_links6):
-        allowed_ips = virt_address.split('/')[0] + '/32'
+        allowed_ips = [virt_address.split('/')[0] + '/32']
         if self.server.ipv6 and virt_address6:
-            allowed_ips += ',' + virt_address6.split('/')[0] + '/128'
-
-        for network_link in network_links:
-            allowed_ips += ',' + network_link
+            allowed_ips.append(virt_address6.split('/')[0] + '/128')
 
-        for network_link in network_links6:
-            allowed_ips += ',' + network_link
+        allowed_ips += network_links
+        allowed_ips += network_links6
 
         try:
-            utils.check_output_logged([
-                'wg', 'set', self.interface_wg,
-                'peer', wg_public_key,
-                'persistent-keepalive', '10',
-                'allowed-ips', allowed_ips,
-            ])
-        except subprocess.CalledProcessError:
+            self.wg_peers.add_peer(wg_public_key, allowed_ips, 10)
+        except pyroute2.netlink.exceptions.NetlinkError:
             logger.exception('Failed to add wg peer', 'server',
                 server_id=self.server.id,
             )
@@ -1698,14 +1560,14 @@ class ServerInstance(object):
     def disconnect_wg(self, wg_public_key, reason=""):
         self.server.output.push_message('wg-client-kill "%s"' % reason)
         for i in range(10):
+            wg_peers = self.wg_peers
+            if not wg_peers:
+                break
+
             try:
-                utils.check_output_logged([
-                    'wg', 'set', self.interface_wg,
-                    'peer', wg_public_key,
-                    'remove',
-                ])
+                wg_peers.remove_peer(wg_public_key)
                 break
-            except subprocess.CalledProcessError:
+            except pyroute2.netlink.exceptions.NetlinkError:
                 if i < 9:
                     logger.exception(
                         'Failed to remove wg peer, retrying...',
@@ -1729,10 +1591,7 @@ class ServerInstance(object):
         thread.daemon = True
         thread.start()
 
-        thread = threading.Thread(name="InstanceKeepAlive",
-            target=self._keep_alive_thread)
-        thread.daemon = True
-        thread.start()
+        heartbeat.add_instance(self)
 
         thread = threading.Thread(name="InstanceRouteKeepAlive",
             target=self._route_ad_keep_alive_thread)
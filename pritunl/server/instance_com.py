@@ -1,4 +1,5 @@
 from pritunl.server.listener import *
+from pritunl.server.client_bandwidth import ClientBandwidth
 
 from pritunl.constants import *
 from pritunl.helpers import *
@@ -14,7 +15,6 @@ from pritunl import plugins
 
 import os
 import time
-import datetime
 import threading
 import socket
 import uuid
@@ -28,13 +28,9 @@ class ServerInstanceCom(object):
         self.sock = None
         self.sock_lock = threading.Lock()
         self.socket_path = instance.management_socket_path
-        self.bytes_lock = threading.Lock()
-        self.bytes_recv = 0
-        self.bytes_sent = 0
         self.client = None
         self.clients = clients.Clients(svr, instance, self)
-        self.client_bytes = {}
-        self.client_bytes_period = {}
+        self.client_bandwidth = ClientBandwidth()
         self.cur_timestamp = utils.now()
         self.bandwidth_rate = settings.vpn.bandwidth_update_rate
 
@@ -67,124 +63,166 @@ class ServerInstanceCom(object):
         self.server.output.push_message(message)
 
     def parse_bytecount(self, client_id, bytes_recv, bytes_sent):
-        self.bytes_lock.acquire()
-        try:
-            _, bytes_recv_prev, bytes_sent_prev = self.client_bytes.get(
-                client_id, (None, 0, 0))
+        self.client_bandwidth.update(client_id, bytes_recv, bytes_sent)
+
+    def _parse_tls_id(self, env_val):
+        tls_env = ''.join(x for x in env_val.decode('utf-8', 'replace')
+            if x in VALID_CHARS)
+        o_index = tls_env.find('O=')
+        cn_index = tls_env.find('CN=')
+
+        if o_index < 0 or cn_index < 0:
+            self.send_client_deny(self.client['client_id'],
+                self.client.get('key_id'),
+                'Failed to parse org_id and user_id')
+            self.client = None
+            return
 
-            cur_bytes_recv, cur_bytes_sent = self.client_bytes_period.get(
-                client_id, (0, 0))
+        if o_index > cn_index:
+            org_id = tls_env[o_index + 2:]
+            user_id = tls_env[3:o_index]
+        else:
+            org_id = tls_env[2:cn_index]
+            user_id = tls_env[cn_index + 3:]
 
-            self.client_bytes[client_id] = (
-                self.cur_timestamp, bytes_recv, bytes_sent)
-            self.client_bytes_period[client_id] = (
-                cur_bytes_recv + (bytes_recv - bytes_recv_prev),
-                cur_bytes_sent + (bytes_sent - bytes_sent_prev),
-            )
+        self.client['org_id'] = database.ParseObjectId(org_id)
+        self.client['user_id'] = database.ParseObjectId(user_id)
 
-            self.bytes_recv += bytes_recv - bytes_recv_prev
-            self.bytes_sent += bytes_sent - bytes_sent_prev
-        finally:
-            self.bytes_lock.release()
+    def _parse_remote_ip6(self, env_val):
+        remote_ip = utils.filter_str(env_val.decode('utf-8', 'replace'))
+        if remote_ip.startswith('::ffff:'):
+            remote_ip = remote_ip.split(':')[-1]
+        self.client['remote_ip'] = remote_ip
+
+    def _parse_platform(self, env_val):
+        if self.client.get('platform'):
+            return
+        env_val = env_val.decode('utf-8', 'replace')
+        if 'chrome' in env_val.lower():
+            env_val = 'chrome'
+            self.client['device_id'] = uuid.uuid4().hex
+            self.client['device_name'] = 'chrome-os'
+        self.client['platform'] = utils.filter_str(env_val)
+
+    def _parse_username(self, env_val):
+        self.client['username'] = utils.filter_str(
+            env_val.decode('utf-8', 'replace'))[:128]
+
+    def _parse_password(self, env_val):
+        self.client['password'] = env_val.decode('utf-8', 'replace')
+
+    _env_fields = {
+        b'IV_HWADDR': 'mac_addr',
+        b'untrusted_ip': 'remote_ip',
+        b'IV_VER': 'ovpn_ver',
+        b'UV_ID': 'device_id',
+        b'UV_NAME': 'device_name',
+        b'UV_PLATFORM': 'platform',
+        b'UV_PRITUNL_VER': 'client_ver',
+    }
+
+    _env_handlers = {
+        b'tls_id_0': _parse_tls_id,
+        b'untrusted_ip6': _parse_remote_ip6,
+        b'IV_PLAT': _parse_platform,
+        b'username': _parse_username,
+        b'password': _parse_password,
+    }
+
+    def _parse_client_env(self, line):
+        if line == b'>CLIENT:ENV,END':
+            cmd = self.client['cmd']
+            if cmd == 'connect':
+                self.clients.connect(self.client)
+            elif cmd == 'reauth':
+                self.clients.connect(self.client, reauth=True)
+            elif cmd == 'connected':
+                self.clients.connected(self.client.get('client_id'))
+            elif cmd == 'disconnected':
+                self.clients.disconnected(self.client.get('client_id'))
+            self.client = None
+            return
+
+        # Only the values of used keys are decoded
+        env_key, _, env_val = line[12:].partition(b'=')
+
+        field = self._env_fields.get(env_key)
+        if field:
+            self.client[field] = utils.filter_str(
+                env_val.decode('utf-8', 'replace'))
+            return
+
+        handler = self._env_handlers.get(env_key)
+        if handler:
+            handler(self, env_val)
+
+    def _parse_client_connect(self, line):
+        _, client_id, key_id = line.split(b',')
+        self.client = {
+            'cmd': 'connect',
+            'client_id': client_id.decode(),
+            'key_id': key_id.decode(),
+        }
+
+    def _parse_client_reauth(self, line):
+        _, client_id, key_id = line.split(b',')
+        self.client = {
+            'cmd': 'reauth',
+            'client_id': client_id.decode(),
+            'key_id': key_id.decode(),
+        }
+
+    def _parse_client_established(self, line):
+        _, client_id = line.split(b',')
+        self.client = {
+            'cmd': 'connected',
+            'client_id': client_id.decode(),
+        }
+
+    def _parse_client_disconnect(self, line):
+        _, client_id = line.split(b',')
+        self.client = {
+            'cmd': 'disconnected',
+            'client_id': client_id.decode(),
+        }
+
+    def _parse_bytecount_cli(self, line):
+        client_id, bytes_recv, bytes_sent = line[15:].split(b',')
+        self.parse_bytecount(client_id.decode(), int(bytes_recv),
+            int(bytes_sent))
+
+    def _parse_success(self, line):
+        self.push_output('COM> %s' % line.decode('utf-8', 'replace'))
+
+    _line_handlers = {
+        b'>CLIENT:CONNECT': _parse_client_connect,
+        b'>CLIENT:REAUTH': _parse_client_reauth,
+        b'>CLIENT:ESTABLISHED': _parse_client_established,
+        b'>CLIENT:DISCONNECT': _parse_client_disconnect,
+        b'>BYTECOUNT_CLI': _parse_bytecount_cli,
+        b'SUCCESS': _parse_success,
+    }
 
     def parse_line(self, line):
+        # Messages are dispatched on the tag before the first comma,
+        # tags followed by a colon such as BYTECOUNT_CLI fall back to
+        # the tag before the first colon
+        tag = line.split(b',', 1)[0]
+
         if self.client:
-            if line == '>CLIENT:ENV,END':
-                cmd = self.client['cmd']
-                if cmd == 'connect':
-                    self.clients.connect(self.client)
-                elif cmd == 'reauth':
-                    self.clients.connect(self.client, reauth=True)
-                elif cmd == 'connected':
-                    self.clients.connected(self.client.get('client_id'))
-                elif cmd == 'disconnected':
-                    self.clients.disconnected(self.client.get('client_id'))
-                self.client = None
-            elif line.startswith('>CLIENT:ENV'):
-                env_key, env_val = line[12:].split('=', 1)
-                if env_key == 'tls_id_0':
-                    tls_env = ''.join(x for x in env_val if x in VALID_CHARS)
-                    o_index = tls_env.find('O=')
-                    cn_index = tls_env.find('CN=')
-
-                    if o_index < 0 or cn_index < 0:
-                        self.send_client_deny(self.client,
-                            'Failed to parse org_id and user_id')
-                        self.client = None
-                        return
-
-                    if o_index > cn_index:
-                        org_id = tls_env[o_index + 2:]
-                        user_id = tls_env[3:o_index]
-                    else:
-                        org_id = tls_env[2:cn_index]
-                        user_id = tls_env[cn_index + 3:]
-
-                    self.client['org_id'] = database.ParseObjectId(org_id)
-                    self.client['user_id'] = database.ParseObjectId(user_id)
-                elif env_key == 'IV_HWADDR':
-                    self.client['mac_addr'] = utils.filter_str(env_val)
-                elif env_key == 'untrusted_ip':
-                    self.client['remote_ip'] = utils.filter_str(env_val)
-                elif env_key == 'untrusted_ip6':
-                    remote_ip = utils.filter_str(env_val)
-                    if remote_ip.startswith('::ffff:'):
-                        remote_ip = remote_ip.split(':')[-1]
-                    self.client['remote_ip'] = remote_ip
-                elif env_key == 'IV_PLAT' and not self.client.get('platform'):
-                    if 'chrome' in env_val.lower():
-                        env_val = 'chrome'
-                        self.client['device_id'] = uuid.uuid4().hex
-                        self.client['device_name'] = 'chrome-os'
-                    self.client['platform'] = utils.filter_str(env_val)
-                elif env_key == 'IV_VER':
-                    self.client['ovpn_ver'] = utils.filter_str(env_val)
-                elif env_key == 'UV_ID':
-                    self.client['device_id'] = utils.filter_str(env_val)
-                elif env_key == 'UV_NAME':
-                    self.client['device_name'] = utils.filter_str(env_val)
-                elif env_key == 'UV_PLATFORM':
-                    self.client['platform'] = utils.filter_str(env_val)
-                elif env_key == 'UV_PRITUNL_VER':
-                    self.client['client_ver'] = utils.filter_str(env_val)
-                elif env_key == 'username':
-                    self.client['username'] = utils.filter_str(env_val)[:128]
-                elif env_key == 'password':
-                    self.client['password'] = env_val
+            if tag == b'>CLIENT:ENV':
+                self._parse_client_env(line)
             else:
-                self.push_output('CCOM> %s' % line[1:])
-        elif line.startswith('>BYTECOUNT_CLI'):
-            client_id, bytes_recv, bytes_sent = line.split(',')
-            client_id = client_id.split(':')[1]
-            self.parse_bytecount(client_id, int(bytes_recv), int(bytes_sent))
-        elif line.startswith('>CLIENT:CONNECT'):
-            _, client_id, key_id = line.split(',')
-            self.client = {
-                'cmd': 'connect',
-                'client_id': client_id,
-                'key_id': key_id,
-            }
-        elif line.startswith('>CLIENT:REAUTH'):
-            _, client_id, key_id = line.split(',')
-            self.client = {
-                'cmd': 'reauth',
-                'client_id': client_id,
-                'key_id': key_id,
-            }
-        elif line.startswith('>CLIENT:ESTABLISHED'):
-            _, client_id = line.split(',')
-            self.client = {
-                'cmd': 'connected',
-                'client_id': client_id,
-            }
-        elif line.startswith('>CLIENT:DISCONNECT'):
-            _, client_id = line.split(',')
-            self.client = {
-                'cmd': 'disconnected',
-                'client_id': client_id,
-            }
-        elif line.startswith('SUCCESS:'):
-            self.push_output('COM> %s' % line)
+                self.push_output('CCOM> %s' % line[1:].decode(
+                    'utf-8', 'replace'))
+            return
+
+        handler = self._line_handlers.get(tag)
+        if handler is None:
+            handler = self._line_handlers.get(tag.split(b':', 1)[0])
+            if handler is None:
+                return
+        handler(self, line)
 
     def wait_for_socket(self):
         for _ in range(10000):
@@ -253,68 +291,87 @@ class ServerInstanceCom(object):
             for network in networks:
                 self.instance.tables_add(vxlan_addr, vxlan_addr6, network)
 
+    def update_wg_peers(self):
+        # Handshakes and transfer counters of all peers are read in one
+        # dump, a peer that received data since the last dump is alive
+        peers = utils.wg_dump(self.instance.interface_wg)
+        cur_time = time.time()
+
+        for wg_public_key, (handshake, bytes_recv, bytes_sent) in \
+                peers.items():
+            if self.clients.clients.find_id(wg_public_key,
+                    view=True) is None:
+                continue
+
+            if self.client_bandwidth.update(
+                    wg_public_key, bytes_recv, bytes_sent):
+                self.clients.ping_wg_peer(wg_public_key, cur_time)
+            elif handshake:
+                self.clients.ping_wg_peer(wg_public_key, handshake)
+
     @interrupter
     def _watch_thread(self):
         try:
             while True:
                 self.cur_timestamp = utils.now()
-                timestamp_ttl = self.cur_timestamp - datetime.timedelta(
-                    seconds=180)
-
-                for client_id, (timestamp, _, _) in list(
-                        self.client_bytes.items()):
-                    if timestamp < timestamp_ttl:
-                        self.client_bytes.pop(client_id, None)
-                        self.client_bytes_period.pop(client_id, None)
-                    else:
-                        self.bytes_lock.acquire()
-                        bytes_sent, bytes_recv = self.client_bytes_period.get(
-                            client_id, (0, 0))
-                        self.client_bytes_period[client_id] = (0, 0)
-                        self.bytes_lock.release()
-
-                        client = self.clients.get_client(client_id)
-                        if client:
-                            monitoring.insert_point('user_bandwidth', {
-                                'org_id': client.get('org_id'),
-                                'org_name': client.get('org_name'),
-                                'user_id': client.get('user_id'),
-                                'user_name': client.get('user_name'),
-                                'device_id': utils.filter_str2(
-                                    client.get('device_id')),
-                                'device_name': utils.filter_str2(
-                                    client.get('device_name')),
-                            }, {
-                                'bytes_sent': bytes_sent,
-                                'bytes_recv': bytes_recv,
-                            })
-
-                            plugins.event(
-                                'user_bandwidth',
-                                host_id=settings.local.host.id,
-                                host_name=settings.local.host.name,
-                                server_id=self.server.id,
-                                server_name=self.server.name,
-                                org_id=client.get('org_id'),
-                                org_name=client.get('org_name'),
-                                user_id=client.get('user_id'),
-                                user_name=client.get('user_name'),
-                                device_id=client.get('device_id'),
-                                device_name=client.get('device_name'),
-                                remote_ip=client.get('real_address'),
-                                virtual_ip=client.get('virt_address'),
-                                virtual_ip6=client.get('virt_address6'),
-                                timestamp=self.cur_timestamp,
-                                bytes_sent=bytes_sent,
-                                bytes_recv=bytes_recv,
-                            )
+                if self.instance.wg_peers:
+                    try:
+                        self.update_wg_peers()
+                    except:
+                        logger.exception('Failed to read wg peers', 'server',
+                            server_id=self.server.id,
+                            instance_id=self.instance.id,
+                        )
+
+                bytes_recv, bytes_sent, client_bytes = \
+                    self.client_bandwidth.roll(180)
+
+                has_events = plugins.has_event('user_bandwidth')
+                points = []
+                bandwidth_events = []
+
+                for client_id, client_recv, client_sent in client_bytes:
+                    client = self.clients.clients.find_id(
+                        client_id, view=True)
+                    if not client:
+                        continue
 
-                self.bytes_lock.acquire()
-                bytes_recv = self.bytes_recv
-                bytes_sent = self.bytes_sent
-                self.bytes_recv = 0
-                self.bytes_sent = 0
-                self.bytes_lock.release()
+                    points.append(({
+                        'org_id': client.get('org_id'),
+                        'org_name': client.get('org_name'),
+                        'user_id': client.get('user_id'),
+                        'user_name': client.get('user_name'),
+                        'device_id': utils.filter_str2(
+                            client.get('device_id')),
+                        'device_name': utils.filter_str2(
+                            client.get('device_name')),
+                    }, {
+                        'bytes_sent': client_recv,
+                        'bytes_recv': client_sent,
+                    }))
+
+                    if has_events:
+                        bandwidth_events.append({
+                            'host_id': settings.local.host.id,
+                            'host_name': settings.local.host.name,
+                            'server_id': self.server.id,
+                            'server_name': self.server.name,
+                            'org_id': client.get('org_id'),
+                            'org_name': client.get('org_name'),
+                            'user_id': client.get('user_id'),
+                            'user_name': client.get('user_name'),
+                            'device_id': client.get('device_id'),
+                            'device_name': client.get('device_name'),
+                            'remote_ip': client.get('real_address'),
+                            'virtual_ip': client.get('virt_address'),
+                            'virtual_ip6': client.get('virt_address6'),
+                            'timestamp': self.cur_timestamp,
+                            'bytes_sent': client_recv,
+                            'bytes_recv': client_sent,
+                        })
+
+                monitoring.insert_points('user_bandwidth', points)
+                plugins.events('user_bandwidth', bandwidth_events)
 
                 monitoring.insert_point('server_bandwidth', {
                     'host': settings.local.host.name,
@@ -331,12 +388,13 @@ class ServerInstanceCom(object):
                     'device_count': self.clients.clients.count({}),
                 })
 
-                if bytes_recv != 0 or bytes_sent != 0:
-                    self.server.bandwidth.add_data(
-                        utils.now(), bytes_recv, bytes_sent)
+                # Called on every tick to close the rollup windows
+                self.server.bandwidth.add_data(
+                    utils.now(), bytes_recv, bytes_sent)
 
                 yield interrupter_sleep(self.bandwidth_rate)
                 if self.instance.sock_interrupt:
+                    self.server.bandwidth.flush()
                     return
         except GeneratorExit:
             raise
@@ -359,10 +417,10 @@ class ServerInstanceCom(object):
 
             add_listener(self.instance.id, self.on_msg)
 
-            data = ''
+            data = bytearray()
             while True:
-                data += self.sock.recv(SOCKET_BUFFER).decode()
-                if not data or self.instance.sock_interrupt:
+                buf = self.sock.recv(SOCKET_BUFFER)
+                if not buf or self.instance.sock_interrupt:
                     if not self.instance.sock_interrupt and \
                             not check_global_interrupt():
                         self.instance.stop_process()
@@ -370,21 +428,34 @@ class ServerInstanceCom(object):
                             'ERROR Management socket exited unexpectedly')
                         logger.error('Management socket exited unexpectedly')
                     return
-                lines = data.split('\n')
-                data = lines.pop()
-                for line in lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        self.parse_line(line)
-                    except:
-                        logger.exception('Failed to parse line from vpn com',
-                            'server',
-                            server_id=self.server.id,
-                            instance_id=self.instance.id,
-                            line=line,
-                        )
+
+                # Remaining data has no newline, only the received
+                # bytes need to be scanned
+                scan = len(data)
+                data += buf
+                end = data.find(b'\n', scan)
+                if end < 0:
+                    continue
+
+                start = 0
+                with memoryview(data) as view:
+                    while end >= 0:
+                        line = view[start:end].tobytes().strip()
+                        start = end + 1
+                        end = data.find(b'\n', start)
+                        if not line:
+                            continue
+                        try:
+                            self.parse_line(line)
+                        except:
+                            logger.exception(
+                                'Failed to parse line from vpn com',
+                                'server',
+                                server_id=self.server.id,
+                                instance_id=self.instance.id,
+                                line=line.decode('utf-8', 'replace'),
+                            )
+                del data[:start]
         except:
             if not self.instance.sock_interrupt:
                 self.push_output('ERROR Management socket exception')
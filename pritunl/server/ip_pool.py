@@ -7,6 +7,7 @@ from pritunl import settings
 from pritunl import utils
 
 import pymongo
+import time
 
 class ServerIpPool:
     def __init__(self, server):
@@ -145,88 +146,155 @@ class ServerIpPool:
             'user_id': '',
         }})
 
-    def assign_ip_pool_org(self, org_id):
-        org = organization.get_by_id(org_id)
+    def _bulk_assign_pass(self, users):
         network_hash = self.server.network_hash
         server_id = self.server.id
-        org_id = org.id
-        ip_pool_avial = True
-        pool_end = False
 
-        network = ipaddress.IPv4Network(self.server.network)
-        network_start = self.server.network_start
-        network_end = self.server.network_end
-        if network_start:
-            network_start = ipaddress.IPv4Address(network_start)
-        if network_end:
-            network_end = ipaddress.IPv4Address(network_end)
-
-        ip_pool = self.get_ip_pool(network, network_start)
-        if not ip_pool:
-            return
-
-        try:
-            doc = self.collection.find({
-                'network': network_hash,
-                'server_id': server_id,
-            }).sort('_id', pymongo.DESCENDING)[0]
-            if doc:
-                last_addr = doc['_id']
+        user_ids = [x[1] for x in users]
+        assigned = set(self.collection.find({
+            'server_id': server_id,
+            'network': network_hash,
+            'user_id': {'$in': user_ids},
+        }, {
+            'user_id': True,
+        }).distinct('user_id'))
 
-                for remote_ip_addr in ip_pool:
-                    if int(remote_ip_addr) == last_addr:
-                        break
-                    if network_end and remote_ip_addr > network_end:
-                        break
-        except IndexError:
-            pass
+        pending = [x for x in users if x[1] not in assigned]
+        if not pending:
+            return [], False
 
         bulk = []
+        bulk_users = []
+        pool_end = False
 
-        for user in org.iter_users(include_pool=True):
-            if user.type != CERT_CLIENT:
-                continue
-
-            if ip_pool_avial:
-                response = self.collection.update_one({
-                    'network': network_hash,
-                    'server_id': server_id,
-                    'user_id': {'$exists': False},
-                }, {'$set': {
-                    'org_id': org_id,
-                    'user_id': user.id,
-                }})
-                if bool(response.modified_count):
-                    continue
-                ip_pool_avial = False
-
-            try:
-                remote_ip_addr = next(ip_pool)
-                if network_end and remote_ip_addr > network_end:
-                    raise StopIteration()
-            except StopIteration:
-                pool_end = True
-                break
-            doc_id = int(remote_ip_addr)
+        cursor = self.collection.find({
+            'network': network_hash,
+            'server_id': server_id,
+            'user_id': {'$exists': False},
+        }, {
+            '_id': True,
+        }).sort('_id', pymongo.ASCENDING).limit(len(pending))
 
+        for doc in cursor:
+            org_id, user_id = pending[len(bulk)]
             bulk.append(pymongo.UpdateOne({
-                '_id': doc_id,
+                '_id': doc['_id'],
+                'user_id': {'$exists': False},
             }, {'$set': {
-                '_id': doc_id,
-                'network': network_hash,
-                'server_id': server_id,
                 'org_id': org_id,
-                'user_id': user.id,
-                'address': '%s/%s' % (remote_ip_addr, network.prefixlen),
-            }}, upsert=True))
+                'user_id': user_id,
+            }}))
+            bulk_users.append(user_id)
+
+        if len(bulk) < len(pending):
+            network = ipaddress.IPv4Network(self.server.network)
+            network_start = self.server.network_start
+            network_end = self.server.network_end
+            if network_start:
+                network_start = ipaddress.IPv4Address(network_start)
+            if network_end:
+                network_end = ipaddress.IPv4Address(network_end)
+
+            ip_pool = self.get_ip_pool(network, network_start)
+            if not ip_pool:
+                pool_end = True
+            else:
+                try:
+                    doc = self.collection.find({
+                        'network': network_hash,
+                        'server_id': server_id,
+                    }).sort('_id', pymongo.DESCENDING)[0]
+                    if doc:
+                        last_addr = doc['_id']
+                        for remote_ip_addr in ip_pool:
+                            if int(remote_ip_addr) == last_addr:
+                                break
+                            if network_end and remote_ip_addr > network_end:
+                                break
+                except IndexError:
+                    pass
+
+                for org_id, user_id in pending[len(bulk):]:
+                    try:
+                        remote_ip_addr = next(ip_pool)
+                        if network_end and remote_ip_addr > network_end:
+                            raise StopIteration()
+                    except StopIteration:
+                        pool_end = True
+                        break
+
+                    bulk.append(pymongo.InsertOne({
+                        '_id': int(remote_ip_addr),
+                        'network': network_hash,
+                        'server_id': server_id,
+                        'org_id': org_id,
+                        'user_id': user_id,
+                        'address': '%s/%s' % (
+                            remote_ip_addr, network.prefixlen),
+                    }))
+                    bulk_users.append(user_id)
 
         if bulk:
-            self.collection.bulk_write(bulk)
+            try:
+                self.collection.bulk_write(bulk, ordered=True)
+            except pymongo.errors.BulkWriteError:
+                pass
+
+        assigned = set(self.collection.find({
+            'server_id': server_id,
+            'network': network_hash,
+            'user_id': {'$in': bulk_users},
+        }, {
+            'user_id': True,
+        }).distinct('user_id'))
+
+        return [x for x in pending if x[1] not in assigned], pool_end
+
+    def bulk_assign_ip_addr(self, users):
+        start = time.time()
+        users = list(users)
+        if not users:
+            return True
+
+        remaining, pool_end = self._bulk_assign_pass(users)
+        if remaining and not pool_end:
+            remaining, pool_end = self._bulk_assign_pass(remaining)
+
+        count = len(users) - len(remaining)
+        if remaining and not pool_end:
+            for org_id, user_id in remaining:
+                if not self.assign_ip_addr(org_id, user_id):
+                    pool_end = True
+                    break
+                count += 1
+
+        if count:
+            duration = max(time.time() - start, 0.001)
+            logger.info('Bulk assigned ip addresses', 'server',
+                server_id=self.server.id,
+                count=count,
+                duration=round(duration, 3),
+                rate=int(count / duration),
+            )
 
-        if pool_end:
+        return not pool_end
+
+    def assign_ip_pool_org(self, org_id):
+        org = organization.get_by_id(org_id)
+
+        users = []
+        for doc in self.users_collection.find({
+                    'org_id': org.id,
+                    'type': CERT_CLIENT,
+                }, {
+                    '_id': True,
+                }):
+            users.append((org.id, doc['_id']))
+
+        if not self.bulk_assign_ip_addr(users):
             logger.warning('Failed to assign ip addresses ' +
                 'to org, ip pool empty', 'server',
-                org_id=org_id,
+                org_id=org.id,
             )
 
     def unassign_ip_pool_org(self, org_id):
@@ -358,13 +426,19 @@ class ServerIpPool:
 
         self.collection.bulk_write(bulk)
 
-        for user_id in user_ids - user_ip_ids:
-            doc = self.users_collection.find_one(user_id, {
-                'org_id': True,
-            })
-            if doc:
-                if not self.assign_ip_addr(doc['org_id'], user_id):
-                    break
+        missing_ids = list(user_ids - user_ip_ids)
+        if not missing_ids:
+            return
+
+        users = []
+        for doc in self.users_collection.find({
+                    '_id': {'$in': missing_ids},
+                }, {
+                    'org_id': True,
+                }):
+            users.append((doc['org_id'], doc['_id']))
+
+        self.bulk_assign_ip_addr(users)
 
     def get_ip_addr(self, org_id, user_id):
         doc = self.collection.find_one({
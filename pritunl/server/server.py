@@ -626,11 +626,8 @@ class Server(mongo.MongoObject):
         return certs
 
     def initialize(self):
-        self.generate_tls_auth_start()
-        try:
-            self.generate_dh_param()
-        finally:
-            self.generate_tls_auth_wait()
+        self.generate_tls_auth()
+        self.generate_dh_param()
 
     def generate_auth_key(self):
         if self.auth_public_key and self.auth_private_key and \
@@ -1563,6 +1560,13 @@ class Server(mongo.MongoObject):
             'type': 'dh_params',
             'server_id': self.id,
         })
+        if settings.vpn.dh_param_mode == 'ffdhe' and \
+                self.dh_param_bits in FFDHE_PARAMS:
+            if doc:
+                queue.stop(doc['_id'])
+            self.dh_params = FFDHE_PARAMS[self.dh_param_bits]
+            return
+
         if doc:
             if doc['dh_param_bits'] != self.dh_param_bits:
                 queue.stop(doc['_id'])
@@ -1580,36 +1584,8 @@ class Server(mongo.MongoObject):
 
         self.queue_dh_params()
 
-    def generate_tls_auth_start(self):
-        self.tls_auth_temp_path = utils.get_temp_path()
-        self.tls_auth_path = os.path.join(
-            self.tls_auth_temp_path, TLS_AUTH_NAME)
-
-        os.makedirs(self.tls_auth_temp_path)
-        args = [
-            'openvpn', '--genkey',
-            '--secret', self.tls_auth_path,
-        ]
-        try:
-            self.tls_auth_process = subprocess.Popen(args,
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except:
-            utils.rmtree(self.tls_auth_temp_path)
-            raise
-
-    def generate_tls_auth_wait(self):
-        try:
-            return_code = self.tls_auth_process.wait()
-            if return_code:
-                raise ValueError('Popen returned ' +
-                    'error exit code %r' % return_code)
-            self.read_file('tls_auth_key', self.tls_auth_path)
-        finally:
-            utils.rmtree(self.tls_auth_temp_path)
-
     def generate_tls_auth(self):
-        self.generate_tls_auth_start()
-        self.generate_tls_auth_wait()
+        self.tls_auth_key = utils.generate_static_key().rstrip('\n')
 
     def generate_ca_cert(self):
         ca_certificate = ''
@@ -1702,7 +1678,9 @@ class Server(mongo.MongoObject):
 
         if not self.dh_params:
             self.generate_dh_param()
-            return
+            if not self.dh_params:
+                return
+            self.commit('dh_params')
 
         if not self.organizations:
             raise ServerMissingOrg('Server cannot be started ' + \
@@ -1837,7 +1815,7 @@ class Server(mongo.MongoObject):
 
         if not used_resources:
             used_resources = get_used_resources(self.id)
-        network_used = used_resources['networks']
+        network_used = utils.NetworkTrie(used_resources['networks'])
         port_used = used_resources['ports']
 
         if self.status == ONLINE and not allow_online:
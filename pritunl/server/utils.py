@@ -115,10 +115,69 @@ def iter_servers(spec=None, fields=None, page=None):
     for doc in cursor:
         yield Server(doc=doc, fields=fields)
 
+def _load_servers_counts(svrs):
+    online_ids = [x.id for x in svrs if x.status == ONLINE]
+    org_ids = set()
+    for svr in svrs:
+        org_ids.update(svr.organizations or [])
+
+    clients_count = {}
+    if online_ids:
+        for doc in Server.clients_collection.aggregate([
+                    {'$match': {
+                        'server_id': {'$in': online_ids},
+                        'type': CERT_CLIENT,
+                    }},
+                    {'$group': {
+                        '_id': {
+                            'server_id': '$server_id',
+                            'user_id': '$user_id',
+                        },
+                        'devices': {'$sum': 1},
+                    }},
+                    {'$group': {
+                        '_id': '$_id.server_id',
+                        'users': {'$sum': 1},
+                        'devices': {'$sum': '$devices'},
+                    }},
+                ]):
+            clients_count[doc['_id']] = (doc['users'], doc['devices'])
+
+    org_user_count = {}
+    if org_ids:
+        for doc in mongo.get_collection('users').aggregate([
+                    {'$match': {
+                        'type': CERT_CLIENT,
+                        'org_id': {'$in': list(org_ids)},
+                    }},
+                    {'$group': {
+                        '_id': '$org_id',
+                        'count': {'$sum': 1},
+                    }},
+                ]):
+            org_user_count[doc['_id']] = doc['count']
+
+    for svr in svrs:
+        if svr.status == ONLINE:
+            svr.users_online, svr.devices_online = clients_count.get(
+                svr.id, (0, 0))
+        else:
+            svr.users_online = 0
+            svr.devices_online = 0
+
+        svr.user_count = sum(org_user_count.get(x, 0)
+            for x in set(svr.organizations or []))
+
 def iter_servers_dict(page=None):
     fields = {key: True for key in dict_fields}
 
-    for svr in iter_servers(fields=fields, page=page):
+    # Load the client and user counts of the page in two aggregations
+    # rather than three queries for each server
+    svrs = list(iter_servers(fields=fields, page=page))
+    if svrs:
+        _load_servers_counts(svrs)
+
+    for svr in svrs:
         yield svr.dict()
 
 def get_server_page_total():
@@ -143,8 +202,8 @@ def output_link_clear(server_id):
     ServerOutputLink(server_id).clear_output(
         [x['server_id'] for x in svr.links])
 
-def bandwidth_get(server_id, period):
-    return ServerBandwidth(server_id).get_period(period)
+def bandwidth_get(server_id, period, downsample=None):
+    return ServerBandwidth(server_id).get_period(period, downsample)
 
 def bandwidth_random_get(server_id, period):
     return ServerBandwidth(server_id).get_period_random(period)
@@ -6,6 +6,7 @@ class SettingsApp(SettingsGroupMongo):
         'secondary_mongodb_uri': None,
         'redis_uri': None,
         'redis_timeout': 6,
+        'redis_queue_size': 2048,
         'server_debug': False,
         'server_ssl': True,
         'server_port': 443,
@@ -31,6 +32,12 @@ class SettingsApp(SettingsGroupMongo):
         'influxdb_token': None,
         'influxdb_prefix': 'pritunl_',
         'influxdb_interval': 3,
+        'influxdb_timeout': 10,
+        'influxdb_batch_size': 5000,
+        'influxdb_batch_bytes': 1048576,
+        'influxdb_queue_size': 50000,
+        'influxdb_spool_path': '/var/lib/pritunl/influxdb_spool',
+        'influxdb_spool_size': 67108864,
         'settings_check_interval': 60,
         'key_link_timeout': 86400,
         'key_link_timeout_short': 600,
@@ -65,6 +72,7 @@ class SettingsApp(SettingsGroupMongo):
         'auth_expire_window': 86400,
         'auth_limiter_ttl': 600,
         'auth_limiter_count_max': 30,
+        'auth_limiter_sync_rate': 1,
         'wg_public_key_ttl': 7776000,
         'org_pool_size': 1,
         'user_pool_size': 6,
@@ -161,6 +169,8 @@ class SettingsApp(SettingsGroupMongo):
         'org_page_count': 5,
         'server_page_count': 3,
         'link_page_count': 10,
+        'link_topology_ttl': 5,
+        'link_heartbeat_rate': 1,
         'host_page_count': 10,
         'acme_api_url': 'https://acme-v02.api.letsencrypt.org/directory',
         'acme_timestamp': None,
@@ -10,4 +10,6 @@ class SettingsMongo(SettingsGroupMongo):
         'task_max_attempts': 3,
         'task_ttl': 30,
         'cursor_stall_ttl': 60,
+        'change_stream': True,
+        'subscriber_queue_size': 2048,
     }
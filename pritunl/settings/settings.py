@@ -21,6 +21,7 @@ class Settings(object):
     def __init__(self):
         self._running = False
         self._loaded = False
+        self._callbacks = []
         self._init_modules()
 
     @cached_static_property
@@ -37,6 +38,17 @@ class Settings(object):
 
         return groups
 
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def _run_callbacks(self):
+        for callback in self._callbacks:
+            try:
+                callback()
+            except:
+                from pritunl import logger
+                logger.exception('Error in settings callback', 'settings')
+
     def on_msg(self, msg):
         docs = msg['message']
 
@@ -47,6 +59,8 @@ class Settings(object):
                     continue
                 setattr(group, field, val)
 
+        self._run_callbacks()
+
     def commit(self, init=False):
         from pritunl import messenger
         from pritunl import mongo
@@ -115,6 +129,8 @@ class Settings(object):
 
             group.__dict__.update(data)
 
+        self._run_callbacks()
+
     def _init_modules(self):
         for cls in module_classes:
             if cls.type == GROUP_MONGO:
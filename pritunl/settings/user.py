@@ -19,6 +19,7 @@ class SettingsUser(SettingsGroupMongo):
         'cert_message_digest': 'sha256',
         'cert_expire_days': 10000,
         'page_count': 10,
+        'search_count_limit': 1000,
         'skip_remote_sso_check': False,
         'conf_sync': True,
         'restrict_import': False,
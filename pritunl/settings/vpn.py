@@ -12,6 +12,7 @@ class SettingsVpn(SettingsGroupMongo):
         'peer_limit': 300,
         'peer_limit_timeout': 10,
         'default_dh_param_bits': 2048,
+        'dh_param_mode': 'generate',
         'max_routes_per_client': 1024,
         'otp_cache': False,
         'otp_cache_timeout': 28800,
@@ -25,6 +26,9 @@ class SettingsVpn(SettingsGroupMongo):
         'dns_mapping_push_all_apple': False,
         'http_request_timeout': 10,
         'op_timeout': 25,
+        'client_write_delay': 5,
+        'client_write_batch': 500,
+        'org_cache_size': 1024,
         'startup_timeout': 300,
         'link_timeout': 10,
         'firewall_connect_timeout': 180,
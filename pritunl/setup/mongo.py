@@ -132,6 +132,23 @@ def upsert_indexes():
         ('org_id', pymongo.ASCENDING),
         ('name', pymongo.ASCENDING),
     ], background=True)
+    upsert_index('users', [
+        ('org_id', pymongo.ASCENDING),
+        ('search_terms', pymongo.ASCENDING),
+    ], background=True)
+    upsert_index('users', [
+        ('org_id', pymongo.ASCENDING),
+        ('type', pymongo.ASCENDING),
+        ('name', pymongo.ASCENDING),
+        ('_id', pymongo.ASCENDING),
+    ], background=True)
+    upsert_index('users', [
+        ('org_id', pymongo.ASCENDING),
+        ('type', pymongo.ASCENDING),
+        ('last_active', pymongo.ASCENDING),
+        ('name', pymongo.ASCENDING),
+        ('_id', pymongo.ASCENDING),
+    ], background=True)
     upsert_index('users', [
         ('name', pymongo.ASCENDING),
         ('auth_type', pymongo.ASCENDING),
@@ -193,6 +210,10 @@ def upsert_indexes():
         ('host_id', pymongo.ASCENDING),
         ('timestamp', pymongo.ASCENDING),
     ], background=True)
+    upsert_index('hosts_usage', [
+        ('period', pymongo.ASCENDING),
+        ('timestamp', pymongo.ASCENDING),
+    ], background=True)
     upsert_index('servers', 'name', background=True)
     upsert_index('servers', 'ping_timestamp',
         background=True)
@@ -209,6 +230,10 @@ def upsert_indexes():
         ('period', pymongo.ASCENDING),
         ('timestamp', pymongo.ASCENDING),
     ], background=True)
+    upsert_index('servers_bandwidth', [
+        ('period', pymongo.ASCENDING),
+        ('timestamp', pymongo.ASCENDING),
+    ], background=True)
     upsert_index('servers_ip_pool', [
         ('server_id', pymongo.ASCENDING),
         ('user_id', pymongo.ASCENDING),
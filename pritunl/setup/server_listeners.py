@@ -1,5 +1,6 @@
 from pritunl import listener
 from pritunl import callbacks
+from pritunl import objcache
 
 def setup_server_listeners():
     from pritunl import vxlan
@@ -7,3 +8,4 @@ def setup_server_listeners():
     listener.add_listener('client', callbacks.on_client)
     listener.add_listener('client_links', callbacks.on_client_link)
     listener.add_listener('vxlan', vxlan.on_vxlan)
+    listener.add_listener('events', objcache.on_msg)
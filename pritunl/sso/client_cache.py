@@ -0,0 +1,195 @@
+from pritunl import settings
+from pritunl import mongo
+from pritunl import utils
+from pritunl import messenger
+from pritunl import logger
+from pritunl import objcache
+
+import threading
+import hashlib
+import time
+import pymongo
+
+_entries = objcache.ObjCache(ttl=3600, capacity=65536)
+_entries_lock = threading.Lock()
+_pending = {}
+_pending_lock = threading.Lock()
+_pending_thread = None
+_flush_lock = threading.Lock()
+
+def _hash_token(auth_token):
+    return hashlib.sha256(auth_token.encode()).hexdigest()
+
+def _get_ttl():
+    return settings.app.sso_client_cache_timeout + \
+        settings.app.sso_client_cache_window
+
+def _set_entry(user_id, server_id, device_id, device_name, token_hash,
+        timestamp):
+    _entries_lock.acquire()
+    try:
+        devices = _entries.get(user_id)
+        if devices is None:
+            devices = {}
+        else:
+            devices = devices.copy()
+        devices[(server_id, device_id, device_name)] = (token_hash, timestamp)
+        _entries.set(user_id, devices)
+    finally:
+        _entries_lock.release()
+
+def _flush():
+    global _pending
+
+    # Held across the swap and write so a clear cannot run between
+    # them and have its delete undone by the upserts
+    _flush_lock.acquire()
+    try:
+        _pending_lock.acquire()
+        try:
+            if not _pending:
+                return
+            pending = _pending
+            _pending = {}
+        finally:
+            _pending_lock.release()
+
+        bulk = []
+        for doc in pending.values():
+            bulk.append(pymongo.ReplaceOne({
+                'user_id': doc['user_id'],
+                'server_id': doc['server_id'],
+                'device_id': doc['device_id'],
+                'device_name': doc['device_name'],
+            }, doc, upsert=True))
+
+        mongo.get_collection('sso_client_cache').bulk_write(
+            bulk, ordered=False)
+    finally:
+        _flush_lock.release()
+
+def _clear_pending(user_id):
+    _pending_lock.acquire()
+    try:
+        for key in list(_pending.keys()):
+            if key[0] == user_id:
+                _pending.pop(key, None)
+    finally:
+        _pending_lock.release()
+
+def _flush_thread():
+    while True:
+        time.sleep(1)
+        try:
+            _flush()
+        except:
+            logger.exception('Error writing sso client cache', 'sso')
+
+def check_client_cache(user_id, server_id, device_id, device_name,
+        auth_token):
+    devices = _entries.get(user_id)
+    if devices:
+        entry = devices.get((server_id, device_id, device_name))
+        if entry and entry[0] == _hash_token(auth_token) and \
+                time.time() - entry[1] < _get_ttl():
+            return True
+
+    doc = mongo.get_collection('sso_client_cache').find_one({
+        'user_id': user_id,
+        'server_id': server_id,
+        'device_id': device_id,
+        'device_name': device_name,
+        'auth_token': auth_token,
+    })
+    if not doc:
+        return False
+
+    timestamp = doc.get('timestamp')
+    if timestamp:
+        timestamp = time.time() - (
+            utils.now() - timestamp).total_seconds()
+    else:
+        timestamp = time.time()
+
+    _set_entry(user_id, server_id, device_id, device_name,
+        _hash_token(auth_token), timestamp)
+
+    return True
+
+def update_client_cache(user_id, server_id, device_id, device_name,
+        auth_token):
+    global _pending_thread
+
+    token_hash = _hash_token(auth_token)
+    _set_entry(user_id, server_id, device_id, device_name, token_hash,
+        time.time())
+
+    _pending_lock.acquire()
+    try:
+        _pending[(user_id, server_id, device_id, device_name)] = {
+            'user_id': user_id,
+            'server_id': server_id,
+            'device_id': device_id,
+            'device_name': device_name,
+            'auth_token': auth_token,
+            'timestamp': utils.now(),
+        }
+
+        if _pending_thread is None:
+            _pending_thread = threading.Thread(name="SsoClientCache",
+                target=_flush_thread)
+            _pending_thread.daemon = True
+            _pending_thread.start()
+    finally:
+        _pending_lock.release()
+
+    messenger.publish('tokens', 'client_cache', extra={
+        'user_id': user_id,
+        'server_id': server_id,
+        'device_id': device_id,
+        'device_name': device_name,
+        'token_hash': token_hash,
+    })
+
+def clear_client_cache(user_id):
+    _flush_lock.acquire()
+    try:
+        _clear_pending(user_id)
+        _entries.remove(user_id)
+
+        mongo.get_collection('sso_client_cache').delete_many({
+            'user_id': user_id,
+        })
+    finally:
+        _flush_lock.release()
+
+    messenger.publish('tokens', 'client_cache_clear', extra={
+        'user_id': user_id,
+    })
+
+def on_client_cache_msg(msg):
+    message = msg['message']
+    user_id = msg.get('user_id')
+    if not user_id:
+        return
+
+    if message == 'client_cache_clear':
+        _flush_lock.acquire()
+        try:
+            _clear_pending(user_id)
+            _entries.remove(user_id)
+        finally:
+            _flush_lock.release()
+    elif message == 'client_cache':
+        token_hash = msg.get('token_hash')
+        if not token_hash:
+            return
+
+        _set_entry(
+            user_id,
+            msg.get('server_id'),
+            msg.get('device_id'),
+            msg.get('device_name'),
+            token_hash,
+            time.time(),
+        )
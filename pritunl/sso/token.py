@@ -4,6 +4,7 @@ from pritunl import listener
 from pritunl import utils
 from pritunl import settings
 from pritunl import mongo
+from pritunl.sso.client_cache import on_client_cache_msg
 
 import threading
 import datetime
@@ -62,3 +63,4 @@ def check_token(token, user_id, server_id):
 
 def init_token():
     listener.add_listener('tokens', _on_msg)
+    listener.add_listener('tokens', on_client_cache_msg)
@@ -2,6 +2,8 @@ import pritunl.tasks.acme_update
 import pritunl.tasks.clean_ip_pool
 import pritunl.tasks.clean_client_pool
 import pritunl.tasks.clean_users
+import pritunl.tasks.user_search_terms
+import pritunl.tasks.org_user_count
 import pritunl.tasks.clean_network_links
 import pritunl.tasks.clean_network_lock
 import pritunl.tasks.pooler
@@ -12,3 +14,4 @@ import pritunl.tasks.host
 import pritunl.tasks.link
 import pritunl.tasks.clean_servers
 import pritunl.tasks.clean_vxlans
+import pritunl.tasks.clean_rollups
@@ -0,0 +1,13 @@
+from pritunl import rollup
+from pritunl import utils
+from pritunl import task
+
+class TaskCleanRollups(task.Task):
+    type = 'clean_rollups'
+
+    def task(self):
+        timestamp = utils.now()
+        rollup.clean('servers_bandwidth', timestamp)
+        rollup.clean('hosts_usage', timestamp)
+
+task.add_task(TaskCleanRollups, minutes=range(13, 60, 30))
@@ -0,0 +1,54 @@
+from pritunl.constants import *
+from pritunl.helpers import *
+from pritunl import mongo
+from pritunl import task
+
+import pymongo
+
+class TaskOrgUserCount(task.Task):
+    type = 'org_user_count'
+    ttl = 300
+
+    @cached_static_property
+    def user_collection(cls):
+        return mongo.get_collection('users')
+
+    @cached_static_property
+    def org_collection(cls):
+        return mongo.get_collection('organizations')
+
+    def task(self):
+        # Correct drift in the incrementally maintained org user counts
+        org_user_count = {}
+        for doc in self.user_collection.aggregate([
+                    {'$match': {
+                        'type': CERT_CLIENT,
+                    }},
+                    {'$group': {
+                        '_id': '$org_id',
+                        'count': {'$sum': 1},
+                    }},
+                ]):
+            org_user_count[doc['_id']] = doc['count']
+
+        bulk = []
+        for doc in self.org_collection.find({
+                    'user_count': {'$exists': True},
+                }, {
+                    '_id': True,
+                    'user_count': True,
+                }):
+            user_count = org_user_count.get(doc['_id'], 0)
+            if doc['user_count'] == user_count:
+                continue
+
+            bulk.append(pymongo.UpdateOne({
+                '_id': doc['_id'],
+            }, {'$set': {
+                'user_count': user_count,
+            }}))
+
+        if bulk:
+            self.org_collection.bulk_write(bulk, ordered=False)
+
+task.add_task(TaskOrgUserCount, minutes=range(11, 60, 15))
@@ -0,0 +1,42 @@
+from pritunl.helpers import *
+from pritunl import mongo
+from pritunl import task
+from pritunl import utils
+
+import pymongo
+
+class TaskUserSearchTerms(task.Task):
+    type = 'user_search_terms'
+    ttl = 300
+
+    @cached_static_property
+    def user_collection(cls):
+        return mongo.get_collection('users')
+
+    def task(self):
+        while True:
+            cursor = self.user_collection.find({
+                'search_terms': {'$exists': False},
+            }, {
+                '_id': True,
+                'name': True,
+                'email': True,
+            }).limit(500)
+
+            bulk = []
+            for doc in cursor:
+                bulk.append(pymongo.UpdateOne({
+                    '_id': doc['_id'],
+                    'search_terms': {'$exists': False},
+                }, {'$set': {
+                    'search_terms': utils.get_search_terms(
+                        doc.get('name'), doc.get('email')),
+                }}))
+
+            if not bulk:
+                break
+
+            self.user_collection.bulk_write(bulk, ordered=False)
+
+task.add_task(TaskUserSearchTerms, minutes=range(4, 60, 10),
+    run_on_start=True)
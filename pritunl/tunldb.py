@@ -1,5 +1,5 @@
-import queue
 import time
+import heapq
 import collections
 import threading
 import uuid
@@ -28,37 +28,120 @@ TRANSACTION_METHODS = {
 }
 CHANNEL_TTL = 120
 CHANNEL_BUFFER = 128
+LOG_FLUSH_DELAY = 0.05
+LOG_COMPACT_MIN = 10000
+LOG_METHODS = TRANSACTION_METHODS | {'_expire_at'}
+
+def _mutation(func):
+    name = func.__name__
+
+    def _wrapped(self, *args, **kwargs):
+        if not self._path:
+            return func(self, *args, **kwargs)
+
+        self._lock.acquire()
+        try:
+            self._depth += 1
+            try:
+                result = func(self, *args, **kwargs)
+            finally:
+                self._depth -= 1
+
+            if not self._depth and not self._replaying:
+                self._log_op(name, args, kwargs, result)
+        finally:
+            self._lock.release()
+
+        return result
+
+    _wrapped.__name__ = name
+    return _wrapped
 
 class TunlDB(object):
     def __init__(self, strict=True):
         self._path = None
-        self._set_queue = queue.Queue()
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._replaying = False
+        self._log_id = None
+        self._log_ops = []
+        self._log_count = 0
+        self._log_event = threading.Event()
         self._data = collections.defaultdict(
             lambda: {'ttl': None, 'val': None})
-        self._timers = {}
+        self._expire_heap = []
+        self._expire_cond = threading.Condition()
+        self._expire_thread = None
         self._channels = collections.defaultdict(
             lambda: {'subs': set(), 'msgs': collections.deque(
                 maxlen=CHANNEL_BUFFER), 'timer': None})
         self._commit_log = []
         self._strict = strict
 
-    def _put_queue(self):
-        if self._path:
-            self._set_queue.put('set')
+    def _log_op(self, name, args, kwargs, result):
+        if name == 'set_pop':
+            if result is None:
+                return
+            name = 'set_remove'
+            args = (args[0], result)
+            kwargs = {}
+        elif name == 'expire':
+            name = '_expire_at'
+            args = (args[0], self._data[args[0]]['ttl'])
+            kwargs = {}
+
+        self._log_ops.append((name, args, kwargs))
+        self._log_event.set()
 
     def _export_thread(self):
         while True:
-            try:
-                self._set_queue.get(timeout=5)
-            except queue.Empty:
+            if not self._log_event.wait(5):
                 continue
-            # Attempt to get more db sets form queue to reduce export calls
-            for _ in range(50):
-                try:
-                    self._set_queue.get(timeout=0.01)
-                except queue.Empty:
-                    pass
-            self.export_data()
+            # Wait briefly to group more operations into each write
+            time.sleep(LOG_FLUSH_DELAY)
+            self._log_event.clear()
+            self.flush_log()
+
+    def _expire_runner(self):
+        while True:
+            self._expire_cond.acquire()
+            try:
+                while not self._expire_heap:
+                    self._expire_cond.wait()
+
+                ttl_time, key = self._expire_heap[0]
+                delay = ttl_time / 1000.0 - time.time()
+                if delay > 0:
+                    self._expire_cond.wait(delay)
+                    continue
+
+                heapq.heappop(self._expire_heap)
+            finally:
+                self._expire_cond.release()
+
+            self._lock.acquire()
+            try:
+                data = self._data.get(key)
+                if data and data['ttl'] == ttl_time:
+                    self.remove(key)
+            finally:
+                self._lock.release()
+
+    def _schedule_expire(self, key, ttl_time):
+        self._expire_cond.acquire()
+        try:
+            heapq.heappush(self._expire_heap, (ttl_time, key))
+
+            if self._expire_thread is None:
+                self._expire_thread = threading.Thread(name="TunlExpire",
+                    target=self._expire_runner)
+                self._expire_thread.daemon = True
+                self._expire_thread.start()
+
+            if self._expire_heap[0][1] == key:
+                self._expire_cond.notify()
+        finally:
+            self._expire_cond.release()
 
     def _validate(self, value):
         if not self._strict:
@@ -78,10 +161,10 @@ class TunlDB(object):
             export_thread.daemon = True
             export_thread.start()
 
+    @_mutation
     def set(self, key, value):
         self._validate(value)
         self._data[key]['val'] = value
-        self._put_queue()
 
     def get(self, key):
         data = self._data.get(key)
@@ -91,31 +174,27 @@ class TunlDB(object):
     def exists(self, key):
         return key in self._data
 
+    @_mutation
     def rename(self, key, new_key):
         data = self._data.get(key)
         if data:
             self._data[new_key]['val'] = data['val']
             self.remove(key)
-            self._put_queue()
 
+    @_mutation
     def remove(self, key):
         self._data.pop(key, None)
-        self._put_queue()
 
+    @_mutation
     def expire(self, key, ttl):
-        ttl_time = int(time.time() * 1000) + int(ttl * 1000)
-
-        cur_timer = self._timers.pop(key, None)
-        if cur_timer:
-            cur_timer.cancel()
-        timer = threading.Timer(ttl, self.remove, (key,))
-        timer.daemon = True
-        self._timers[key] = timer
-        timer.start()
+        self._expire_at(key, int(time.time() * 1000) + int(ttl * 1000))
 
+    @_mutation
+    def _expire_at(self, key, ttl_time):
         self._data[key]['ttl'] = ttl_time
-        self._put_queue()
+        self._schedule_expire(key, ttl_time)
 
+    @_mutation
     def increment(self, key):
         value = '1'
         data = self._data.get(key)
@@ -127,9 +206,9 @@ class TunlDB(object):
                 data['val'] = value
         else:
             self._data[key]['val'] = value
-        self._put_queue()
         return value
 
+    @_mutation
     def decrement(self, key):
         value = '-1'
         data = self._data.get(key)
@@ -141,12 +220,12 @@ class TunlDB(object):
                 data['val'] = value
         else:
             self._data[key]['val'] = value
-        self._put_queue()
         return value
 
     def keys(self):
         return set(self._data)
 
+    @_mutation
     def set_add(self, key, element):
         self._validate(element)
         data = self._data.get(key)
@@ -157,24 +236,23 @@ class TunlDB(object):
                 data['val'] = {element}
         else:
             self._data[key]['val'] = {element}
-        self._put_queue()
 
+    @_mutation
     def set_remove(self, key, element):
         data = self._data.get(key)
         if data:
             try:
                 data['val'].remove(element)
-                self._put_queue()
             except (KeyError, AttributeError):
                 pass
 
+    @_mutation
     def set_pop(self, key):
         value = None
         data = self._data.get(key)
         if data:
             try:
                 value = data['val'].pop()
-                self._put_queue()
             except (KeyError, AttributeError):
                 pass
         return value
@@ -215,6 +293,7 @@ class TunlDB(object):
                 pass
         return 0
 
+    @_mutation
     def list_lpush(self, key, value):
         self._validate(value)
         data = self._data.get(key)
@@ -225,8 +304,8 @@ class TunlDB(object):
                 data['val'] = collections.deque([value])
         else:
             self._data[key]['val'] = collections.deque([value])
-        self._put_queue()
 
+    @_mutation
     def list_rpush(self, key, value):
         self._validate(value)
         data = self._data.get(key)
@@ -237,26 +316,25 @@ class TunlDB(object):
                 data['val'] = collections.deque([value])
         else:
             self._data[key]['val'] = collections.deque([value])
-        self._put_queue()
 
+    @_mutation
     def list_lpop(self, key):
         value = None
         data = self._data.get(key)
         if data:
             try:
                 value = data['val'].popleft()
-                self._put_queue()
             except (AttributeError, IndexError):
                 pass
         return value
 
+    @_mutation
     def list_rpop(self, key):
         value = None
         data = self._data.get(key)
         if data:
             try:
                 value = data['val'].pop()
-                self._put_queue()
             except (AttributeError, IndexError):
                 pass
         return value
@@ -297,6 +375,7 @@ class TunlDB(object):
             except TypeError:
                 pass
 
+    @_mutation
     def list_remove(self, key, value, count=1):
         self._validate(value)
         data = self._data.get(key)
@@ -312,8 +391,7 @@ class TunlDB(object):
                         data['val'].remove(value)
                 except (AttributeError, ValueError):
                     pass
-            self._put_queue()
-
+    
     def list_length(self, key):
         data = self._data.get(key)
         if data:
@@ -323,6 +401,7 @@ class TunlDB(object):
                 pass
         return 0
 
+    @_mutation
     def dict_set(self, key, field, value):
         self._validate(value)
         data = self._data.get(key)
@@ -333,7 +412,6 @@ class TunlDB(object):
                 data['val'] = {field: value}
         else:
             self._data[key]['val'] = {field: value}
-        self._put_queue()
 
     def dict_get(self, key, field):
         data = self._data.get(key)
@@ -343,6 +421,7 @@ class TunlDB(object):
             except TypeError:
                 pass
 
+    @_mutation
     def dict_remove(self, key, field):
         data = self._data.get(key)
         if data:
@@ -350,8 +429,7 @@ class TunlDB(object):
                 data['val'].pop(field, None)
             except AttributeError:
                 pass
-            self._put_queue()
-
+    
     def dict_keys(self, key):
         data = self._data.get(key)
         if data:
@@ -449,54 +527,97 @@ class TunlDB(object):
         return TunlDBTransaction(self)
 
     def _apply_trans(self, trans):
-        for call in trans[1]:
-            getattr(self, call[0])(*call[1], **call[2])
+        self._lock.acquire()
+        try:
+            for call in trans[1]:
+                getattr(self, call[0])(*call[1], **call[2])
+            try:
+                self._commit_log.remove(trans)
+            except ValueError:
+                pass
+        finally:
+            self._lock.release()
+
+    def flush_log(self):
+        if not self._path:
+            return
+
+        self._lock.acquire()
         try:
-            self._commit_log.remove(trans)
-        except ValueError:
-            pass
-        self._put_queue()
+            log_ops = self._log_ops
+            self._log_ops = []
+            if not log_ops:
+                return
+
+            with open(self._path + '.log', 'a') as log_file:
+                for op in log_ops:
+                    log_file.write(json.dumps(op) + '\n')
+
+            self._log_count += len(log_ops)
+            if self._log_count >= max(LOG_COMPACT_MIN, len(self._data) * 2):
+                self.export_data()
+        finally:
+            self._lock.release()
 
     def export_data(self):
         if not self._path:
             return
         temp_path = self._path + '_%s.tmp' % uuid.uuid4().hex
-        try:
-            data = self._data.copy()
-            timers = list(self._timers.keys())
-            commit_log = copy.copy(self._commit_log)
+        log_path = self._path + '.log'
+        log_id = uuid.uuid4().hex
 
+        self._lock.acquire()
+        try:
             with open(temp_path, 'w') as db_file:
                 os.chmod(temp_path, 0o600)
                 export_data = []
+                timers = []
 
-                for key in data:
-                    key_ttl = data[key]['ttl']
-                    key_val = data[key]['val']
+                for key in self._data:
+                    key_ttl = self._data[key]['ttl']
+                    key_val = self._data[key]['val']
                     key_type = type(key_val).__name__
                     if key_type == 'set' or key_type == 'deque':
                         key_val = list(key_val)
                     export_data.append((key, key_type, key_ttl, key_val))
+                    if key_ttl:
+                        timers.append(key)
 
                 db_file.write(json.dumps({
                     'ver': 1,
+                    'log_id': log_id,
                     'data': export_data,
                     'timers': timers,
-                    'commit_log': commit_log,
+                    'commit_log': self._commit_log,
                 }))
             os.rename(temp_path, self._path)
+
+            # Operations already applied are part of the snapshot, a log
+            # with a different id is ignored on import
+            with open(log_path, 'w') as log_file:
+                os.chmod(log_path, 0o600)
+                log_file.write(json.dumps({'log_id': log_id}) + '\n')
+
+            self._log_id = log_id
+            self._log_ops = []
+            self._log_count = 0
         except:
             try:
                 os.remove(temp_path)
             except OSError:
                 pass
             raise
+        finally:
+            self._lock.release()
 
     def import_data(self):
+        log_id = None
+
         if os.path.isfile(self._path):
             with open(self._path, 'r') as db_file:
                 import_data = json.loads(db_file.read())
                 data = import_data['data']
+                log_id = import_data.get('log_id')
 
                 for key_data in data:
                     key = key_data[0]
@@ -514,27 +635,40 @@ class TunlDB(object):
                         'val': key_val,
                     }
 
-                if 'timers' in import_data:
-                    for key in import_data['timers']:
-                        if key not in self._data:
-                            continue
-                        ttl = self._data[key]['ttl']
-                        if not ttl:
-                            continue
-                        ttl -= int(time.time() * 1000)
-                        ttl /= 1000.0
-                        if ttl >= 0:
-                            timer = threading.Timer(ttl, self.remove, (key,))
-                            timer.daemon = True
-                            self._timers[key] = timer
-                            timer.start()
-                        else:
-                            self.remove(key)
-
                 if 'commit_log' in import_data:
                     for tran in import_data['commit_log']:
                         self._apply_trans(tran)
 
+        log_path = self._path + '.log'
+        if log_id and os.path.isfile(log_path):
+            self._replaying = True
+            try:
+                with open(log_path, 'r') as log_file:
+                    header = log_file.readline()
+                    if header and json.loads(header).get('log_id') == log_id:
+                        for line in log_file:
+                            try:
+                                name, args, kwargs = json.loads(line)
+                            except ValueError:
+                                break
+                            if name not in LOG_METHODS:
+                                continue
+                            getattr(self, name)(*args, **kwargs)
+            finally:
+                self._replaying = False
+
+        cur_time = int(time.time() * 1000)
+        for key, data in list(self._data.items()):
+            ttl = data['ttl']
+            if not ttl:
+                continue
+            if ttl <= cur_time:
+                self._data.pop(key, None)
+            else:
+                self._schedule_expire(key, ttl)
+
+        self.export_data()
+
 class TunlDBTransaction(object):
     def __init__(self, cache):
         self._cache = cache
@@ -60,6 +60,7 @@ class User(mongo.MongoObject):
         'dns_suffix',
         'port_forwarding',
         'devices',
+        'search_terms',
     }
     fields_default = {
         'name': '',
@@ -118,6 +119,10 @@ class User(mongo.MongoObject):
     def collection(cls):
         return mongo.get_collection('users')
 
+    @cached_static_property
+    def org_collection(cls):
+        return mongo.get_collection('organizations')
+
     @cached_static_property
     def audit_collection(cls):
         return mongo.get_collection('users_audit')
@@ -470,6 +475,49 @@ class User(mongo.MongoObject):
         if block:
             self.load()
 
+    def commit(self, fields=None, spec=None):
+        if isinstance(fields, str):
+            fields = (fields,)
+
+        if fields is None or 'name' in fields or 'email' in fields:
+            search_fields = {}
+            missing = []
+            for field in ('name', 'email'):
+                if field in self.loaded_fields or field in self.__dict__:
+                    search_fields[field] = getattr(self, field)
+                else:
+                    missing.append(field)
+
+            if missing and self.exists:
+                doc = self.collection.find_one({
+                    '_id': self.id,
+                }, missing) or {}
+                for field in missing:
+                    search_fields[field] = doc.get(field)
+                missing = []
+
+            if not missing:
+                self.search_terms = utils.get_search_terms(
+                    search_fields['name'], search_fields['email'])
+                if fields is not None:
+                    fields = set(fields)
+                    fields.add('search_terms')
+
+        response = mongo.MongoObject.commit(self, fields=fields, spec=spec)
+
+        if self.upserted and self.type == CERT_CLIENT:
+            self.inc_org_user_count(1)
+
+        return response
+
+    def inc_org_user_count(self, count, org_id=None):
+        self.org_collection.update_one({
+            '_id': org_id or self.org_id,
+            'user_count': {'$exists': True},
+        }, {'$inc': {
+            'user_count': count,
+        }})
+
     def remove(self):
         self.audit_collection.delete_many({
             'user_id': self.id,
@@ -480,7 +528,15 @@ class User(mongo.MongoObject):
             'org_id': self.org_id,
         })
         self.unassign_ip_addr()
-        mongo.MongoObject.remove(self)
+
+        doc = self.collection.find_one_and_delete({
+            '_id': self.id,
+        }, {
+            'org_id': True,
+            'type': True,
+        })
+        if doc and doc.get('type') == CERT_CLIENT:
+            self.inc_org_user_count(-1, org_id=doc.get('org_id'))
 
     def clear_auth_cache(self):
         self.sso_passcode_cache_collection.delete_many({
@@ -489,9 +545,7 @@ class User(mongo.MongoObject):
         self.sso_push_cache_collection.delete_many({
             'user_id': self.id,
         })
-        self.sso_client_cache_collection.delete_many({
-            'user_id': self.id,
-        })
+        sso.clear_client_cache(self.id)
         messenger.publish('instance', ['user_disconnect', self.id])
 
     def disconnect(self):
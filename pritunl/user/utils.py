@@ -1,6 +1,7 @@
 from pritunl.user.user import User
 
 from pritunl.constants import *
+from pritunl import utils
 
 import threading
 import re
@@ -57,6 +58,8 @@ def reserve_pooled_user(org, name=None, email=None, pin=None, type=CERT_CLIENT,
         doc['client_to_client'] = client_to_client
     if port_forwarding is not None:
         doc['port_forwarding'] = port_forwarding
+    if name is not None or email is not None:
+        doc['search_terms'] = utils.get_search_terms(name, email)
 
     doc = User.collection.find_one_and_update({
         'org_id': org.id,
@@ -70,6 +73,8 @@ def reserve_pooled_user(org, name=None, email=None, pin=None, type=CERT_CLIENT,
 
     if doc:
         usr = User(org=org, doc=doc)
+        if type == CERT_CLIENT:
+            usr.inc_org_user_count(1)
         usr.assign_ip_addr()
         return usr
 
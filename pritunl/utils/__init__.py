@@ -11,6 +11,10 @@ from pritunl.utils.aws import *
 from pritunl.utils.oracle import *
 from pritunl.utils.cloud import *
 from pritunl.utils.sig import *
+from pritunl.utils.keys import *
+from pritunl.utils.wireguard import *
 from pritunl.utils.none_queue import NoneQueue
+from pritunl.utils.network_trie import NetworkTrie
 from pritunl.utils.auth import *
+from pritunl.utils.search import *
 from pritunl.utils.md5_hash import unsafe_md5
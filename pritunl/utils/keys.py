@@ -0,0 +1,44 @@
+from cryptography.hazmat.primitives.asymmetric import x25519
+from cryptography.hazmat.primitives import serialization
+
+import os
+import base64
+import binascii
+
+STATIC_KEY_SIZE = 256
+
+def generate_static_key():
+    # Same format as openvpn --genkey --secret
+    key_hex = binascii.hexlify(os.urandom(STATIC_KEY_SIZE)).decode()
+
+    lines = [
+        '#',
+        '# 2048 bit OpenVPN static key',
+        '#',
+        '-----BEGIN OpenVPN Static key V1-----',
+    ]
+    for i in range(0, len(key_hex), 32):
+        lines.append(key_hex[i:i + 32])
+    lines.append('-----END OpenVPN Static key V1-----')
+
+    return '\n'.join(lines) + '\n'
+
+def generate_wg_private_key():
+    # Clamped the same as wg genkey
+    private_key = bytearray(os.urandom(32))
+    private_key[0] &= 248
+    private_key[31] = (private_key[31] & 127) | 64
+    return base64.b64encode(bytes(private_key)).decode()
+
+def get_wg_public_key(private_key):
+    private_key = x25519.X25519PrivateKey.from_private_bytes(
+        base64.b64decode(private_key))
+    public_key = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw,
+    )
+    return base64.b64encode(public_key).decode()
+
+def generate_wg_key():
+    private_key = generate_wg_private_key()
+    return private_key, get_wg_public_key(private_key)
@@ -1,4 +1,5 @@
 from pritunl.utils.misc import check_output_logged
+from pritunl.utils.network_trie import NetworkTrie
 
 from pritunl.constants import *
 from pritunl import ipaddress
@@ -487,25 +488,70 @@ def del_route6(dst_addr):
     finally:
         _ip_route_lock.release()
 
-def check_network_overlap(test_network, networks):
-    test_net = ipaddress.ip_network(test_network)
-    test_start = test_net.network_address
-    test_end = test_net.broadcast_address
+def _link_index(ifname):
+    index = _ip_route.link_lookup(ifname=ifname)
+    if not index:
+        raise pyroute2.netlink.exceptions.NetlinkError(19,
+            'Interface %s not found' % ifname)
+    return index[0]
 
-    for network in networks:
-        net_start = network.network_address
-        net_end = network.broadcast_address
+def add_link(ifname, kind):
+    _ip_route_lock.acquire()
+    try:
+        _ip_route.link(
+            'add',
+            ifname=ifname,
+            kind=kind,
+        )
+    finally:
+        _ip_route_lock.release()
 
-        if test_start >= net_start and test_start <= net_end:
-            return True
-        elif test_end >= net_start and test_end <= net_end:
-            return True
-        elif net_start >= test_start and net_start <= test_end:
-            return True
-        elif net_end >= test_start and net_end <= test_end:
-            return True
+def del_link(ifname):
+    _ip_route_lock.acquire()
+    try:
+        index = _ip_route.link_lookup(ifname=ifname)
+        if not index:
+            return
+        _ip_route.link(
+            'del',
+            index=index[0],
+        )
+    except pyroute2.netlink.exceptions.NetlinkError as err:
+        if err.code != 19:
+            raise
+    finally:
+        _ip_route_lock.release()
 
-    return False
+def set_link(ifname, **kwargs):
+    _ip_route_lock.acquire()
+    try:
+        _ip_route.link(
+            'set',
+            index=_link_index(ifname),
+            **kwargs
+        )
+    finally:
+        _ip_route_lock.release()
+
+def add_link_address(ifname, addr_cidr):
+    address, prefixlen = addr_cidr.split('/')
+
+    _ip_route_lock.acquire()
+    try:
+        _ip_route.addr(
+            'add',
+            index=_link_index(ifname),
+            family=socket.AF_INET6 if ':' in address else socket.AF_INET,
+            address=address,
+            prefixlen=int(prefixlen),
+        )
+    finally:
+        _ip_route_lock.release()
+
+def check_network_overlap(test_network, networks):
+    if not isinstance(networks, NetworkTrie):
+        networks = NetworkTrie(networks)
+    return networks.overlaps(ipaddress.ip_network(test_network))
 
 def check_network_private(test_network):
     test_net = ipaddress.ip_network(test_network)
@@ -0,0 +1,83 @@
+from pritunl import ipaddress
+
+class NetworkTrie(object):
+    __slots__ = ('_roots', '_counts')
+
+    def __init__(self, networks=None):
+        self._roots = {
+            4: [None, None, False],
+            6: [None, None, False],
+        }
+        self._counts = {
+            4: 0,
+            6: 0,
+        }
+
+        if networks:
+            for network in networks:
+                self.add(network)
+
+    def __len__(self):
+        return self._counts[4] + self._counts[6]
+
+    def add(self, network):
+        if isinstance(network, str):
+            network = ipaddress.ip_network(network)
+
+        node = self._roots[network.version]
+        addr = int(network.network_address)
+        shift = network.max_prefixlen - 1
+
+        for i in range(network.prefixlen):
+            bit = (addr >> (shift - i)) & 1
+            child = node[bit]
+            if child is None:
+                child = [None, None, False]
+                node[bit] = child
+            node = child
+
+        if not node[2]:
+            node[2] = True
+            self._counts[network.version] += 1
+
+    def contains(self, address):
+        if isinstance(address, str):
+            address = ipaddress.ip_address(address)
+
+        if not self._counts[address.version]:
+            return False
+
+        node = self._roots[address.version]
+        addr = int(address)
+        shift = address.max_prefixlen - 1
+
+        for i in range(address.max_prefixlen):
+            if node[2]:
+                return True
+            node = node[(addr >> (shift - i)) & 1]
+            if node is None:
+                return False
+
+        return node[2]
+
+    def overlaps(self, network):
+        if isinstance(network, str):
+            network = ipaddress.ip_network(network)
+
+        if not self._counts[network.version]:
+            return False
+
+        node = self._roots[network.version]
+        addr = int(network.network_address)
+        shift = network.max_prefixlen - 1
+
+        # Nodes only exist on the path to a network so reaching the end
+        # of the prefix means a network is equal to or within it
+        for i in range(network.prefixlen):
+            if node[2]:
+                return True
+            node = node[(addr >> (shift - i)) & 1]
+            if node is None:
+                return False
+
+        return True
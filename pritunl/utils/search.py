@@ -0,0 +1,32 @@
+import re
+
+SEARCH_TERM_LEN = 32
+
+def _get_prefixes(term):
+    term = term[:SEARCH_TERM_LEN]
+    return [term[:i] for i in range(1, len(term) + 1)]
+
+def get_search_terms(name, email=None):
+    terms = set()
+
+    for value in (name, email):
+        if not value:
+            continue
+        value = value.lower()
+
+        terms.update(_get_prefixes(value))
+        for term in re.split('[^a-z0-9]+', value):
+            if term:
+                terms.update(_get_prefixes(term))
+
+    return sorted(terms)
+
+def get_search_query(search):
+    terms = []
+
+    for term in search.lower().split():
+        term = term[:SEARCH_TERM_LEN]
+        if term and term not in terms:
+            terms.append(term)
+
+    return terms
@@ -0,0 +1,204 @@
+import socket
+import threading
+import pyroute2.netlink
+import pyroute2.netlink.generic.wireguard
+
+# Kernel values from uapi/linux/wireguard.h, the pyroute2 constants
+# are offset by one
+WGPEER_F_REMOVE_ME = 1
+WGPEER_F_REPLACE_ALLOWEDIPS = 2
+WG_PEER_BATCH = 50
+
+_wg = None
+_wg_lock = threading.Lock()
+
+def _get_wg():
+    # Created on first use since binding fails until the wireguard
+    # module is loaded
+    global _wg
+    if _wg is None:
+        _wg = pyroute2.netlink.generic.wireguard.WireGuard()
+    return _wg
+
+def _wg_allowed_ips(allowed_ips):
+    attrs = []
+
+    for allowed_ip in allowed_ips:
+        addr, mask = allowed_ip.split('/')
+        family = socket.AF_INET6 if ':' in addr else socket.AF_INET
+
+        attrs.append({'attrs': [
+            ['WGALLOWEDIP_A_FAMILY', family],
+            ['WGALLOWEDIP_A_IPADDR', socket.inet_pton(family, addr)],
+            ['WGALLOWEDIP_A_CIDR_MASK', int(mask)],
+        ]})
+
+    return attrs
+
+def _wg_peer_attrs(peer):
+    public_key, allowed_ips, keepalive = peer
+
+    if allowed_ips is None:
+        return {'attrs': [
+            ['WGPEER_A_PUBLIC_KEY', public_key],
+            ['WGPEER_A_FLAGS', WGPEER_F_REMOVE_ME],
+        ]}
+
+    return {'attrs': [
+        ['WGPEER_A_PUBLIC_KEY', public_key],
+        ['WGPEER_A_FLAGS', WGPEER_F_REPLACE_ALLOWEDIPS],
+        ['WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL', keepalive],
+        ['WGPEER_A_ALLOWEDIPS', _wg_allowed_ips(allowed_ips)],
+    ]}
+
+def _wg_request(interface, attrs):
+    msg = pyroute2.netlink.generic.wireguard.wgmsg()
+    msg['cmd'] = pyroute2.netlink.generic.wireguard.WG_CMD_SET_DEVICE
+    msg['version'] = pyroute2.netlink.generic.wireguard.WG_GENL_VERSION
+    msg['attrs'].append(['WGDEVICE_A_IFNAME', interface])
+    msg['attrs'].extend(attrs)
+
+    _wg_lock.acquire()
+    try:
+        wg = _get_wg()
+        wg.nlm_request(
+            msg,
+            msg_type=wg.prid,
+            msg_flags=pyroute2.netlink.NLM_F_REQUEST |
+                pyroute2.netlink.NLM_F_ACK,
+        )
+    finally:
+        _wg_lock.release()
+
+def wg_set_device(interface, private_key, listen_port):
+    _wg_request(interface, [
+        ['WGDEVICE_A_PRIVATE_KEY', private_key],
+        ['WGDEVICE_A_LISTEN_PORT', listen_port],
+    ])
+
+def wg_set_peers(interface, peers):
+    # Peers are (public_key, allowed_ips, keepalive) with allowed_ips
+    # set to None to remove the peer. All peers are sent in one message.
+    _wg_request(interface, [
+        ['WGDEVICE_A_PEERS', [_wg_peer_attrs(x) for x in peers]],
+    ])
+
+def wg_dump(interface):
+    # Returns the latest handshake time and the received and sent byte
+    # counters of every peer on the interface from a single dump
+    peers = {}
+
+    _wg_lock.acquire()
+    try:
+        msgs = _get_wg().info(interface)
+    finally:
+        _wg_lock.release()
+
+    for msg in msgs:
+        for peer in msg.get_attr('WGDEVICE_A_PEERS') or []:
+            public_key = peer.get_attr('WGPEER_A_PUBLIC_KEY')
+            if not public_key:
+                continue
+            if isinstance(public_key, bytes):
+                public_key = public_key.decode()
+
+            handshake = peer.get_attr('WGPEER_A_LAST_HANDSHAKE_TIME')
+
+            peers[public_key] = (
+                handshake['tv_sec'] if handshake else 0,
+                peer.get_attr('WGPEER_A_RX_BYTES') or 0,
+                peer.get_attr('WGPEER_A_TX_BYTES') or 0,
+            )
+
+    return peers
+
+class WgPeerError(Exception):
+    pass
+
+class WgPeerQueue(object):
+    # Peer changes from concurrent callers are grouped. The first caller
+    # sends everything queued while the others wait for their result, the
+    # changes queued during a send go out together in the next message.
+
+    def __init__(self, interface):
+        self.interface = interface
+        self._lock = threading.Lock()
+        self._pending = []
+        self._sending = False
+
+    def add_peer(self, public_key, allowed_ips, keepalive):
+        self._submit((public_key, allowed_ips, keepalive))
+
+    def remove_peer(self, public_key):
+        self._submit((public_key, None, None))
+
+    def _submit(self, peer):
+        op = [peer, threading.Event(), None]
+
+        self._lock.acquire()
+        try:
+            self._pending.append(op)
+            if self._sending:
+                sender = False
+            else:
+                self._sending = True
+                sender = True
+        finally:
+            self._lock.release()
+
+        if sender:
+            ops = []
+            try:
+                while True:
+                    self._lock.acquire()
+                    try:
+                        ops = self._pending
+                        self._pending = []
+                        if not ops:
+                            self._sending = False
+                            break
+                    finally:
+                        self._lock.release()
+
+                    for i in range(0, len(ops), WG_PEER_BATCH):
+                        self._send(ops[i:i + WG_PEER_BATCH])
+                    ops = []
+            finally:
+                # Release waiting callers if the send was interrupted,
+                # the next caller becomes the sender
+                if ops:
+                    self._lock.acquire()
+                    try:
+                        ops += self._pending
+                        self._pending = []
+                        self._sending = False
+                    finally:
+                        self._lock.release()
+
+                    for pending_op in ops:
+                        if not pending_op[1].is_set():
+                            pending_op[2] = WgPeerError(
+                                'Peer update interrupted')
+                            pending_op[1].set()
+
+        op[1].wait()
+        if op[2] is not None:
+            raise op[2]
+
+    def _send(self, ops):
+        try:
+            wg_set_peers(self.interface, [x[0] for x in ops])
+        except pyroute2.netlink.exceptions.NetlinkError:
+            # Kernel stops at the failed peer, send each peer on its
+            # own to apply the rest and find the failed peer
+            for op in ops:
+                try:
+                    wg_set_peers(self.interface, [op[0]])
+                except Exception as err:
+                    op[2] = err
+        except Exception as err:
+            for op in ops:
+                op[2] = err
+
+        for op in ops:
+            op[1].set()
@@ -0,0 +1,244 @@
+CONF_PATH = '/etc/pritunl.conf'
+SERVER_ID = '5d3b2d405a3d9c0a455b6dbe'
+COUNT = 1000
+CONCURRENCY = 32
+SOCKET_PATH = '/tmp/pritunl_connect_bench.sock'
+
+import os
+import sys
+import time
+import socket
+import threading
+import collections
+import pymongo.monitoring
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', '..'))
+
+import pritunl
+from pritunl.constants import *
+from pritunl import setup
+from pritunl import server
+from pritunl import database
+from pritunl.server.instance_com import ServerInstanceCom
+
+class CommandCounter(pymongo.monitoring.CommandListener):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+
+    def started(self, event):
+        with self.lock:
+            self.counts[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def snapshot(self):
+        with self.lock:
+            return self.counts.copy()
+
+class Noop(object):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+class BenchInstance(object):
+    def __init__(self, svr):
+        self.id = database.ObjectId()
+        self.server = svr
+        self.management_socket_path = SOCKET_PATH
+        self.sock_interrupt = False
+        self.interface = 'tun-bench'
+        self.interface_wg = 'wg-bench'
+        self.iptables = Noop()
+        self.vxlan = None
+        self.wg_public_key = None
+
+    def is_interrupted(self):
+        return self.sock_interrupt
+
+    def stop_process(self):
+        self.sock_interrupt = True
+
+    def connect_wg(self, *args, **kwargs):
+        pass
+
+    def disconnect_wg(self, *args, **kwargs):
+        pass
+
+    def enable_iptables_tun_nat(self):
+        pass
+
+    def reserve_route_advertisement(self, *args, **kwargs):
+        pass
+
+    def tables_add(self, *args, **kwargs):
+        pass
+
+class FakeManagement(object):
+    def __init__(self, users):
+        self.users = users
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.slots = threading.Semaphore(CONCURRENCY)
+        self.pending = {}
+        self.latencies = []
+        self.denied = 0
+        self.done = threading.Event()
+
+    def send(self, data):
+        with self.send_lock:
+            self.conn.sendall(data.encode())
+
+    def send_connect(self, client_id, org_id, user_id):
+        self.send(''.join((
+            '>CLIENT:CONNECT,%d,1\n' % client_id,
+            '>CLIENT:ENV,untrusted_ip=10.%d.%d.%d\n' % (
+                (client_id >> 16) & 255, (client_id >> 8) & 255,
+                client_id & 255),
+            '>CLIENT:ENV,IV_HWADDR=%012x\n' % client_id,
+            '>CLIENT:ENV,IV_PLAT=linux\n',
+            '>CLIENT:ENV,IV_VER=2.6.0\n',
+            '>CLIENT:ENV,UV_ID=%032x\n' % client_id,
+            '>CLIENT:ENV,UV_NAME=bench-%d\n' % client_id,
+            '>CLIENT:ENV,tls_id_0=CN=%s, O=%s\n' % (user_id, org_id),
+            '>CLIENT:ENV,END\n',
+        )))
+
+    def send_established(self, client_id):
+        self.send(''.join((
+            '>CLIENT:ESTABLISHED,%d\n' % client_id,
+            '>CLIENT:ENV,END\n',
+            '>BYTECOUNT_CLI:%d,%d,%d\n' % (client_id, 4096, 8192),
+        )))
+
+    def send_disconnect(self, client_id):
+        self.send(''.join((
+            '>CLIENT:DISCONNECT,%d\n' % client_id,
+            '>CLIENT:ENV,END\n',
+        )))
+
+    def on_response(self, cmd, client_id):
+        start = self.pending.pop(client_id, None)
+        if start is None:
+            return
+
+        self.latencies.append(time.time() - start)
+        if cmd == 'client-deny':
+            self.denied += 1
+        else:
+            self.send_established(client_id)
+        self.slots.release()
+
+        if not self.pending and len(self.latencies) >= len(self.users):
+            self.done.set()
+
+    def read_thread(self):
+        data = b''
+        in_auth = False
+        while True:
+            buf = self.conn.recv(65536)
+            if not buf:
+                return
+            data += buf
+            lines = data.split(b'\n')
+            data = lines.pop()
+            for line in lines:
+                line = line.decode().strip()
+                if in_auth:
+                    if line == 'END':
+                        in_auth = False
+                    continue
+
+                cmd = line.split(' ', 1)[0]
+                if cmd not in ('client-auth', 'client-deny'):
+                    continue
+                if cmd == 'client-auth':
+                    in_auth = True
+
+                self.on_response(cmd, int(line.split(' ')[1]))
+
+    def run(self):
+        if os.path.exists(SOCKET_PATH):
+            os.remove(SOCKET_PATH)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(SOCKET_PATH)
+        sock.listen(1)
+        self.conn, _ = sock.accept()
+
+        thread = threading.Thread(target=self.read_thread)
+        thread.daemon = True
+        thread.start()
+
+        # Wait for the initial bytecount command before starting
+        time.sleep(1.5)
+
+        start = time.time()
+        for i, (org_id, user_id) in enumerate(self.users):
+            self.slots.acquire()
+            client_id = i + 1
+            self.pending[client_id] = time.time()
+            self.send_connect(client_id, org_id, user_id)
+
+        self.done.wait()
+        duration = time.time() - start
+
+        for i in range(len(self.users)):
+            self.send_disconnect(i + 1)
+
+        return duration
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * pct / 100.0))
+    return values[index]
+
+counter = CommandCounter()
+pymongo.monitoring.register(counter)
+
+pritunl.set_conf_path(CONF_PATH)
+setup.setup_db_host()
+
+svr = server.get_by_id(database.ObjectId(SERVER_ID))
+if not svr:
+    raise ValueError('Server not found')
+
+users = []
+for org in svr.iter_orgs():
+    for usr in org.iter_users():
+        if usr.type != CERT_CLIENT or usr.disabled:
+            continue
+        users.append((org.id, usr.id))
+        if len(users) >= COUNT:
+            break
+    if len(users) >= COUNT:
+        break
+
+if not users:
+    raise ValueError('Server has no client users')
+
+fake = FakeManagement(users)
+instance = BenchInstance(svr)
+instance_com = ServerInstanceCom(svr, instance)
+instance_com.start()
+
+counts_start = counter.snapshot()
+duration = fake.run()
+counts = counter.snapshot() - counts_start
+
+time.sleep(2)
+instance.sock_interrupt = True
+
+connects = len(fake.latencies)
+print('connects: %d (%d denied)' % (connects, fake.denied))
+print('connects/sec: %.1f' % (connects / duration))
+print('auth latency p50: %.1fms' % (percentile(fake.latencies, 50) * 1000))
+print('auth latency p99: %.1fms' % (percentile(fake.latencies, 99) * 1000))
+print('mongo commands/connect: %.2f' % (
+    sum(counts.values()) / float(connects)))
+for command_name, count in counts.most_common():
+    print('  %s: %.2f' % (command_name, count / float(connects)))
@@ -0,0 +1,83 @@
+CONF_PATH = '/etc/pritunl.conf'
+TEST_LINK_NAME = 'unittest_topology_link'
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..'))
+
+import pritunl
+from pritunl.constants import *
+from pritunl import setup
+from pritunl import link
+from pritunl.link import topology
+
+class LinkTopologyTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pritunl.set_conf_path(CONF_PATH)
+        setup.setup_db_host()
+
+    def setUp(self):
+        lnk = link.get_by_name(TEST_LINK_NAME)
+        if lnk:
+            lnk.remove()
+
+        self.lnk = link.Link(
+            name=TEST_LINK_NAME,
+            type=SITE_TO_SITE,
+            status=OFFLINE,
+        )
+        self.lnk.commit()
+
+    def tearDown(self):
+        self.lnk.remove()
+        topology.clear(self.lnk.id)
+
+    def test_version_loaded(self):
+        lnk = link.get_by_id(self.lnk.id)
+
+        self.assertEqual(topology.get_version(lnk),
+            self.lnk.topology_version)
+        self.assertGreater(topology.get_version(lnk), 0)
+
+    def test_version_partial_fields(self):
+        lnk = link.get_by_name(TEST_LINK_NAME, fields=('_id', 'name'))
+
+        self.assertEqual(topology.get_version(lnk),
+            self.lnk.topology_version)
+
+    def test_bump_invalidates_loaded_link(self):
+        lnk = link.get_by_id(self.lnk.id)
+        snapshot = topology.get(lnk)
+        self.assertIs(topology.get(lnk), snapshot)
+
+        version = topology.bump(self.lnk.id)
+
+        # Snapshot left in the cache of another process
+        topology._snapshots[self.lnk.id] = snapshot
+
+        lnk = link.get_by_id(self.lnk.id)
+        self.assertEqual(topology.get_version(lnk), version)
+
+        new_snapshot = topology.get(lnk)
+        self.assertIsNot(new_snapshot, snapshot)
+        self.assertEqual(new_snapshot.version, version)
+        self.assertIs(topology.get(lnk), new_snapshot)
+
+    def test_full_commit_keeps_version(self):
+        lnk = link.get_by_id(self.lnk.id)
+        version = topology.bump(self.lnk.id)
+
+        lnk.name = TEST_LINK_NAME
+        lnk.commit()
+
+        self.assertEqual(lnk.topology_version, version + 1)
+        self.assertEqual(topology.get_version(
+            link.get_by_id(self.lnk.id)), version + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import threading
+import unittest
+import http.server
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..'))
+
+from pritunl import settings
+from pritunl import monitoring
+
+class InfluxHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        lines = gzip.decompress(data).decode().splitlines()
+
+        server = self.server
+        server.requests.append((self.path, lines))
+
+        status = server.statuses.pop(0) if server.statuses else 204
+        if status == 204:
+            server.lines.extend(lines)
+
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class MonitoringTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), InfluxHandler)
+        self.server.requests = []
+        self.server.lines = []
+        self.server.statuses = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.temp_dir = tempfile.mkdtemp()
+
+        settings.app.influxdb_url = 'http://127.0.0.1:%s' % (
+            self.server.server_address[1])
+        settings.app.influxdb_org = 'test_org'
+        settings.app.influxdb_bucket = 'test_bucket'
+        settings.app.influxdb_token = 'test_token'
+        settings.app.influxdb_batch_size = 10
+        settings.app.influxdb_queue_size = 50
+        settings.app.influxdb_spool_path = os.path.join(
+            self.temp_dir, 'spool')
+
+        monitoring._queue.clear()
+        for key in monitoring._stats:
+            monitoring._stats[key] = 0
+        monitoring._cur_influxdb_url = None
+        monitoring.connect()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+        settings.app.influxdb_url = None
+        monitoring.connect()
+
+    def insert(self, count):
+        monitoring.insert_points('test', [
+            ({'host': 'test'}, {'value': i}) for i in range(count)])
+
+    def test_write(self):
+        self.insert(25)
+        monitoring.write_queue()
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(self.server.lines), 25)
+        path, lines = self.server.requests[0]
+        self.assertTrue(path.startswith('/api/v2/write?'))
+        self.assertIn('bucket=test_bucket', path)
+        self.assertTrue(lines[0].startswith('pritunl_test,host=test '))
+
+        stats = monitoring.get_stats()
+        self.assertEqual(stats['queued'], 25)
+        self.assertEqual(stats['written'], 25)
+        self.assertEqual(stats['queue_size'], 0)
+
+    def test_retry(self):
+        self.insert(5)
+        self.server.statuses.append(503)
+
+        with self.assertRaises(Exception):
+            monitoring.write_queue()
+        self.assertEqual(monitoring.get_stats()['queue_size'], 5)
+
+        monitoring.write_queue()
+        self.assertEqual(len(self.server.lines), 5)
+        self.assertEqual(monitoring.get_stats()['written'], 5)
+
+    def test_rejected(self):
+        self.insert(5)
+        self.server.statuses.append(400)
+
+        monitoring.write_queue()
+        stats = monitoring.get_stats()
+        self.assertEqual(stats['dropped'], 5)
+        self.assertEqual(stats['written'], 0)
+        self.assertEqual(stats['queue_size'], 0)
+
+    def test_spool(self):
+        self.insert(60)
+
+        stats = monitoring.get_stats()
+        self.assertEqual(stats['spilled'], 10)
+        self.assertEqual(stats['queue_size'], 50)
+        self.assertGreater(stats['spool_size'], 0)
+
+        monitoring.write_queue()
+        stats = monitoring.get_stats()
+        self.assertEqual(len(self.server.lines), 60)
+        self.assertEqual(stats['replayed'], 10)
+        self.assertEqual(stats['spool_size'], 0)
+
+    def test_concurrent_stats(self):
+        threads = [threading.Thread(target=self.insert, args=(5,))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = monitoring.get_stats()
+        self.assertEqual(stats['queued'], 40)
+        self.assertEqual(stats['queue_size'] + stats['spilled'], 40)
+
+
+if __name__ == '__main__':
+    unittest.main()